@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_migrate, post_save
 
 
 class BackendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'backend'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from backend.authentication import forget_user_tokens
+        from backend.search import check_search_version, create_search_table
+        post_migrate.connect(create_search_table, sender=self)
+        post_save.connect(forget_user_tokens, sender=User)
+        checks.register(check_search_version)
@@ -0,0 +1,138 @@
+import hashlib
+import secrets
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from backend.models import AuthToken
+
+TOKEN_KEYWORDS = ('token', 'bearer')
+
+
+def token_digest(key: str) -> str:
+    """
+    SHA-256 вместо PBKDF2: токен случайный и длинный, перебор по хешу бесполезен, а проверка почти бесплатна
+    """
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_key(digest: str) -> str:
+    return f'auth-token:{digest}'
+
+
+def issue_token(user) -> tuple[str, AuthToken]:
+    """
+    Выдает новый токен; сам ключ возвращается один раз и в БД не хранится
+    """
+    key = secrets.token_urlsafe(32)
+    token = AuthToken.objects.create(user=user, digest=token_digest(key),
+                                     expires_at=timezone.now() + timedelta(seconds=settings.AUTH_TOKEN_TTL))
+    return key, token
+
+
+def revoke_token(key: str) -> bool:
+    digest = token_digest(key)
+    caches['auth'].delete(cache_key(digest))
+    deleted, _ = AuthToken.objects.filter(digest=digest).delete()
+    return bool(deleted)
+
+
+def revoke_user_tokens(user) -> int:
+    digests = list(AuthToken.objects.filter(user=user).values_list('digest', flat=True))
+    caches['auth'].delete_many([cache_key(digest) for digest in digests])
+    deleted, _ = AuthToken.objects.filter(user=user).delete()
+    return deleted
+
+
+def forget_user_tokens(sender, instance, **kwargs):
+    """
+    Сбрасывает кэш токенов пользователя после его сохранения: деактивация и изменения видны сразу,
+    а не через AUTH_TOKEN_CACHE_TIMEOUT
+    """
+    digests = AuthToken.objects.filter(user=instance).values_list('digest', flat=True)
+    caches['auth'].delete_many([cache_key(digest) for digest in digests])
+
+
+def cached_user(entry, now):
+    """
+    Пользователь из записи кэша; False - запись есть, но срок токена истек, None - записи нет
+    """
+    if entry is None:
+        return None
+    user, expires_at = entry
+    return user if expires_at > now else False
+
+
+def load_token(digest: str, now):
+    """
+    Ищет действующий токен в БД; результат (пользователь, срок) кладется в кэш не дольше срока токена
+    """
+    token = AuthToken.objects.select_related('user').filter(digest=digest, expires_at__gt=now).first()
+    if token is None or not token.user.is_active:
+        return None
+    timeout = min(settings.AUTH_TOKEN_CACHE_TIMEOUT, (token.expires_at - now).total_seconds())
+    return (token.user, token.expires_at), timeout
+
+
+def lookup_token(key: str):
+    """
+    Пользователь по токену: из кэша 'auth', при промахе — одним запросом к БД. None, если токен недействителен
+    """
+    digest, now = token_digest(key), timezone.now()
+    user = cached_user(caches['auth'].get(cache_key(digest)), now)
+    if user is not None:
+        return user or None
+    loaded = load_token(digest, now)
+    if loaded is None:
+        return None
+    entry, timeout = loaded
+    caches['auth'].set(cache_key(digest), entry, timeout)
+    return entry[0]
+
+
+async def alookup_token(key: str):
+    digest, now = token_digest(key), timezone.now()
+    user = cached_user(await caches['auth'].aget(cache_key(digest)), now)
+    if user is not None:
+        return user or None
+    loaded = await sync_to_async(load_token)(digest, now)
+    if loaded is None:
+        return None
+    entry, timeout = loaded
+    await caches['auth'].aset(cache_key(digest), entry, timeout)
+    return entry[0]
+
+
+def token_from_header(header: bytes | str) -> str | None:
+    """
+    Ключ из заголовка "Authorization: Token <ключ>" (или Bearer); None, если схема другая
+    """
+    if isinstance(header, bytes):
+        header = header.decode('latin-1')
+    parts = header.split()
+    if len(parts) != 2 or parts[0].lower() not in TOKEN_KEYWORDS:
+        return None
+    return parts[1]
+
+
+class TokenAuthentication(BaseAuthentication):
+    """
+    Аутентификация DRF по токену из POST /auth; другие схемы заголовка пропускаются дальше (Basic)
+    """
+
+    def authenticate(self, request):
+        key = token_from_header(get_authorization_header(request))
+        if key is None:
+            return None
+        user = lookup_token(key)
+        if user is None:
+            raise AuthenticationFailed('Токен недействителен или истек')
+        return user, key
+
+    def authenticate_header(self, request):
+        return 'Token'
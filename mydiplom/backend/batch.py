@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from time import perf_counter
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from backend.feed import feed_format, fetch_feed, file_hash, parse_feed_file
+from backend.importer import PriceListImporter
+from backend.models import ImportJob, Shop
+
+BATCH_DOWNLOADS = 8
+
+
+def fetch_source(url: str, headers: dict, directory: str) -> tuple[str, dict, float]:
+    """
+    Скачивает прайс во временный файл каталога directory условным запросом (file:// читается на месте).
+    Возвращает путь, сведения об ответе, как fetch_feed, и время скачивания
+    """
+    started = perf_counter()
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        path = url2pathname(parsed.path)
+        meta = {'status': 200, 'content_type': '', 'etag': '', 'last_modified': '', 'hash': file_hash(path)}
+        return path, meta, perf_counter() - started
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        meta = fetch_feed(url, file, headers)
+    return file.name, meta, perf_counter() - started
+
+
+class BatchImport:
+    """
+    Загрузка многих прайсов: скачивание в потоках, разбор и проверка YAML в пуле процессов (CPU не упирается
+    в GIL), запись в БД - единственным писателем в вызывающем потоке, поэтому прайсы не спорят за блокировки.
+    Пока пишется один прайс, следующие продолжают скачиваться и разбираться. В процессе-демоне (воркер prefork
+    Celery) порождать процессы нельзя, и разбор идет в потоках
+    """
+
+    def __init__(self, jobs: list[ImportJob], processes: int = None, downloads: int = BATCH_DOWNLOADS):
+        self.jobs = jobs
+        self.processes = processes or min(os.cpu_count() or 1, max(len(jobs), 1))
+        self.downloads = downloads
+        self.results = {job.id: {'job': job.id, 'url': job.url, 'rows': 0, 'invalid': 0, 'skipped': '',
+                                 'timings': {}, 'error': ''} for job in jobs}
+        self.metas = {}
+
+    def run(self) -> dict:
+        started = perf_counter()
+        try:
+            self.process()
+        except Exception as e:
+            # задачи, до которых не дошла очередь, не остаются навсегда в скачивании или разборе
+            for job in self.jobs:
+                if job.phase not in ('done', 'failed'):
+                    self.fail(job, e)
+            raise
+        seconds = perf_counter() - started
+        rows = sum(result['rows'] for result in self.results.values())
+        return {
+            'feeds': list(self.results.values()),
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_second': round(rows / seconds, 1) if seconds else 0,
+        }
+
+    def parser_pool(self):
+        if multiprocessing.current_process().daemon:
+            # billiard помечает процессы пула Celery демонами: ProcessPoolExecutor в них падает на AssertionError
+            return ThreadPoolExecutor(self.processes)
+        # spawn: процессы не наследуют соединения с БД и потоки скачивания
+        return ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def process(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                ThreadPoolExecutor(self.downloads) as downloader, \
+                self.parser_pool() as parser:
+            shops = {shop.user_id: shop for shop in Shop.objects.filter(
+                user_id__in=[job.user_id for job in self.jobs if not job.force])}
+            pending = {}
+            for job in self.jobs:
+                job.set_phase('downloading')
+                shop = shops.get(job.user_id) if not job.force else None
+                headers = shop.feed_headers(job.url) if shop else None
+                pending[downloader.submit(fetch_source, job.url, headers, directory)] = ('download', job)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, job = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.fail(job, e)
+                        continue
+                    if stage == 'download':
+                        path, meta, seconds = result
+                        self.results[job.id]['timings']['download'] = round(seconds, 4)
+                        if job.skip_unchanged(shops.get(job.user_id) if not job.force else None, meta):
+                            self.results[job.id]['skipped'] = job.stats['skipped']
+                            continue
+                        self.metas[job.id] = meta
+                        job.set_phase('parsing')
+                        fmt = feed_format(job.url, meta['content_type'])
+                        try:
+                            # процессы пула запускаются при первой отправке
+                            pending[parser.submit(parse_feed_file, path, fmt)] = ('parse', job)
+                        except Exception as e:
+                            self.fail(job, e)
+                    else:
+                        self.write(job, result)
+
+    def write(self, job: ImportJob, parsed: dict):
+        result = self.results[job.id]
+        result['timings']['parse'] = round(parsed['seconds'], 4)
+        result['invalid'] = parsed['invalid']
+        started = perf_counter()
+        try:
+            job.set_phase('importing')
+            importer = PriceListImporter(job.user, mode=job.mode, progress=job.report_progress)
+            stats = importer.run_feed(parsed['shop'], parsed['categories'], parsed['goods'])
+        except Exception as e:
+            self.fail(job, e)
+            return
+        result['timings']['write'] = round(perf_counter() - started, 4)
+        result['rows'] = importer.rows_processed
+        stats['counts']['invalid'] = parsed['invalid']
+        job.set_phase('done', rows_processed=importer.rows_processed, stats=stats,
+                      errors='\n'.join(parsed['errors'] + importer.errors))
+        Shop.remember_feed(job.user, job.url, self.metas.pop(job.id))
+
+    def fail(self, job: ImportJob, error: Exception):
+        self.results[job.id]['error'] = f'{type(error).__name__}: {error}'
+        job.set_phase('failed', errors=self.results[job.id]['error'])
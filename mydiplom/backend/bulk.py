@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+
+def copy_available() -> bool:
+    """
+    COPY доступен на PostgreSQL с драйвером psycopg 3
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def bulk_insert(model, objs: list, key: str = None, batch_size: int = None) -> list:
+    """
+    Вставляет новые строки. На PostgreSQL крупные пакеты пишутся через COPY во временную таблицу
+    и INSERT ... SELECT ... RETURNING, а id вставленных строк сопоставляются объектам по уникальному в пакете
+    полю key. Иначе, как и раньше, bulk_create
+    """
+    if len(objs) < settings.IMPORT_COPY_THRESHOLD or not copy_available():
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+
+    qn = connection.ops.quote_name
+    meta = model._meta
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    table, staging = qn(meta.db_table), qn(f'{meta.db_table}_copy')
+    columns = ', '.join(qn(field.column) for field in fields)
+    returning = f' RETURNING {qn(meta.pk.column)}, {qn(meta.get_field(key).column)}' if key else ''
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS '
+                       f'SELECT {columns} FROM {table} WITH NO DATA')
+        cursor.execute(f'TRUNCATE {staging}')
+        with cursor.copy(f'COPY {staging} ({columns}) FROM STDIN') as copy:
+            for obj in objs:
+                copy.write_row([field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields])
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}{returning}')
+        if key:
+            ids = {value: pk for pk, value in cursor.fetchall()}
+            attname = meta.get_field(key).attname
+            for obj in objs:
+                obj.pk = ids[getattr(obj, attname)]
+                obj._state.adding = False
+                obj._state.db = connection.alias
+    return objs
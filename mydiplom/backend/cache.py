@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+
+CATALOG_CACHE = 'catalog'
+
+
+class CatalogCache:
+    """
+    Кэш сериализованных ответов каталога.
+    Ключ включает версии областей (весь каталог, конкретный магазин); импорт прайса сбрасывает только
+    затронутые области, а вытеснение старых записей выполняет backend (LRU по MAX_ENTRIES и TTL по TIMEOUT).
+    Версии хранятся в том же backend, поэтому при нескольких процессах он должен быть общим (CATALOG_CACHE_URL)
+    """
+
+    def __init__(self, alias: str = CATALOG_CACHE):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self, scope: str) -> int:
+        key = f'version:{scope}'
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def invalidate(self, *scopes: str):
+        for scope in scopes:
+            self.cache.set(f'version:{scope}', time.time_ns(), timeout=None)
+
+    def key(self, name: str, scopes: list[str], params: dict) -> str:
+        versions = ':'.join(f'{scope}={self.version(scope)}' for scope in scopes)
+        query = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+        return f'{name}:{versions}:{hashlib.md5(query.encode()).hexdigest()}'
+
+    def get_or_build(self, name: str, scopes: list[str], params: dict, build):
+        """
+        Возвращает (данные, True) из кэша или (build(), False), сохраняя результат
+        """
+        key = self.key(name, scopes, params)
+        data = self.cache.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is not None:
+            return data, True
+        data = build()
+        self.cache.set(key, data)
+        return data, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'backend': self.cache.__class__.__name__, 'hits': self.hits, 'misses': self.misses}
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models import Manager
+from rest_framework.fields import CharField, ChoiceField, IntegerField, SerializerMethodField, SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.serializers import ListSerializer, Serializer
+
+
+def choice_value(field: ChoiceField):
+    choices = field.choice_strings_to_values
+
+    def convert(value):
+        return value if value == '' else choices.get(str(value), value)
+    return convert
+
+
+# поля, чей to_representation сводится к приведению типа; подклассы с собственным выводом идут общим путем
+CONVERTERS = {
+    IntegerField.to_representation: lambda field: int,
+    CharField.to_representation: lambda field: str,
+    ChoiceField.to_representation: choice_value,
+}
+
+
+def model_field(serializer: Serializer, source: str):
+    """
+    Поле модели ModelSerializer, из которого читается source, или None (свойства, методы, не модельные данные)
+    """
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return None
+    try:
+        return model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return None
+
+
+def generic_reader(field):
+    """
+    Чтение и вывод поля так же, как в Serializer.to_representation: get_attribute может бросить SkipField
+    """
+
+    def read(instance):
+        attribute = field.get_attribute(instance)
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        return None if check_for_none is None else field.to_representation(attribute)
+    return read
+
+
+def compile_converter(field):
+    """
+    Функция значение -> вывод для поля, либо None, если поле нужно выводить общим путем
+    """
+    if isinstance(field, ListSerializer):
+        if type(field).to_representation is not ListSerializer.to_representation:
+            return None
+        child = compile_converter(field.child) or field.child.to_representation
+
+        def convert(data):
+            return [child(item) for item in (data.all() if isinstance(data, Manager) else data)]
+        return convert
+    if isinstance(field, Serializer):
+        if type(field).to_representation not in (Serializer.to_representation,
+                                                 CompiledSerializerMixin.to_representation):
+            return None
+        return compile_serializer(field)
+    factory = CONVERTERS.get(type(field).to_representation)
+    return factory(field) if factory else None
+
+
+def compile_reader(serializer: Serializer, field):
+    """
+    Чтение поля объекта одним getattr с приведением типа вместо get_attribute/to_representation.
+    Отсутствующая связь OneToOne дает None, как в DRF; прочие случаи уходят общим путем
+    """
+    if isinstance(field, SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+    generic = generic_reader(field)
+    if len(field.source_attrs) != 1 or model_field(serializer, field.source) is None:
+        return generic
+    convert = compile_converter(field)
+    if convert is None:
+        return generic
+    attr = field.source
+
+    def read(instance):
+        try:
+            value = getattr(instance, attr)
+        except ObjectDoesNotExist:
+            return None
+        except AttributeError:
+            return generic(instance)
+        return None if value is None else convert(value)
+
+    if not isinstance(field, ListSerializer):
+        return read
+
+    def read_many(instance):
+        # результат prefetch_related берется из кэша объекта без создания менеджера связи
+        prefetched = getattr(instance, '_prefetched_objects_cache', None)
+        if prefetched and attr in prefetched:
+            return convert(prefetched[attr])
+        return read(instance)
+    return read_many
+
+
+def compile_serializer(serializer: Serializer):
+    """
+    Собирает функцию объект -> dict с выводом, совпадающим с serializer.to_representation.
+    Дерево полей обходится один раз на экземпляр сериализатора (для many=True - один раз на список),
+    дальше каждый объект выводится готовыми функциями чтения без поиска и проверки полей
+    """
+    readers = [(field.field_name, compile_reader(serializer, field)) for field in serializer._readable_fields]
+
+    def represent_skipping(instance) -> dict:
+        ret = {}
+        for name, read in readers:
+            try:
+                ret[name] = read(instance)
+            except SkipField:
+                continue
+        return ret
+
+    def represent(instance) -> dict:
+        try:
+            return {name: read(instance) for name, read in readers}
+        except SkipField:
+            # поле без значения и без default (редкий случай) - вывод заново, пропуская такие поля
+            return represent_skipping(instance)
+    return represent
+
+
+class CompiledSerializerMixin:
+    """
+    Вывод через compile_serializer при FAST_SERIALIZERS; иначе - обычный to_representation DRF
+    """
+
+    def to_representation(self, instance):
+        try:
+            represent = self._represent
+        except AttributeError:
+            represent = self._represent = (compile_serializer(self) if settings.FAST_SERIALIZERS
+                                           else super().to_representation)
+        return represent(instance)
@@ -0,0 +1,140 @@
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+import yaml
+from django.db.models import Prefetch
+
+from backend.models import Shop, ProductInfo, ProductParameter, Order, OrderItem
+
+EXPORT_CHUNK_SIZE = 2000
+CATALOG_FORMATS = {'yaml': 'application/x-yaml', 'ndjson': 'application/x-ndjson'}
+ORDER_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+ORDER_COLUMNS = ('order', 'dt', 'status', 'user', 'shop', 'product_info', 'external_id', 'product', 'model',
+                 'quantity', 'price', 'total')
+
+BOOLEANS = {'True': True, 'False': False}
+
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def parameter_value(value: str, number: float | None):
+    """
+    Числа и флаги возвращаются как в исходном прайсе (512, 6.5, true), остальное - строкой ("2688x1242")
+    """
+    if number is None:
+        return BOOLEANS.get(value, value)
+    number = int(number) if number.is_integer() else number
+    return number if str(number) == value else value
+
+
+def catalog_header(shop: Shop) -> dict:
+    return {'shop': shop.name,
+            'categories': [{'id': pk, 'name': name}
+                           for pk, name in shop.categories.order_by('id').values_list('id', 'name')]}
+
+
+def chunk_parameters(info_ids: list[int]) -> dict[int, dict]:
+    parameters = defaultdict(dict)
+    for info_id, name, value, number in ProductParameter.objects.filter(product_info_id__in=info_ids).order_by(
+            'id').values_list('product_info_id', 'parameter__name', 'value', 'value_num'):
+        parameters[info_id][name] = parameter_value(value, number)
+    return parameters
+
+
+def catalog_goods(shop: Shop, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Товары магазина в схеме data/shop1.yaml пачками по chunk_size: iterator() читает строки порциями,
+    а параметры подгружаются одним запросом на порцию, поэтому память не зависит от размера каталога.
+    values_list вместо моделей: на выгрузке большую часть времени съедало создание объектов
+    """
+    infos = ProductInfo.objects.filter(shop=shop).order_by('id').values_list(
+        'id', 'external_id', 'product__category_id', 'model', 'product__name', 'price', 'price_rrc', 'quantity')
+    for chunk in chunks(infos.iterator(chunk_size=chunk_size), chunk_size):
+        parameters = chunk_parameters([row[0] for row in chunk])
+        yield [{
+            'id': external_id,
+            'category': category_id,
+            'model': model,
+            'name': name,
+            'price': price,
+            'price_rrc': price_rrc,
+            'quantity': quantity,
+            'parameters': parameters.get(info_id, {}),
+        } for info_id, external_id, category_id, model, name, price, price_rrc, quantity in chunk]
+
+
+def iter_catalog(shop: Shop, fmt: str = 'yaml', chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Прайс магазина для StreamingHttpResponse: заголовок отдается до чтения товаров, дальше по строке на порцию.
+    Результат снова загружается через PartnerUpdate
+    """
+    header = catalog_header(shop)
+    if fmt == 'ndjson':
+        yield json.dumps(header, ensure_ascii=False) + '\n'
+        for goods in catalog_goods(shop, chunk_size):
+            yield ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in goods)
+        return
+    yield yaml.dump(header, Dumper=YamlDumper, allow_unicode=True, sort_keys=False) + 'goods:\n'
+    for goods in catalog_goods(shop, chunk_size):
+        yield yaml.dump(goods, Dumper=YamlDumper, allow_unicode=True, sort_keys=False)
+
+
+class Echo:
+    """
+    Буфер для csv.writer: строка возвращается сразу, без накопления
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_orders_csv(orders, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Строки заказов, по строке CSV на позицию: values() без создания моделей, порциями через iterator()
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_COLUMNS)
+    items = OrderItem.objects.filter(order__in=orders).order_by('order_id', 'id').values_list(
+        'order_id', 'order__dt', 'order__status', 'order__user__username', 'shop__name', 'product_info_id',
+        'product_info__external_id', 'product_info__product__name', 'product_info__model', 'quantity',
+        'product_info__price')
+    for chunk in chunks(items.iterator(chunk_size=chunk_size), chunk_size):
+        yield ''.join(writer.writerow((row[0], row[1].isoformat(), *row[2:], row[9] * (row[10] or 0)))
+                      for row in chunk)
+
+
+def order_document(order: Order) -> dict:
+    items = [{
+        'product_info': item.product_info_id,
+        'external_id': item.product_info.external_id if item.product_info else None,
+        'product': item.product_info.product.name if item.product_info else None,
+        'shop': item.shop.name if item.shop else None,
+        'quantity': item.quantity,
+        'price': item.product_info.price if item.product_info else None,
+        'total': item.quantity * item.product_info.price if item.product_info else 0,
+    } for item in order.ordered_items.all()]
+    return {'id': order.id, 'dt': order.dt.isoformat(), 'status': order.status,
+            'user': order.user.username if order.user else None,
+            'items': items, 'total': sum(item['total'] for item in items)}
+
+
+def iter_orders_ndjson(orders, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Заказ целиком на строку NDJSON; позиции, магазины и продукты подгружаются отдельными запросами на порцию
+    """
+    orders = orders.select_related('user').order_by('id').prefetch_related(
+        Prefetch('ordered_items', queryset=OrderItem.objects.select_related('product_info__product', 'shop')))
+    for chunk in chunks(orders.iterator(chunk_size=chunk_size), chunk_size):
+        yield ''.join(json.dumps(order_document(order), ensure_ascii=False) + '\n' for order in chunk)
+
+
+def iter_orders(orders, fmt: str = 'csv', chunk_size: int = EXPORT_CHUNK_SIZE):
+    return iter_orders_ndjson(orders, chunk_size) if fmt == 'ndjson' else iter_orders_csv(orders, chunk_size)
@@ -0,0 +1,72 @@
+import re
+
+from django.db.models import Count, Exists, OuterRef, QuerySet
+from rest_framework.exceptions import ValidationError
+
+from backend.models import Parameter, ProductInfo, ProductParameter
+
+CONDITION_RE = re.compile(r'^(?P<name>.+?)\s*(?P<op>>=|<=|!=|>|<|=)\s*(?P<value>.*)$')
+NUMERIC_LOOKUPS = {'>=': 'gte', '<=': 'lte', '>': 'gt', '<': 'lt'}
+
+
+def parse_conditions(raw: list[str]) -> list[tuple[str, str, str]]:
+    """
+    Разбирает условия вида "Встроенная память (Гб)>=256" или "Цвет=черный"
+    """
+    conditions = []
+    for item in raw:
+        match = CONDITION_RE.match(item.strip())
+        if not match:
+            raise ValidationError({'p': f'Неверное условие: {item}'})
+        conditions.append((match['name'].strip(), match['op'], match['value'].strip()))
+    return conditions
+
+
+def condition_filter(parameter_id: int, op: str, value: str):
+    """
+    Полусоединение с product_parameter по составному индексу (parameter, value_num | value, product_info)
+    """
+    number = ProductParameter.parse_number(value)
+    if op in NUMERIC_LOOKUPS:
+        if number is None:
+            raise ValidationError({'p': f'Для сравнения {op} нужно числовое значение: {value}'})
+        lookup = {f'value_num__{NUMERIC_LOOKUPS[op]}': number}
+    elif number is not None:
+        lookup = {'value_num': number}
+    else:
+        lookup = {'value': value}
+    exists = Exists(ProductParameter.objects.filter(product_info_id=OuterRef('pk'), parameter_id=parameter_id,
+                                                    **lookup))
+    return ~exists if op == '!=' else exists
+
+
+def filter_product_infos(queryset: QuerySet, conditions: list[tuple[str, str, str]]) -> QuerySet:
+    names = {name for name, _, _ in conditions}
+    parameters = dict(Parameter.objects.filter(name__in=names).values_list('name', 'id'))
+    if unknown := names - parameters.keys():
+        raise ValidationError({'p': f'Неизвестные параметры: {", ".join(sorted(unknown))}'})
+    for name, op, value in conditions:
+        queryset = queryset.filter(condition_filter(parameters[name], op, value))
+    return queryset
+
+
+def facet_counts(queryset: QuerySet) -> dict[str, list[dict]]:
+    """
+    Количество подходящих позиций для каждого значения каждого параметра (один запрос)
+    """
+    rows = (ProductParameter.objects.filter(product_info__in=queryset.order_by().values('id'))
+            .order_by().values('parameter__name', 'value').annotate(count=Count('product_info_id', distinct=True))
+            .order_by('parameter__name', '-count', 'value'))
+    facets = {}
+    for row in rows:
+        facets.setdefault(row['parameter__name'], []).append({'value': row['value'], 'count': row['count']})
+    return facets
+
+
+def search_product_infos(raw_conditions: list[str], limit: int, offset: int = 0) -> dict:
+    queryset = filter_product_infos(ProductInfo.objects.all(), parse_conditions(raw_conditions))
+    return {
+        'count': queryset.count(),
+        'results': queryset.select_related('product', 'shop').order_by('price', 'id')[offset:offset + limit],
+        'facets': facet_counts(queryset),
+    }
@@ -0,0 +1,256 @@
+import hashlib
+import io
+import json
+import tempfile
+import threading
+from itertools import chain
+from time import perf_counter
+
+import httpx
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from yaml.events import MappingStartEvent, MappingEndEvent, SequenceStartEvent, SequenceEndEvent
+
+FEED_CHUNK_SIZE = 64 * 1024
+FEED_SPOOL_SIZE = 8 * 1024 * 1024
+FEED_TIMEOUT = httpx.Timeout(30, connect=10)
+FEED_REQUEST_TIMEOUT = (10, 60)
+FEED_POOL_SIZE = 16
+FEED_SEQUENCES = ('categories', 'goods')
+FEED_REQUIRED = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity')
+FEED_MAX_ERRORS = 20
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Файловый интерфейс поверх итератора байтовых блоков (например, response.iter_content)
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def feed_format(url: str, content_type: str = '') -> str:
+    if 'ndjson' in content_type or url.rsplit('?', 1)[0].endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'yaml'
+
+
+def construct_entry(loader: yaml.SafeLoader):
+    node = loader.compose_node(None, None)
+    value = loader.construct_object(node, deep=True)
+    loader.constructed_objects = {}
+    loader.recursive_objects = {}
+    return value
+
+
+def iter_yaml_feed(stream):
+    """
+    Событийный разбор YAML (и JSON) прайса: записи categories и goods строятся по одной
+    """
+    loader = yaml.SafeLoader(stream)
+    try:
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise ValueError('Прайс должен быть словарем с ключами shop, categories и goods')
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            key = construct_entry(loader)
+            if key in FEED_SEQUENCES and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield key, construct_entry(loader)
+                loader.get_event()
+            else:
+                yield key, construct_entry(loader)
+    finally:
+        loader.dispose()
+
+
+def iter_ndjson_feed(stream):
+    """
+    Разбор NDJSON прайса: первая строка {"shop": ..., "categories": [...]}, далее по товару на строку
+    """
+    lines = (line for line in io.TextIOWrapper(stream, encoding='utf-8') if line.strip())
+    header = json.loads(next(lines, '{}'))
+    yield 'shop', header.get('shop')
+    for category in header.get('categories', []):
+        yield 'categories', category
+    for line in lines:
+        yield 'goods', json.loads(line)
+
+
+def read_feed(chunks, fmt: str = 'yaml'):
+    """
+    Читает заголовок прайса и возвращает (shop, categories, goods), где goods - ленивый итератор
+    """
+    stream = io.BufferedReader(ChunkStream(chunks), FEED_CHUNK_SIZE)
+    entries = iter_ndjson_feed(stream) if fmt == 'ndjson' else iter_yaml_feed(stream)
+    shop, categories = None, []
+    for key, value in entries:
+        if key == 'shop':
+            shop = value
+        elif key == 'categories':
+            categories.append(value)
+        elif key == 'goods':
+            return shop, categories, chain([value], (value for key, value in entries if key == 'goods'))
+    return shop, categories, iter(())
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def feed_session() -> requests.Session:
+    """
+    Общая сессия с пулом keep-alive соединений и повтором при обрывах и 502/503/504: прайсы одного
+    поставщика и пакетная загрузка не открывают соединение (и TLS) заново на каждый запрос
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods={'GET'})
+            adapter = HTTPAdapter(pool_connections=FEED_POOL_SIZE, pool_maxsize=FEED_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def feed_meta(response, digest=None) -> dict:
+    """
+    Что нужно сохранить о прайсе для следующего условного запроса
+    """
+    return {
+        'status': response.status_code,
+        'content_type': response.headers.get('Content-Type', ''),
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+        'hash': digest.hexdigest() if digest else '',
+    }
+
+
+def fetch_feed(url: str, body, headers: dict = None) -> dict:
+    """
+    Скачивает прайс в файл body, считая SHA-256 содержимого. На 304 Not Modified тело пустое
+    """
+    with feed_session().get(url, headers=headers, stream=True, timeout=FEED_REQUEST_TIMEOUT) as response:
+        if response.status_code == 304:
+            return feed_meta(response)
+        response.raise_for_status()
+        digest = hashlib.sha256()
+        for chunk in response.iter_content(FEED_CHUNK_SIZE):
+            digest.update(chunk)
+            body.write(chunk)
+        return feed_meta(response, digest)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter_file(file):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def download_feed(url: str, headers: dict = None) -> tuple:
+    """
+    Асинхронно скачивает прайс во временный файл (до FEED_SPOOL_SIZE в памяти), не занимая поток сервера.
+    Возвращает файл, перемотанный в начало (None на 304), и сведения об ответе, как fetch_feed
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=FEED_SPOOL_SIZE)
+    try:
+        async with httpx.AsyncClient(timeout=FEED_TIMEOUT, follow_redirects=True) as client:
+            async with client.stream('GET', url, headers=headers) as response:
+                if response.status_code == 304:
+                    body.close()
+                    return None, feed_meta(response)
+                response.raise_for_status()
+                digest = hashlib.sha256()
+                async for chunk in response.aiter_bytes(FEED_CHUNK_SIZE):
+                    digest.update(chunk)
+                    body.write(chunk)
+                meta = feed_meta(response, digest)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body, meta
+
+
+def iter_file(file):
+    while chunk := file.read(FEED_CHUNK_SIZE):
+        yield chunk
+
+
+def validate_item(item, category_ids: set) -> str | None:
+    """
+    Причина, по которой товар не может быть загружен, или None
+    """
+    if not isinstance(item, dict):
+        return 'товар должен быть словарем'
+    missing = [key for key in FEED_REQUIRED if key not in item]
+    if missing:
+        return f'нет полей {", ".join(missing)}'
+    for key in ('id', 'price', 'price_rrc', 'quantity'):
+        if not isinstance(item[key], int) or isinstance(item[key], bool) or item[key] < 0:
+            return f'{key} должно быть неотрицательным целым'
+    if category_ids and item['category'] not in category_ids:
+        return f'категория {item["category"]} не описана в прайсе'
+    if not isinstance(item['name'], str) or not item['name'] or len(item['name']) > 255:
+        return 'name должно быть непустой строкой до 255 символов'
+    if len(str(item['model'])) > 80:
+        return 'model длиннее 80 символов'
+    if not isinstance(item.get('parameters', {}), dict):
+        return 'parameters должно быть словарем'
+    return None
+
+
+def parse_feed_file(path: str, fmt: str = 'yaml') -> dict:
+    """
+    Разбор и проверка прайса из файла для пула процессов: не обращается к Django и БД, результат -
+    готовые к записи shop, categories и goods. Неверные товары пропускаются и попадают в errors
+    """
+    started = perf_counter()
+    with open(path, 'rb') as file:
+        if fmt == 'yaml':
+            # товары все равно целиком уходят писателю, поэтому вместо потокового разбора - libyaml
+            data = yaml.load(file, Loader=YamlLoader)
+            if not isinstance(data, dict):
+                raise ValueError('Прайс должен быть словарем с ключами shop, categories и goods')
+            shop, categories, items = data.get('shop'), data.get('categories') or [], data.get('goods') or []
+        else:
+            shop, categories, items = read_feed(iter_file(file), fmt)
+        category_ids = {category['id'] for category in categories}
+        goods, errors, invalid = [], [], 0
+        for index, item in enumerate(items):
+            error = validate_item(item, category_ids)
+            if error is None:
+                goods.append(item)
+                continue
+            invalid += 1
+            if len(errors) < FEED_MAX_ERRORS:
+                item_id = item.get('id') if isinstance(item, dict) else None
+                errors.append(f'Товар {item_id if item_id is not None else f"#{index + 1}"}: {error}')
+    return {'shop': shop, 'categories': categories, 'goods': goods, 'invalid': invalid, 'errors': errors,
+            'seconds': perf_counter() - started}
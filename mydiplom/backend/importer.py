@@ -0,0 +1,286 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.db import transaction
+
+from backend.bulk import bulk_insert
+from backend.cache import catalog_cache
+from backend.search import get_search_index
+from backend.models import Shop, Category, ProductInfo, Product, ProductParameter, Parameter, ProductOffer
+
+
+def chunked(items, size):
+    """
+    Разбивает последовательность на списки длиной не более size
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PriceListImporter:
+    """
+    Класс для загрузки прайса поставщика пакетными запросами
+    """
+    batch_size = 1000
+    modes = ('sync', 'replace')
+    info_fields = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, user, batch_size: int = None, mode: str = 'sync', progress=None):
+        if mode not in self.modes:
+            raise ValueError(f'Неизвестный режим загрузки: {mode}')
+        self.user = user
+        self.mode = mode
+        self.progress = progress
+        self.rows_processed = 0
+        if batch_size:
+            self.batch_size = batch_size
+        self.timings = {}
+        self.counts = {}
+        self.shop = None
+        self.errors = []
+        self.category_ids = {}
+        self._parameters = {}
+        self._seen = set()
+        self.touched = set()
+        self.offer_products = set()
+        self.search_changed = set()
+        self.search_deleted = set()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + perf_counter() - started
+
+    def count(self, name: str, value: int):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def touch_shop(self):
+        """
+        Отмечает изменение набора позиций магазина для сброса кэша каталога
+        """
+        self.touched.add(f'shop:{self.shop.id}')
+
+    def report(self, rows: int):
+        self.rows_processed += rows
+        if self.progress:
+            self.progress(self.rows_processed)
+
+    def stats(self) -> dict:
+        return {
+            'timings': {name: round(value, 4) for name, value in self.timings.items()},
+            'counts': self.counts,
+        }
+
+    def run(self, data: dict) -> dict:
+        return self.run_feed(data['shop'], data.get('categories', []), data.get('goods', []))
+
+    def run_feed(self, shop: str, categories: list[dict], goods) -> dict:
+        """
+        Загружает прайс; goods может быть ленивым итератором и читается пакетами по batch_size
+        """
+        if not shop:
+            raise ValueError('В прайсе не указан магазин')
+        with self.phase('total'), transaction.atomic():
+            self.import_shop(shop)
+            self.import_categories(categories)
+            if self.mode == 'replace':
+                with self.phase('cleanup'):
+                    infos = ProductInfo.objects.filter(shop_id=self.shop.id)
+                    for pk, product_id in infos.order_by().values_list('id', 'product_id'):
+                        self.search_deleted.add(pk)
+                        self.offer_products.add(product_id)
+                    deleted, _ = infos.delete()
+                    self.count('deleted', deleted)
+                    self.touch_shop()
+            for batch in chunked(goods, self.batch_size):
+                self.sync_goods(batch)
+                self.report(len(batch))
+            if self.mode == 'sync':
+                self.delete_stale()
+            self.refresh_offers()
+            with self.phase('search'):
+                get_search_index().sync(self.search_changed, self.search_deleted)
+            touched = sorted(self.touched)
+            transaction.on_commit(lambda: catalog_cache.invalidate(*touched))
+        return self.stats()
+
+    def import_shop(self, name: str):
+        with self.phase('shop'):
+            self.shop, _ = Shop.objects.get_or_create(name=name, user_id=self.user.id)
+
+    def import_categories(self, categories: list[dict]):
+        """
+        Создает недостающие категории и связывает их с магазином. Название категории уникально: если оно уже
+        занято другим id, товары прайса относятся к существующей категории, а конфликт попадает в errors
+        """
+        with self.phase('categories'):
+            names = {category['id']: category['name'] for category in categories}
+            self.category_ids = {pk: pk for pk in Category.objects.filter(id__in=names).values_list('id', flat=True)}
+            missing = [Category(id=pk, name=name) for pk, name in names.items() if pk not in self.category_ids]
+            if missing:
+                taken = dict(Category.objects.filter(name__in=[category.name for category in missing])
+                             .values_list('name', 'id'))
+                Category.objects.bulk_create([category for category in missing if category.name not in taken])
+                for category in missing:
+                    self.category_ids[category.id] = taken.get(category.name, category.id)
+                    if category.name in taken:
+                        self.errors.append(f'Категория {category.id} "{category.name}" уже есть с id '
+                                           f'{taken[category.name]}: товары отнесены к ней')
+                if taken:
+                    self.count('category_conflicts', len(taken))
+            through = Category.shops.through
+            ids = set(self.category_ids.values())
+            linked = set(through.objects.filter(shop_id=self.shop.id, category_id__in=ids)
+                         .values_list('category_id', flat=True))
+            links = [through(category_id=pk, shop_id=self.shop.id) for pk in ids if pk not in linked]
+            through.objects.bulk_create(links, ignore_conflicts=True)
+            if missing or links:
+                self.touched.add('catalog')
+            self.count('categories', len(names))
+
+    def resolve_products(self, goods: list[dict]) -> dict:
+        """
+        Возвращает словарь {название продукта: id}, создавая недостающие продукты
+        """
+        with self.phase('products'):
+            categories = {item['name']: item['category'] for item in goods}
+            products = dict(Product.objects.filter(name__in=categories).values_list('name', 'id'))
+            missing = [Product(name=name, category_id=self.category_ids.get(category_id, category_id))
+                       for name, category_id in categories.items() if name not in products]
+            if missing:
+                Product.objects.bulk_create(missing, ignore_conflicts=True)
+                products.update(Product.objects.filter(name__in=[product.name for product in missing])
+                                .values_list('name', 'id'))
+                self.count('products_created', len(missing))
+                self.touched.add('catalog')
+        return products
+
+    def resolve_parameters(self, goods: list[dict]) -> dict:
+        """
+        Возвращает словарь {имя параметра: id}, создавая недостающие параметры
+        """
+        with self.phase('parameters'):
+            names = {name for item in goods for name in item.get('parameters', {})} - self._parameters.keys()
+            if names:
+                self._parameters.update(Parameter.objects.filter(name__in=names).values_list('name', 'id'))
+                missing = names - self._parameters.keys()
+                if missing:
+                    Parameter.objects.bulk_create([Parameter(name=name) for name in missing], ignore_conflicts=True)
+                    self._parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+                    self.count('parameters_created', len(missing))
+        return self._parameters
+
+    def build_product_info(self, item: dict, products: dict) -> ProductInfo:
+        return ProductInfo(product_id=products[item['name']],
+                           external_id=item['id'],
+                           model=item['model'],
+                           price=item['price'],
+                           price_rrc=item['price_rrc'],
+                           quantity=item['quantity'],
+                           shop_id=self.shop.id)
+
+    def sync_goods(self, goods: list[dict]):
+        """
+        Сравнивает пакет товаров с текущими позициями магазина и записывает только изменения.
+        В режиме replace позиции магазина уже удалены, и пакет целиком уходит в bulk_create
+        """
+        goods = list({item['id']: item for item in goods}.values())
+        products = self.resolve_products(goods)
+        parameters = self.resolve_parameters(goods)
+
+        with self.phase('product_infos'):
+            existing = {info.external_id: info for info in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[item['id'] for item in goods]).order_by()}
+            created, changed, changed_fields = [], [], set()
+            for item in goods:
+                new = self.build_product_info(item, products)
+                info = existing.get(item['id'])
+                if info is None:
+                    created.append((item, new))
+                    continue
+                self._seen.add(info.id)
+                fields = [field for field in self.info_fields if getattr(info, field) != getattr(new, field)]
+                if {'product_id', 'price', 'quantity'} & set(fields):
+                    self.offer_products.update((info.product_id, new.product_id))
+                if {'product_id', 'model'} & set(fields):
+                    self.search_changed.add(info.id)
+                if fields:
+                    for field in fields:
+                        setattr(info, field, getattr(new, field))
+                    changed.append(info)
+                    changed_fields.update(fields)
+            bulk_insert(ProductInfo, [new for _, new in created], key='external_id')
+            if changed:
+                ProductInfo.objects.bulk_update(changed, sorted(changed_fields))
+            self._seen.update(new.id for _, new in created)
+            if created:
+                self.touch_shop()
+            self.offer_products.update(new.product_id for _, new in created)
+            self.search_changed.update(new.id for _, new in created)
+            self.count('created', len(created))
+            self.count('updated', len(changed))
+            self.count('unchanged', len(existing) - len(changed))
+
+        with self.phase('product_parameters'):
+            current = {}
+            for product_parameter in ProductParameter.objects.filter(product_info__in=existing.values()):
+                current.setdefault(product_parameter.product_info_id, {})[product_parameter.parameter_id] = \
+                    product_parameter
+            to_create, to_update, to_delete = [], [], []
+            pairs = [(item, existing[item['id']]) for item in goods if item['id'] in existing] + created
+            for item, info in pairs:
+                old = current.get(info.id, {})
+                new = {parameters[name]: str(value) for name, value in item.get('parameters', {}).items()}
+                for parameter_id, value in new.items():
+                    product_parameter = old.get(parameter_id)
+                    if product_parameter is None:
+                        to_create.append(ProductParameter.build(info.id, parameter_id, value))
+                    elif product_parameter.value != value:
+                        product_parameter.set_value(value)
+                        to_update.append(product_parameter)
+                to_delete.extend(product_parameter.id for parameter_id, product_parameter in old.items()
+                                 if parameter_id not in new)
+            bulk_insert(ProductParameter, to_create, batch_size=self.batch_size)
+            if to_update:
+                ProductParameter.objects.bulk_update(to_update, ['value', 'value_num'], batch_size=self.batch_size)
+            if to_delete:
+                ProductParameter.objects.filter(id__in=to_delete).delete()
+            self.count('product_parameters_created', len(to_create))
+            self.count('product_parameters_updated', len(to_update))
+            self.count('product_parameters_deleted', len(to_delete))
+
+    def delete_stale(self):
+        """
+        Удаляет позиции магазина, которых нет в новом прайсе
+        """
+        with self.phase('cleanup'):
+            stale = []
+            for pk, product_id in ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', 'product_id'):
+                if pk not in self._seen:
+                    stale.append(pk)
+                    self.offer_products.add(product_id)
+                    self.search_deleted.add(pk)
+            for batch in chunked(stale, self.batch_size):
+                ProductInfo.objects.filter(id__in=batch).delete()
+            self.count('deleted', len(stale))
+            if stale:
+                self.touch_shop()
+
+    def refresh_offers(self):
+        """
+        Пересчитывает сводки предложений только для продуктов, чьи позиции изменились
+        """
+        with self.phase('offers'):
+            changed = ProductOffer.refresh(self.offer_products)
+            self.count('offers', changed)
+            if changed:
+                self.touched.add('catalog')
@@ -0,0 +1,138 @@
+import json
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter
+from backend.models import Contact, Order, OrderItem, ProductInfo
+from backend.synthetic import synthetic_feed
+
+OPERATIONS = ('import', 'reimport', 'catalog', 'cart_add', 'cart_confirm', 'order_history')
+CART_LINES = 20
+HISTORY_ORDERS = 50
+
+
+def compare(baseline: dict, results: dict, threshold: float, slack: float = 0.005) -> list[str]:
+    """
+    Регрессии относительно базовой линии: рост времени больше чем на threshold (и больше slack секунд)
+    или любой рост числа SQL-запросов
+    """
+    regressions = []
+    for size, operations in results.items():
+        for name, current in operations.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            if current['queries'] > base['queries']:
+                regressions.append(f'{name} [{size}]: запросов {base["queries"]} -> {current["queries"]}')
+            if current['seconds'] > base['seconds'] * (1 + threshold) and \
+                    current['seconds'] - base['seconds'] > slack:
+                regressions.append(f'{name} [{size}]: время {base["seconds"]:.4f} -> {current["seconds"]:.4f} с')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Замеряет загрузку прайса, каталог, корзину, подтверждение и историю заказов на синтетических '
+            'прайсах нескольких размеров во временной БД; сравнивает с базовой линией JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,5000', help='Товаров в прайсе магазина, через запятую')
+        parser.add_argument('--shops', type=int, default=2)
+        parser.add_argument('--categories', type=int, default=5)
+        parser.add_argument('--parameters', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--baseline', default='benchmarks/baseline.json')
+        parser.add_argument('--save', action='store_true', help='Записать результаты как новую базовую линию')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Допустимый рост времени, доля')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(ALLOWED_HOSTS=['*'],
+                                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+                results = {str(size): self.run_size(size, options) for size in sizes}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{"операция":<16}' + ''.join(f'{size:>22}' for size in results))
+        for name in OPERATIONS:
+            cells = ''.join(f'{result["seconds"] * 1000:>12.1f} мс {result["queries"]:>4} q'
+                            for result in (results[size][name] for size in results))
+            self.stdout.write(f'{name:<16}{cells}')
+
+        baseline_path = Path(options['baseline'])
+        if options['save']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+            self.stdout.write(f'Базовая линия записана в {baseline_path}')
+        elif baseline_path.exists():
+            regressions = compare(json.loads(baseline_path.read_text(encoding='utf-8')), results,
+                                  options['threshold'])
+            if regressions:
+                raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'Регрессий относительно {baseline_path} нет'))
+
+    def measure(self, action, repeat: int = 1, before=None) -> dict:
+        """
+        Медиана времени и максимум SQL-запросов за repeat запусков; before выполняется вне замера
+        """
+        timings, queries = [], 0
+        for _ in range(repeat):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as captured:
+                started = perf_counter()
+                action()
+                timings.append(perf_counter() - started)
+            queries = max(queries, len(captured))
+        return {'seconds': round(statistics.median(timings), 6), 'queries': queries}
+
+    def run_size(self, size: int, options: dict) -> dict:
+        call_command('flush', interactive=False, verbosity=0)
+        caches['catalog'].clear()
+        repeat = options['repeat']
+        feeds = [(User.objects.create_user(username=f'supplier{shop}'),
+                  synthetic_feed(shop, options['categories'], size, options['parameters']))
+                 for shop in range(1, options['shops'] + 1)]
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        Contact.objects.create(user=buyer, type='address', value='Москва')
+        client = APIClient()
+        client.force_authenticate(buyer)
+
+        def import_feeds():
+            for supplier, feed in feeds:
+                PriceListImporter(supplier).run(feed)
+
+        def request(method: str, name: str, data=None, expected: int = 200):
+            response = getattr(client, method)(reverse(name), data, format='json' if method == 'post' else None)
+            if response.status_code != expected:
+                raise CommandError(f'{name}: {response.status_code} {response.content[:200]}')
+
+        results = {'import': self.measure(import_feeds), 'reimport': self.measure(import_feeds)}
+        infos = list(ProductInfo.objects.filter(quantity__gte=repeat * 2).values('id', 'shop_id')[:CART_LINES])
+        lines = {'product_info_ids': [{'id': info['id'], 'shop_id': info['shop_id'], 'quantity': 1}
+                                      for info in infos]}
+        results['catalog'] = self.measure(lambda: request('get', 'products', {'page_size': 50}), repeat,
+                                          before=caches['catalog'].clear)
+        results['cart_add'] = self.measure(lambda: request('post', 'add-products', lines), repeat,
+                                           before=lambda: Order.objects.filter(status='cart').delete())
+        results['cart_confirm'] = self.measure(
+            lambda: request('post', 'order-cart-confirm', {'address': 'address'}, expected=201), repeat,
+            before=lambda: request('post', 'add-products', lines))
+
+        orders = Order.objects.bulk_create([Order(user=buyer, status='confirmed') for _ in range(HISTORY_ORDERS)])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info_id=info['id'], shop_id=info['shop_id'],
+                                                 quantity=1) for order in orders for info in infos[:3]])
+        results['order_history'] = self.measure(lambda: request('get', 'order-list', {'page_size': 20}), repeat)
+        return results
@@ -0,0 +1,64 @@
+import base64
+import statistics
+from time import perf_counter, process_time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from backend.authentication import issue_token
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стоимость запроса к корзине с HTTP Basic (PBKDF2 на каждый запрос) и с токеном '
+            'во временной БД: время CPU, общее время и SQL-запросы на запрос')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(ALLOWED_HOSTS=['*']):
+                results = self.run(options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{"схема":<8}{"CPU, мс":>12}{"время, мс":>12}{"запросов":>10}')
+        for scheme, result in results.items():
+            self.stdout.write(f'{scheme:<8}{result["cpu"] * 1000:>12.2f}{result["wall"] * 1000:>12.2f}'
+                              f'{result["queries"]:>10}')
+        self.stdout.write(f'Токен быстрее по CPU в {results["basic"]["cpu"] / results["token"]["cpu"]:.1f} раз')
+
+    def run(self, count: int) -> dict:
+        user = User.objects.create_user(username='buyer', password='password')
+        key, _ = issue_token(user)
+        caches['auth'].clear()
+        headers = {
+            'basic': 'Basic ' + base64.b64encode(b'buyer:password').decode(),
+            'token': f'Token {key}',
+        }
+        client = APIClient()
+        return {scheme: self.measure(client, header, count) for scheme, header in headers.items()}
+
+    def measure(self, client: APIClient, header: str, count: int) -> dict:
+        """
+        Медианы CPU и общего времени на запрос и максимум SQL-запросов; первый запрос прогревает кэш
+        """
+        cpu, wall, queries = [], [], 0
+        client.get(reverse('order-cart'), HTTP_AUTHORIZATION=header)
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                started, started_cpu = perf_counter(), process_time()
+                response = client.get(reverse('order-cart'), HTTP_AUTHORIZATION=header)
+                cpu.append(process_time() - started_cpu)
+                wall.append(perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'{response.status_code} {response.content[:200]}')
+            queries = max(queries, len(captured))
+        return {'cpu': statistics.median(cpu), 'wall': statistics.median(wall), 'queries': queries}
@@ -0,0 +1,142 @@
+import os
+import random
+import tempfile
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from backend.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+
+MODELS = (User, Shop, Category, Product, ProductInfo, Order, OrderItem, Contact)
+# составные индексы и ограничения горячих путей, которых нет в исходной схеме
+HOT_PATH_NAMES = {'order_user_status_idx', 'unique_order_cart', 'unique_order_item',
+                  'unique_product_info_external_id', 'unique_contact'}
+
+
+@contextmanager
+def without_hot_path_indexes():
+    """
+    Временно убирает из _meta моделей составные индексы и ограничения, чтобы построить схему "до"
+    """
+    saved = [(model._meta, model._meta.indexes, model._meta.constraints) for model in MODELS]
+    try:
+        for meta, indexes, constraints in saved:
+            meta.indexes = [index for index in indexes if index.name not in HOT_PATH_NAMES]
+            meta.constraints = [constraint for constraint in constraints if constraint.name not in HOT_PATH_NAMES]
+        yield
+    finally:
+        for meta, indexes, constraints in saved:
+            meta.indexes, meta.constraints = indexes, constraints
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает планы и время горячих запросов на схеме без составных индексов и с ними'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=20, help='Заказов на пользователя')
+        parser.add_argument('--shops', type=int, default=20)
+        parser.add_argument('--goods', type=int, default=5000, help='Позиций на магазин')
+        parser.add_argument('--repeat', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        labels = {'before': True, 'after': False}
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                for label, strip in labels.items():
+                    connections.settings[label] = {**connections.settings['default'], 'TEST': {},
+                                                   'NAME': os.path.join(directory, f'{label}.sqlite3')}
+                    self.create_schema(label, strip)
+                    self.seed(label, random.Random(options['seed']), options)
+                results = {label: self.measure(label, random.Random(options['seed']), options) for label in labels}
+            finally:
+                for label in labels.keys() & connections.settings.keys():
+                    connections[label].close()
+                    del connections[label]
+                    del connections.settings[label]
+
+        self.stdout.write(f'\n{"запрос":<20}{"до, мкс":>12}{"после, мкс":>12}{"ускорение":>12}')
+        for name, before in results['before'].items():
+            after = results['after'][name]
+            self.stdout.write(f'{name:<20}{before:>12.1f}{after:>12.1f}{before / after:>11.1f}x')
+
+    def create_schema(self, alias: str, strip: bool):
+        with without_hot_path_indexes() if strip else nullcontext():
+            with connections[alias].schema_editor() as editor:
+                for model in MODELS:
+                    editor.create_model(model)
+
+    def seed(self, alias: str, rnd: random.Random, options: dict):
+        users, shops, goods = options['users'], options['shops'], options['goods']
+        User.objects.using(alias).bulk_create(
+            [User(id=pk, username=f'user{pk}', email=f'user{pk}@example.com') for pk in range(1, users + 1)],
+            batch_size=1000)
+        Shop.objects.using(alias).bulk_create([Shop(id=pk, name=f'Магазин {pk}', user_id=pk)
+                                               for pk in range(1, shops + 1)])
+        Category.objects.using(alias).create(id=1, name='Категория')
+        Product.objects.using(alias).bulk_create([Product(id=pk, name=f'Товар {pk}', category_id=1)
+                                                  for pk in range(1, goods + 1)], batch_size=1000)
+        ProductInfo.objects.using(alias).bulk_create(
+            [ProductInfo(shop_id=shop, product_id=external_id, external_id=external_id, model='', quantity=10,
+                         price=100, price_rrc=100)
+             for shop in range(1, shops + 1) for external_id in range(1, goods + 1)], batch_size=1000)
+
+        orders = []
+        for user in range(1, users + 1):
+            orders.append(Order(user_id=user, status='cart'))
+            orders.extend(Order(user_id=user, status=rnd.choice(('confirmed', 'canceled')))
+                          for _ in range(options['orders'] - 1))
+        Order.objects.using(alias).bulk_create(orders, batch_size=1000)
+        infos = shops * goods
+        items = [OrderItem(order_id=order, product_info_id=product_info, quantity=1)
+                 for order in range(1, len(orders) + 1) for product_info in rnd.sample(range(1, infos + 1), 3)]
+        OrderItem.objects.using(alias).bulk_create(items, batch_size=1000)
+        Contact.objects.using(alias).bulk_create(
+            [Contact(user_id=user, type=contact_type, value=f'{contact_type}-{user}')
+             for user in range(1, users + 1) for contact_type in ('phone', 'address', 'email')], batch_size=1000)
+        connections[alias].cursor().execute('ANALYZE')
+
+    def queries(self, alias: str, rnd: random.Random, options: dict) -> dict:
+        """
+        Горячие запросы в том виде, в каком их строят представления и загрузчик прайса
+        """
+        users, shops, goods = options['users'], options['shops'], options['goods']
+        orders = users * options['orders']
+        return {
+            'корзина': lambda: Order.objects.using(alias).filter(
+                user_id=rnd.randint(1, users), status='cart')[:1],
+            'история заказов': lambda: Order.objects.using(alias).filter(
+                user_id=rnd.randint(1, users)).order_by('-dt', '-id')[:20],
+            'строка корзины': lambda: OrderItem.objects.using(alias).filter(
+                order_id=rnd.randint(1, orders), product_info_id=rnd.randint(1, shops * goods)).order_by(),
+            'сверка прайса': lambda: ProductInfo.objects.using(alias).filter(
+                shop_id=rnd.randint(1, shops), external_id__in=rnd.sample(range(1, goods + 1), 50)).order_by(),
+            'контакт': lambda: Contact.objects.using(alias).filter(
+                user_id=rnd.randint(1, users), type='phone', value='phone-1').order_by(),
+        }
+
+    def measure(self, alias: str, rnd: random.Random, options: dict) -> dict:
+        """
+        Печатает план каждого запроса и возвращает среднее время выполнения SQL в микросекундах
+        """
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Схема {alias}'))
+        timings = {}
+        connection = connections[alias]
+        connection.ensure_connection()
+        for name, build in self.queries(alias, rnd, options).items():
+            self.stdout.write(f'{name}:\n  ' + build().explain().replace('\n', '\n  '))
+            # время меряется на DB-API соединении, чтобы накладные расходы ORM не заслоняли разницу планов
+            statements = [build().query.sql_with_params() for _ in range(options['repeat'])]
+            statements = [(sql.replace('%s', '?'), params) for sql, params in statements]
+            best = None
+            for _ in range(3):
+                started = perf_counter()
+                for sql, params in statements:
+                    connection.connection.execute(sql, params).fetchall()
+                elapsed = perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best / options['repeat'] * 1e6
+        return timings
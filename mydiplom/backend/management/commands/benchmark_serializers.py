@@ -0,0 +1,87 @@
+import statistics
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from backend.importer import PriceListImporter
+from backend.models import Order, OrderItem, Product, ProductInfo
+from backend.prefetch import plan_queryset
+from backend.renderers import UJSONRenderer
+from backend.serializers import OrderSerializer, ProductSerializer
+from backend.synthetic import synthetic_feed
+
+ORDER_LINES = 3
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает на 1000 объектов обычный вывод DRF и собранные сериализаторы (ProductSerializer, '
+            'OrderSerializer с позициями), а также JSONRenderer и UJSONRenderer во временной БД; '
+            'проверяет, что ответы совпадают байт в байт')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=1000, help='Продуктов и заказов')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self.run(options['objects'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{"на 1000 объектов":<24}{"DRF, мс":>12}{"быстрый, мс":>14}{"ускорение":>12}')
+        for name, (slow, fast) in results.items():
+            self.stdout.write(f'{name:<24}{slow * 1000:>12.2f}{fast * 1000:>14.2f}{slow / fast:>11.1f}x')
+
+    def run(self, count: int, repeat: int) -> dict:
+        for shop in (1, 2):
+            PriceListImporter(User.objects.create_user(username=f'supplier{shop}')).run(
+                synthetic_feed(shop, goods=count))
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        infos = list(ProductInfo.objects.values_list('id', 'shop_id')[:ORDER_LINES * 10])
+        orders = Order.objects.bulk_create([Order(user=buyer, status='confirmed') for _ in range(count)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_info_id=info_id, shop_id=shop_id, quantity=index + 1)
+            for number, order in enumerate(orders)
+            for index, (info_id, shop_id) in enumerate(infos[number % 10 * ORDER_LINES:][:ORDER_LINES])])
+
+        # объекты загружаются заранее: замеряется только вывод, без SQL
+        products = list(plan_queryset(Product.objects.order_by('id'), ProductSerializer)[:count])
+        orders = list(plan_queryset(Order.objects.order_by('id'), OrderSerializer))
+        scale = 1000 / count
+        results = {}
+        for name, serializer, objects in (('products', ProductSerializer, products),
+                                          ('orders', OrderSerializer, orders)):
+            with override_settings(FAST_SERIALIZERS=False):
+                slow, data = self.measure(lambda: serializer(objects, many=True).data, repeat)
+            fast, fast_data = self.measure(lambda: serializer(objects, many=True).data, repeat)
+            self.check_same(name, JSONRenderer().render(data), JSONRenderer().render(fast_data))
+            results[f'{name}: сериализация'] = (slow * scale, fast * scale)
+
+            slow, body = self.measure(lambda: JSONRenderer().render(data), repeat)
+            fast, fast_body = self.measure(lambda: UJSONRenderer().render(data), repeat)
+            self.check_same(name, body, fast_body)
+            results[f'{name}: JSON'] = (slow * scale, fast * scale)
+        return results
+
+    @staticmethod
+    def measure(action, repeat: int) -> tuple[float, object]:
+        """
+        Медиана времени за repeat запусков и результат последнего
+        """
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            result = action()
+            timings.append(perf_counter() - started)
+        return statistics.median(timings), result
+
+    @staticmethod
+    def check_same(name: str, expected: bytes, actual: bytes):
+        if expected != actual:
+            raise CommandError(f'{name}: быстрый вывод отличается от DRF')
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.export import CATALOG_FORMATS, EXPORT_CHUNK_SIZE, ORDER_FORMATS, iter_catalog, iter_orders
+from backend.models import Shop, Order
+
+
+class Command(BaseCommand):
+    help = ('Выгружает прайс магазина в схеме data/shop1.yaml (YAML/NDJSON) или заказы (CSV/NDJSON) '
+            'потоком, порциями по --chunk-size строк')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('catalog', 'orders'))
+        parser.add_argument('--shop', help='ID или название магазина (для catalog)')
+        parser.add_argument('--user', help='Только заказы пользователя (для orders)')
+        parser.add_argument('--status', help='Только заказы в статусе (для orders)')
+        parser.add_argument('--format', help='yaml/ndjson для catalog, csv/ndjson для orders')
+        parser.add_argument('--output', help='Файл; по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['kind'] == 'catalog':
+            chunks = self.catalog(options)
+        else:
+            chunks = self.orders(options)
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+        self.stderr.write(f'Выгрузка записана в {options["output"]}')
+
+    def catalog(self, options: dict):
+        fmt = options['format'] or 'yaml'
+        if fmt not in CATALOG_FORMATS:
+            raise CommandError(f'Неизвестный формат выгрузки прайса: {fmt}')
+        if not options['shop']:
+            raise CommandError('Укажите --shop')
+        lookup = {'id': options['shop']} if options['shop'].isdigit() else {'name': options['shop']}
+        shop = Shop.objects.filter(**lookup).first()
+        if shop is None:
+            raise CommandError(f'Магазин {options["shop"]} не найден')
+        return iter_catalog(shop, fmt, options['chunk_size'])
+
+    def orders(self, options: dict):
+        fmt = options['format'] or 'csv'
+        if fmt not in ORDER_FORMATS:
+            raise CommandError(f'Неизвестный формат выгрузки заказов: {fmt}')
+        orders = Order.objects.exclude(status='cart')
+        if options['user']:
+            orders = orders.filter(user__username=options['user'])
+        if options['status']:
+            orders = orders.filter(status=options['status'])
+        return iter_orders(orders, fmt, options['chunk_size'])
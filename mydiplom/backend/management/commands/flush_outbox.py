@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from backend.notifications import flush_outbox
+
+
+class Command(BaseCommand):
+    help = ('Отправляет очередь писем, включая отложенные после ошибки; для cron, когда Celery beat не запущен '
+            '(например, без брокера)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Писем за одно SMTP-соединение')
+
+    def handle(self, *args, **options):
+        result = flush_outbox(options['batch_size'])
+        retry = f', следующий повтор через {result["retry_in"]:.0f} с' if result['retry_in'] is not None else ''
+        self.stdout.write(f'Отправлено писем: {result["sent"]}{retry}')
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from backend.synthetic import synthetic_feed, write_feed
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетические прайсы магазинов в схеме data/shop1.yaml'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='feeds', help='Каталог для файлов прайсов')
+        parser.add_argument('--shops', type=int, default=3)
+        parser.add_argument('--categories', type=int, default=5, help='Категорий в прайсе')
+        parser.add_argument('--goods', type=int, default=1000, help='Товаров в прайсе магазина')
+        parser.add_argument('--parameters', type=int, default=4, help='Параметров у товара')
+        parser.add_argument('--format', choices=('yaml', 'ndjson'), default='yaml')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+        for shop in range(1, options['shops'] + 1):
+            feed = synthetic_feed(shop, options['categories'], options['goods'], options['parameters'],
+                                  options['seed'])
+            path = output / f'shop{shop}.{options["format"]}'
+            with path.open('w', encoding='utf-8') as stream:
+                write_feed(feed, stream, options['format'])
+            self.stdout.write(f'{path}: {len(feed["goods"])} товаров')
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.batch import BATCH_DOWNLOADS, BatchImport
+from backend.importer import PriceListImporter
+from backend.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = ('Пакетная загрузка прайсов: источники вида <username>=<url или путь к файлу>; скачивание '
+            'параллельно, разбор в пуле процессов, запись в БД одним писателем')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='*', help='<username>=<url или путь>')
+        parser.add_argument('--manifest', help='Файл со строками "<username> <url или путь>"')
+        parser.add_argument('--mode', choices=PriceListImporter.modes, default='sync')
+        parser.add_argument('--processes', type=int, help='Процессов разбора; по умолчанию по числу CPU')
+        parser.add_argument('--force', action='store_true', help='Загрузить даже неизменившиеся прайсы')
+        parser.add_argument('--downloads', type=int, default=BATCH_DOWNLOADS, help='Одновременных скачиваний')
+
+    def handle(self, *args, **options):
+        sources = [source.split('=', 1) for source in options['sources']]
+        if options['manifest']:
+            lines = Path(options['manifest']).read_text(encoding='utf-8').splitlines()
+            sources += [line.split(None, 1) for line in lines if line.strip() and not line.startswith('#')]
+        if not sources or any(len(source) != 2 for source in sources):
+            raise CommandError('Укажите источники в виде <username>=<url или путь>')
+
+        users = User.objects.in_bulk({username for username, _ in sources}, field_name='username')
+        unknown = sorted({username for username, _ in sources} - users.keys())
+        if unknown:
+            raise CommandError(f'Пользователи не найдены: {", ".join(unknown)}')
+        jobs = ImportJob.objects.bulk_create([
+            ImportJob(user=users[username], url=self.source_url(source.strip()), mode=options['mode'],
+                      force=options['force']) for username, source in sources])
+
+        report = BatchImport(jobs, options['processes'], options['downloads']).run()
+        self.stdout.write(f'{"задача":>8} {"строк":>8} {"неверных":>9} {"скачивание":>11} {"разбор":>8} '
+                          f'{"запись":>8}  источник')
+        for feed in report['feeds']:
+            timings = ''.join(f'{feed["timings"].get(name, 0):>{width}.2f} '
+                              for name, width in (('download', 11), ('parse', 8), ('write', 8)))
+            note = feed['error'] or (f'пропущен: {feed["skipped"]}' if feed['skipped'] else '')
+            self.stdout.write(f'{feed["job"]:>8} {feed["rows"]:>8} {feed["invalid"]:>9} {timings} {feed["url"]}'
+                              + (f'\n{"":>9}{note}' if note else ''))
+        failed = sum(1 for feed in report['feeds'] if feed['error'])
+        skipped = sum(1 for feed in report['feeds'] if feed['skipped'])
+        self.stdout.write(f'Прайсов: {len(jobs)}, без изменений: {skipped}, с ошибкой: {failed}; '
+                          f'строк: {report["rows"]} за {report["seconds"]:.2f} с '
+                          f'({report["rows_per_second"]:.0f} строк/с)')
+
+    @staticmethod
+    def source_url(source: str) -> str:
+        if '://' in source:
+            return source
+        path = Path(source).resolve()
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {source}')
+        return path.as_uri()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SHOP_FEED = Path(settings.BASE_DIR).parent / 'data' / 'shop1.yaml'
+
+
+class SlowFeedHandler(BaseHTTPRequestHandler):
+    """
+    Отдает прайс с задержкой, имитируя медленный сервер поставщика
+    """
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = SHOP_FEED.read_bytes()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-yaml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера (WSGI или ASGI): N запросов с заданной параллельностью. '
+            'С --feed-delay поднимает медленный сервер прайса и подставляет его адрес вместо {feed} в --data')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', default='/api/v1/async/upload')
+        parser.add_argument('--method', default='POST')
+        parser.add_argument('--data', default='{"url": "{feed}"}', help='Тело запроса JSON')
+        parser.add_argument('--user', help='Пользователь для HTTP Basic')
+        parser.add_argument('--password')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--feed-delay', type=float, default=None, help='Задержка ответа сервера прайса, с')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        feed_server = None
+        data = options['data']
+        if options['feed_delay'] is not None:
+            feed_server = ThreadingHTTPServer(('127.0.0.1', 0), SlowFeedHandler)
+            feed_server.delay = options['feed_delay']
+            feed_server.daemon_threads = True
+            threading.Thread(target=feed_server.serve_forever, daemon=True).start()
+            data = data.replace('{feed}', f'http://127.0.0.1:{feed_server.server_port}/shop1.yaml')
+        try:
+            latencies, statuses, elapsed = asyncio.run(self.run(options, json.loads(data) if data else None))
+        finally:
+            if feed_server is not None:
+                feed_server.shutdown()
+                feed_server.server_close()
+
+        latencies.sort()
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f'Запросов: {len(latencies)}, параллельно: {options["concurrency"]}, '
+                          f'время: {elapsed:.2f} с, {len(latencies) / elapsed:.1f} запр/с')
+        self.stdout.write(f'Задержка, мс: p50 {percentile(0.5):.0f}, p95 {percentile(0.95):.0f}, '
+                          f'p99 {percentile(0.99):.0f}, max {latencies[-1] * 1000:.0f}')
+        self.stdout.write(f'Ответы: {dict(sorted(statuses.items()))}')
+
+    async def run(self, options: dict, body) -> tuple[list[float], Counter, float]:
+        latencies, statuses = [], Counter()
+        auth = (options['user'], options['password']) if options['user'] else None
+        limits = httpx.Limits(max_connections=options['concurrency'])
+        queue = asyncio.Queue()
+        for _ in range(options['requests']):
+            queue.put_nowait(None)
+
+        async def worker(client: httpx.AsyncClient):
+            while not queue.empty():
+                queue.get_nowait()
+                started = perf_counter()
+                try:
+                    response = await client.request(options['method'], options['path'], json=body)
+                    statuses[str(response.status_code)] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(perf_counter() - started)
+
+        async with httpx.AsyncClient(base_url=options['url'], auth=auth, limits=limits,
+                                     timeout=options['timeout']) as client:
+            started = perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(options['concurrency'])))
+        return latencies, statuses, perf_counter() - started
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.orders import rebuild_shop_lines
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет строки заказов поставщиков (ShopOrderLine) по оформленным заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = rebuild_shop_lines(options['chunk_size'])
+        self.stdout.write(f'Строк заказов поставщиков: {count}')
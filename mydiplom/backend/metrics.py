@@ -0,0 +1,206 @@
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PLACEHOLDER_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+current_request: ContextVar['RequestMetrics | None'] = ContextVar('current_request', default=None)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class CounterMetric(Metric):
+    type = 'counter'
+
+    def inc(self, labels: tuple, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def exposition(self) -> list[str]:
+        return self.header() + [f'{self.name}{format_labels(self.labels, labels)} {value}'
+                                for labels, value in sorted(self.values.items())]
+
+
+class HistogramMetric(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, labels: tuple, value: float):
+        counts = self.values.get(labels)
+        if counts is None:
+            # счетчики по корзинам (последняя — +Inf) и сумма наблюдений
+            counts = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        counts[0][bisect_left(self.buckets, value)] += 1
+        counts[1] += value
+
+    def exposition(self) -> list[str]:
+        lines = self.header()
+        for labels, (buckets, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), buckets):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в памяти; при нескольких процессах сервера каждый отдает свои
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = CounterMetric('http_requests_total', 'Запросы по представлениям',
+                                      ('view', 'method', 'status'))
+        self.latency = HistogramMetric('http_request_duration_seconds', 'Время обработки запроса',
+                                       ('view', 'method'))
+        self.render = HistogramMetric('http_response_render_seconds', 'Время рендеринга ответа (JSON)',
+                                      ('view', 'method'))
+        self.response_size = HistogramMetric('http_response_size_bytes', 'Размер тела ответа',
+                                             ('view', 'method'), SIZE_BUCKETS)
+        self.queries = HistogramMetric('db_queries_per_request', 'SQL-запросов на один HTTP-запрос',
+                                       ('view', 'method'), QUERY_BUCKETS)
+        self.query_time = CounterMetric('db_query_duration_seconds_total', 'Суммарное время SQL-запросов',
+                                        ('view', 'method'))
+        self.n_plus_one = CounterMetric('db_n_plus_one_total', 'Запросы с повторяющейся формой SQL (N+1)',
+                                        ('view', 'method'))
+        self.metrics = (self.requests, self.latency, self.render, self.response_size, self.queries,
+                        self.query_time, self.n_plus_one)
+
+    def record(self, request_metrics: 'RequestMetrics', status: int, size: int | None):
+        labels = (request_metrics.view, request_metrics.method)
+        with self._lock:
+            self.requests.inc((*labels, status))
+            self.latency.observe(labels, request_metrics.duration)
+            if request_metrics.render_duration is not None:
+                self.render.observe(labels, request_metrics.render_duration)
+            if size is not None:
+                self.response_size.observe(labels, size)
+            self.queries.observe(labels, request_metrics.query_count)
+            self.query_time.inc(labels, request_metrics.query_time)
+            if request_metrics.repeated:
+                self.n_plus_one.inc(labels)
+
+    def exposition(self) -> str:
+        with self._lock:
+            return '\n'.join(line for metric in self.metrics for line in metric.exposition()) + '\n'
+
+    def reset(self):
+        with self._lock:
+            for metric in self.metrics:
+                metric.values.clear()
+
+
+registry = MetricsRegistry()
+
+
+def sql_shape(sql: str) -> str:
+    """
+    Форма запроса без числа параметров в IN (...): такие запросы, повторенные в цикле, — признак N+1
+    """
+    return PLACEHOLDER_LIST_RE.sub('(%s...)', sql)
+
+
+class RequestMetrics:
+    """
+    Замеры одного HTTP-запроса; SQL попадает сюда и из потоков sync_to_async, куда копируется контекст
+    """
+
+    def __init__(self, method: str):
+        self.method = method
+        self.view = 'unmatched'
+        self.started = perf_counter()
+        self.view_finished = None
+        self.duration = None
+        self.query_count = 0
+        self.query_time = 0.0
+        self.shapes = Counter()
+        self.repeated = {}
+
+    @property
+    def render_duration(self) -> float | None:
+        if self.view_finished is None:
+            return None
+        return self.started + self.duration - self.view_finished
+
+    def add_query(self, sql: str, elapsed: float):
+        self.query_count += 1
+        self.query_time += elapsed
+        self.shapes[sql_shape(sql)] += 1
+
+    def finish(self, n_plus_one_threshold: int):
+        self.duration = perf_counter() - self.started
+        self.repeated = {shape: count for shape, count in self.shapes.items() if count >= n_plus_one_threshold}
+        for shape, count in self.repeated.items():
+            logger.warning('Возможный N+1 в %s %s: %d одинаковых запросов: %s', self.method, self.view, count, shape)
+
+    def server_timing(self) -> str:
+        parts = [f'total;dur={self.duration * 1000:.1f}',
+                 f'db;dur={self.query_time * 1000:.1f};desc="{self.query_count} queries"']
+        if self.view_finished is not None:
+            parts.append(f'render;dur={self.render_duration * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.add_query(sql, perf_counter() - started)
+
+
+def install_query_wrapper(connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def enable_query_metrics():
+    """
+    Подключает обертку SQL ко всем соединениям, включая открываемые позже в других потоках
+    """
+    connection_created.connect(install_query_wrapper, dispatch_uid='backend.metrics')
+    for connection in connections.all(initialized_only=True):
+        install_query_wrapper(connection)
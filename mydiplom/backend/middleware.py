@@ -0,0 +1,66 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from backend.metrics import RequestMetrics, current_request, enable_query_metrics, registry
+
+
+class PerformanceMiddleware:
+    """
+    Замеры запросов: время, SQL (число, время, повторы формы — N+1), время рендеринга и размер ответа.
+    При METRICS_ENABLED=False исключается из цепочки и ничего не стоит
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = settings.METRICS_SERVER_TIMING
+        self.n_plus_one_threshold = settings.METRICS_N_PLUS_ONE_THRESHOLD
+        enable_query_metrics()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    def start(self, request):
+        request_metrics = RequestMetrics(request.method)
+        request.metrics = request_metrics
+        return request_metrics, current_request.set(request_metrics)
+
+    def process_template_response(self, request, response):
+        """
+        Ответы DRF рендерятся после представления: отсюда отсчитывается время рендеринга
+        """
+        request.metrics.view_finished = perf_counter()
+        return response
+
+    def finish(self, request, response, request_metrics: RequestMetrics):
+        if request.resolver_match is not None:
+            request_metrics.view = request.resolver_match.route or request.resolver_match.view_name
+        request_metrics.finish(self.n_plus_one_threshold)
+        size = None if response.streaming else len(response.content)
+        registry.record(request_metrics, response.status_code, size)
+        if self.server_timing:
+            response['Server-Timing'] = request_metrics.server_timing()
+        return response
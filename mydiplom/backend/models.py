@@ -1,3 +1,6 @@
+import math
+
+from django.core.cache import caches
 from django.db import models
 from django.contrib.auth.models import AbstractUser, User
 
@@ -7,6 +10,21 @@ statuses_order = (
     ('canceled', 'Отменен'),
 )
 
+import_phases = (
+    ('queued', 'В очереди'),
+    ('downloading', 'Загрузка'),
+    ('parsing', 'Разбор'),
+    ('importing', 'Запись'),
+    ('done', 'Завершено'),
+    ('failed', 'Ошибка'),
+)
+
+email_statuses = (
+    ('pending', 'В очереди'),
+    ('sending', 'Отправляется'),
+    ('failed', 'Не отправлено'),
+)
+
 
 class Shop(models.Model):
     class Meta:
@@ -17,10 +35,45 @@ class Shop(models.Model):
     name = models.CharField(max_length=255, verbose_name='Название', null=False, blank=True)
     user = models.OneToOneField(User, verbose_name='Пользователь', blank=True, null=True, on_delete=models.CASCADE)
     url = models.URLField(verbose_name='Ссылка')
+    # сведения о последнем загруженном с url прайсе: условный запрос и пропуск неизменившегося содержимого
+    feed_etag = models.CharField(verbose_name='ETag прайса', max_length=255, blank=True)
+    feed_last_modified = models.CharField(verbose_name='Last-Modified прайса', max_length=64, blank=True)
+    feed_hash = models.CharField(verbose_name='SHA-256 прайса', max_length=64, blank=True)
 
     def __str__(self):
         return f'{self.name}'
 
+    def feed_headers(self, url: str) -> dict:
+        """
+        Заголовки If-None-Match / If-Modified-Since, если прайс с этой ссылки уже загружался
+        """
+        headers = {}
+        if url == self.url and self.feed_etag:
+            headers['If-None-Match'] = self.feed_etag
+        if url == self.url and self.feed_last_modified:
+            headers['If-Modified-Since'] = self.feed_last_modified
+        return headers
+
+    def feed_unchanged(self, url: str, meta: dict) -> str | None:
+        """
+        Причина пропустить загрузку: 'not_modified' (ответ 304) или 'unchanged' (тот же SHA-256), иначе None
+        """
+        if url != self.url:
+            return None
+        if meta['status'] == 304:
+            return 'not_modified'
+        if self.feed_hash and meta['hash'] == self.feed_hash:
+            return 'unchanged'
+        return None
+
+    @classmethod
+    def remember_feed(cls, user, url: str, meta: dict):
+        """
+        Запоминается после успешной загрузки, чтобы неудачная не помешала повторить ее
+        """
+        cls.objects.filter(user=user).update(url=url, feed_etag=meta['etag'],
+                                             feed_last_modified=meta['last_modified'], feed_hash=meta['hash'])
+
 
 class Category(models.Model):
     class Meta:
@@ -57,6 +110,9 @@ class ProductInfo(models.Model):
         verbose_name = 'Информация о продукте'
         verbose_name_plural = 'Информационный список о продуктах'
         ordering = ('name',)
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_product_info_external_id'),
+        ]
 
     model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
     product = models.ForeignKey(Product, verbose_name='Продукт', related_name='product_infos', null=True, blank=True,
@@ -73,6 +129,52 @@ class ProductInfo(models.Model):
         return f'{self.name}'
 
 
+class ProductOffer(models.Model):
+    class Meta:
+        db_table = 'product_offer'
+        verbose_name = 'Сводка предложений по продукту'
+        verbose_name_plural = 'Сводки предложений по продуктам'
+
+    product = models.OneToOneField(Product, verbose_name='Продукт', related_name='offer', primary_key=True,
+                                   on_delete=models.CASCADE)
+    min_price = models.PositiveIntegerField(verbose_name='Минимальная цена', db_index=True)
+    max_price = models.PositiveIntegerField(verbose_name='Максимальная цена')
+    total_quantity = models.PositiveIntegerField(verbose_name='Общее количество')
+    shop_count = models.PositiveIntegerField(verbose_name='Количество магазинов')
+
+    aggregate_fields = ['min_price', 'max_price', 'total_quantity', 'shop_count']
+
+    def __str__(self):
+        return f'{self.product_id}: {self.min_price}-{self.max_price}'
+
+    @classmethod
+    def refresh(cls, product_ids, batch_size: int = 500) -> int:
+        """
+        Пересчитывает сводки для указанных продуктов по product_info, возвращает число изменившихся сводок
+        """
+        product_ids = sorted(set(product_ids))
+        changed = 0
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            current = {offer.product_id: offer for offer in cls.objects.filter(product_id__in=batch)}
+            rows = (ProductInfo.objects.filter(product_id__in=batch).order_by().values('product_id')
+                    .annotate(min_price=models.Min('price'),
+                              max_price=models.Max('price'),
+                              total_quantity=models.Sum('quantity'),
+                              shop_count=models.Count('shop_id', distinct=True)))
+            offers = []
+            for row in rows:
+                offer = cls(**row)
+                old = current.pop(offer.product_id, None)
+                if old is None or any(getattr(old, name) != getattr(offer, name) for name in cls.aggregate_fields):
+                    offers.append(offer)
+            cls.objects.bulk_create(offers, update_conflicts=True, unique_fields=['product'],
+                                    update_fields=cls.aggregate_fields)
+            cls.objects.filter(product_id__in=current).delete()
+            changed += len(offers) + len(current)
+        return changed
+
+
 class Parameter(models.Model):
     class Meta:
         db_table = 'parameter'
@@ -92,16 +194,45 @@ class ProductParameter(models.Model):
         verbose_name = 'Параметр'
         verbose_name_plural = 'Список параметров'
         ordering = ('id',)
+        indexes = [
+            models.Index(fields=['parameter', 'value_num', 'product_info'], name='product_parameter_num_idx'),
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value_idx'),
+        ]
 
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте',
                                      related_name='product_parameters', null=True, blank=True, on_delete=models.CASCADE)
     parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='product_parameters', null=True,
                                   blank=True, on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=100, null=False, blank=True)
+    value_num = models.FloatField(verbose_name='Числовое значение', null=True, blank=True)
 
     def __str__(self):
         return f'{self.value}'
 
+    @staticmethod
+    def parse_number(value):
+        """
+        Числовое представление значения параметра или None для строковых значений ("2688x1242", "черный")
+        """
+        try:
+            number = float(str(value).strip().replace(',', '.'))
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+
+    @classmethod
+    def build(cls, product_info_id: int, parameter_id: int, value) -> 'ProductParameter':
+        return cls(product_info_id=product_info_id, parameter_id=parameter_id, value=str(value),
+                   value_num=cls.parse_number(value))
+
+    def set_value(self, value):
+        self.value = str(value)
+        self.value_num = self.parse_number(value)
+
+    def save(self, *args, **kwargs):
+        self.value_num = self.parse_number(self.value)
+        super().save(*args, **kwargs)
+
 
 class Order(models.Model):
     class Meta:
@@ -109,6 +240,13 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказ'
         ordering = ('dt',)
+        indexes = [
+            models.Index(fields=['user', 'status', 'dt'], name='order_user_status_idx'),
+        ]
+        constraints = [
+            # частичный уникальный индекс: у пользователя не больше одной корзины, поиск корзины идет по нему
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='cart'), name='unique_order_cart'),
+        ]
 
     dt = models.DateTimeField(auto_now_add=True)
     status = models.CharField(verbose_name='Статус', max_length=25, null=False, blank=True, choices=statuses_order)
@@ -124,6 +262,10 @@ class OrderItem(models.Model):
         db_table = 'order_item'
         verbose_name = 'Заказанная позиция'
         verbose_name_plural = 'Список заказанных позиций'
+        ordering = ('id',)
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_item'),
+        ]
 
     order = models.ForeignKey(Order, verbose_name='Заказ', related_name='ordered_items', null=True, blank=True,
                               on_delete=models.CASCADE)
@@ -137,13 +279,146 @@ class OrderItem(models.Model):
         return f'{self.order} {self.product_info}'
 
 
+class ShopOrderLine(models.Model):
+    """
+    Строка подтвержденного заказа глазами поставщика: копия данных позиции на момент подтверждения.
+    Пишется в confirm_cart, читается курсором по (shop, id) без соединений с заказами и товарами
+    """
+    class Meta:
+        db_table = 'shop_order_line'
+        verbose_name = 'Строка заказа магазина'
+        verbose_name_plural = 'Список строк заказов магазинов'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['shop', 'id'], name='shop_order_line_cursor_idx'),
+        ]
+
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='order_lines', on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='shop_lines', on_delete=models.CASCADE)
+    order_item = models.OneToOneField(OrderItem, verbose_name='Заказанная позиция', related_name='shop_line',
+                                      on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='shop_lines',
+                                     null=True, blank=True, on_delete=models.SET_NULL)
+    external_id = models.PositiveIntegerField(verbose_name='Внешний ID', default=0)
+    product_name = models.CharField(verbose_name='Продукт', max_length=255, blank=True)
+    model = models.CharField(verbose_name='Модель', max_length=80, blank=True)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    total = models.PositiveIntegerField(verbose_name='Сумма')
+    buyer = models.CharField(verbose_name='Покупатель', max_length=150, blank=True)
+    address = models.CharField(verbose_name='Адрес', max_length=255, blank=True)
+    dt = models.DateTimeField(verbose_name='Подтвержден')
+
+    def __str__(self):
+        return f'{self.order_id} {self.product_name}'
+
+
 class Contact(models.Model):
     class Meta:
         db_table = 'contact'
         verbose_name = 'Контакты пользователя'
         verbose_name_plural = 'Список контактов пользователя'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'type', 'value'], name='unique_contact'),
+        ]
 
     user = models.ForeignKey(User, verbose_name='Пользователь', related_name='contacts', null=True, blank=True,
                              on_delete=models.CASCADE)
     type = models.CharField(verbose_name='Тип контакта', max_length=255, null=False, blank=True)
     value = models.CharField(verbose_name='Значение', max_length=255, null=False, blank=True)
+
+
+class ImportJob(models.Model):
+    class Meta:
+        db_table = 'import_job'
+        verbose_name = 'Задача загрузки прайса'
+        verbose_name_plural = 'Список задач загрузки прайса'
+        ordering = ('-created_at',)
+
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs', null=True, blank=True,
+                             on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='Ссылка')
+    mode = models.CharField(verbose_name='Режим', max_length=25, default='sync')
+    force = models.BooleanField(verbose_name='Загрузить без проверки изменений', default=False)
+    phase = models.CharField(verbose_name='Этап', max_length=25, choices=import_phases, default='queued')
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано позиций', default=0)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    stats = models.JSONField(verbose_name='Статистика', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.url} ({self.phase})'
+
+    @property
+    def progress_key(self):
+        return f'import-job-{self.id}-rows'
+
+    def set_phase(self, phase: str, **fields):
+        self.phase = phase
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save(update_fields=['phase', 'updated_at', *fields])
+
+    def skip_unchanged(self, shop: Shop | None, meta: dict) -> bool:
+        """
+        Завершает задачу без загрузки, если прайс магазина shop не изменился (Shop.feed_unchanged)
+        """
+        reason = shop.feed_unchanged(self.url, meta) if shop is not None else None
+        if reason:
+            self.set_phase('done', stats={'skipped': reason})
+        return bool(reason)
+
+    def report_progress(self, rows: int):
+        """
+        Публикует прогресс через кэш 'progress' (общий для воркера и веб-процессов): строка задачи недоступна
+        другим соединениям до конца транзакции импорта
+        """
+        caches['progress'].set(self.progress_key, rows, timeout=60 * 60)
+
+    def live_rows_processed(self) -> int:
+        if self.phase == 'importing':
+            return caches['progress'].get(self.progress_key, self.rows_processed)
+        return self.rows_processed
+
+
+class AuthToken(models.Model):
+    class Meta:
+        db_table = 'auth_token'
+        verbose_name = 'Токен доступа'
+        verbose_name_plural = 'Список токенов доступа'
+        ordering = ('-created_at',)
+
+    # хранится только SHA-256 токена: утечка таблицы не раскрывает сами токены
+    digest = models.CharField(verbose_name='Хеш токена', max_length=64, unique=True)
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='auth_tokens', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name='Действует до')
+
+    def __str__(self):
+        return f'{self.user} ({self.expires_at})'
+
+
+class OutgoingEmail(models.Model):
+    class Meta:
+        db_table = 'outgoing_email'
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Очередь исходящих писем'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
+
+    subject = models.CharField(verbose_name='Тема', max_length=255)
+    body = models.TextField(verbose_name='Текст')
+    from_email = models.CharField(verbose_name='Отправитель', max_length=255, blank=True)
+    recipients = models.JSONField(verbose_name='Получатели')
+    status = models.CharField(verbose_name='Статус', max_length=25, choices=email_statuses, default='pending')
+    claim = models.CharField(verbose_name='Метка обработчика', max_length=32, blank=True)
+    attempts = models.PositiveIntegerField(verbose_name='Попытки', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка', auto_now_add=True)
+    last_error = models.TextField(verbose_name='Последняя ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)}'
@@ -0,0 +1,123 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from backend.models import OutgoingEmail
+
+_local = threading.local()
+
+
+def queue_email(subject: str, message: str, recipients: list[str], from_email: str = None) -> OutgoingEmail:
+    """
+    Кладет письмо в очередь; отправка запускается после коммита текущей транзакции
+    """
+    from backend.tasks import send_queued_emails
+
+    email = OutgoingEmail.objects.create(subject=subject, body=message, recipients=list(recipients),
+                                         from_email=from_email or settings.DEFAULT_FROM_EMAIL)
+    transaction.on_commit(lambda: send_queued_emails.apply_async(countdown=settings.EMAIL_BATCH_DELAY))
+    return email
+
+
+def mail_connection():
+    """
+    Постоянное соединение с почтовым сервером, одно на поток воркера
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = _local.connection = get_connection(fail_silently=False)
+        connection.open()
+    return connection
+
+
+def reset_mail_connection():
+    connection = getattr(_local, 'connection', None)
+    _local.connection = None
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def claim_batch(size: int) -> list[OutgoingEmail]:
+    """
+    Помечает до size готовых к отправке писем меткой обработчика; зависшие в 'sending' забираются повторно
+    """
+    claim = get_random_string(32)
+    now = timezone.now()
+    due = (Q(status='pending', next_attempt_at__lte=now) |
+           Q(status='sending', next_attempt_at__lte=now - timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)))
+    ids = list(OutgoingEmail.objects.filter(due).order_by('id').values_list('id', flat=True)[:size])
+    OutgoingEmail.objects.filter(due, id__in=ids).update(status='sending', claim=claim, next_attempt_at=now)
+    return list(OutgoingEmail.objects.filter(claim=claim, status='sending'))
+
+
+def send_batch(emails: list[OutgoingEmail]) -> tuple[int, list[OutgoingEmail], bool]:
+    """
+    Отправляет пакет через одно SMTP-соединение; возвращает число отправленных, письма для повтора и признак
+    того, что соединение с сервером не открылось и пакет прерван
+    """
+    sent, failed, postponed, unavailable = [], [], [], False
+    for index, email in enumerate(emails):
+        message = EmailMessage(email.subject, email.body, email.from_email, email.recipients)
+        for retry in (False, True):
+            try:
+                connection = mail_connection()
+            except Exception as e:
+                # сервер недоступен: остальные письма ждут следующего запуска, а не EMAIL_TIMEOUT каждое
+                reset_mail_connection()
+                email.last_error = f'{type(e).__name__}: {e}'
+                failed.append(email)
+                postponed, unavailable = emails[index + 1:], True
+                break
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                # соединение могло быть закрыто сервером за время простоя: одна повторная попытка с новым
+                reset_mail_connection()
+                if retry:
+                    email.last_error = f'{type(e).__name__}: {e}'
+                    failed.append(email)
+            else:
+                sent.append(email.id)
+                break
+        if unavailable:
+            break
+    OutgoingEmail.objects.filter(id__in=sent).delete()
+
+    now = timezone.now()
+    for email in failed:
+        email.attempts += 1
+        email.status = 'failed' if email.attempts >= settings.EMAIL_MAX_ATTEMPTS else 'pending'
+        email.next_attempt_at = now + timedelta(seconds=settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+    OutgoingEmail.objects.bulk_update(failed, ['attempts', 'status', 'next_attempt_at', 'last_error'])
+    # неотправленные из-за недоступного сервера возвращаются в очередь без учета попытки
+    for email in postponed:
+        email.status, email.next_attempt_at = 'pending', now + timedelta(seconds=settings.EMAIL_RETRY_DELAY)
+    OutgoingEmail.objects.bulk_update(postponed, ['status', 'next_attempt_at'])
+    return len(sent), [email for email in failed if email.status == 'pending'] + postponed, unavailable
+
+
+def flush_outbox(batch_size: int = None) -> dict:
+    """
+    Отправляет накопившиеся письма пакетами; возвращает число отправленных и задержку до ближайшего повтора
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    sent, retry = 0, []
+    while batch := claim_batch(batch_size):
+        batch_sent, batch_retry, unavailable = send_batch(batch)
+        sent += batch_sent
+        retry += batch_retry
+        if unavailable:
+            break
+    delay = None
+    if retry:
+        delay = max((min(email.next_attempt_at for email in retry) - timezone.now()).total_seconds(), 0)
+    return {'sent': sent, 'retry_in': delay}
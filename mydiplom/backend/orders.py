@@ -0,0 +1,206 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from backend.export import chunks
+from backend.models import ProductInfo, Order, OrderItem, ShopOrderLine
+
+CART_UPSERT_BATCH = 250
+SHOP_LINE_FIELDS = ('id', 'order_id', 'product_info_id', 'product_info__shop_id', 'product_info__external_id',
+                    'product_info__product__name', 'product_info__model', 'product_info__price', 'quantity')
+
+
+class InsufficientStock(Exception):
+    """
+    Не хватает остатков хотя бы по одной позиции заказа
+    """
+
+    def __init__(self, needed: dict[int, int]):
+        super().__init__('Недостаточно товара на складе')
+        self.needed = needed
+
+    def shortages(self) -> list[dict]:
+        available = dict(ProductInfo.objects.filter(id__in=self.needed).values_list('id', 'quantity'))
+        return [{'product_info_id': pk, 'requested': quantity, 'available': available.get(pk, 0)}
+                for pk, quantity in self.needed.items() if available.get(pk, 0) < quantity]
+
+
+def reserve_stock(lines: list[dict]):
+    """
+    Списывает остатки по строкам заказа (values() с product_info_id, product_info__shop_id, quantity)
+    одним условным UPDATE на магазин:
+    строка уменьшается, только если quantity >= заказанного, иначе InsufficientStock.
+    Вызывается внутри transaction.atomic, чтобы частичное списание откатилось
+    """
+    by_shop = defaultdict(lambda: defaultdict(int))
+    for line in lines:
+        by_shop[line['product_info__shop_id']][line['product_info_id']] += line['quantity']
+
+    for shop_id, quantities in by_shop.items():
+        amount = Case(*[When(id=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                      output_field=PositiveIntegerField())
+        updated = (ProductInfo.objects.filter(shop_id=shop_id, id__in=quantities, quantity__gte=amount)
+                   .update(quantity=F('quantity') - amount))
+        if updated != len(quantities):
+            raise InsufficientStock({pk: quantity for shop in by_shop.values() for pk, quantity in shop.items()})
+
+
+def shop_line(line: dict, buyer: str, address: str, dt) -> ShopOrderLine:
+    return ShopOrderLine(
+        shop_id=line['product_info__shop_id'],
+        order_id=line['order_id'],
+        order_item_id=line['id'],
+        product_info_id=line['product_info_id'],
+        external_id=line['product_info__external_id'],
+        product_name=line['product_info__product__name'] or '',
+        model=line['product_info__model'],
+        quantity=line['quantity'],
+        price=line['product_info__price'],
+        total=line['quantity'] * line['product_info__price'],
+        buyer=buyer,
+        address=address,
+        dt=dt,
+    )
+
+
+def record_shop_lines(lines: list[dict], buyer: str, address: str):
+    """
+    Копирует строки подтвержденного заказа (values() с полями SHOP_LINE_FIELDS) в ShopOrderLine одним INSERT.
+    Вызывается в транзакции подтверждения: строки появляются у поставщика вместе с заказом
+    """
+    now = timezone.now()
+    ShopOrderLine.objects.bulk_create([shop_line(line, buyer, address, now) for line in lines])
+
+
+def rebuild_shop_lines(chunk_size: int = 2000) -> int:
+    """
+    Заново заполняет ShopOrderLine по всем оформленным заказам, например для заказов до появления таблицы.
+    Адрес в старых заказах не сохранялся, поэтому остается пустым
+    """
+    items = (OrderItem.objects.filter(product_info__isnull=False).exclude(order__status='cart').order_by('id')
+             .values(*SHOP_LINE_FIELDS, 'order__user__username', 'order__dt'))
+    count = 0
+    with transaction.atomic():
+        ShopOrderLine.objects.all().delete()
+        for chunk in chunks(items.iterator(chunk_size=chunk_size), chunk_size):
+            ShopOrderLine.objects.bulk_create([shop_line(line, line['order__user__username'] or '', '',
+                                                         line['order__dt']) for line in chunk])
+            count += len(chunk)
+    return count
+
+
+class CartError(Exception):
+    """
+    Неверные строки в запросе на изменение корзины
+    """
+
+
+def parse_cart_lines(items, id_key: str, min_quantity: int = 1, shop_key: str = None) -> dict[int, dict]:
+    """
+    Проверяет формат строк запроса и складывает повторы одной позиции: {product_info_id: {quantity, shop_id}}
+    """
+    if not isinstance(items, list):
+        raise CartError('Неверный формат входных данных')
+    lines = {}
+    for item in items:
+        keys = (id_key, 'quantity', shop_key) if shop_key else (id_key, 'quantity')
+        if not isinstance(item, dict) or any(key not in item for key in keys):
+            raise CartError('Неверный формат входных данных')
+        try:
+            pk, quantity = int(item[id_key]), int(item['quantity'])
+            shop_id = int(item[shop_key]) if shop_key else None
+        except (TypeError, ValueError):
+            raise CartError('Неверный формат входных данных')
+        if quantity < min_quantity:
+            raise CartError(f'Количество должно быть не меньше {min_quantity}')
+        line = lines.setdefault(pk, {'quantity': 0, 'shop_id': shop_id})
+        line['quantity'] += quantity
+    return lines
+
+
+def product_info_shops(lines: dict[int, dict]) -> dict[int, int]:
+    """
+    Одним запросом проверяет, что позиции существуют и принадлежат указанным магазинам
+    """
+    shops = dict(ProductInfo.objects.filter(id__in=lines).values_list('id', 'shop_id'))
+    if missing := sorted(set(lines) - set(shops)):
+        raise CartError(f'Позиции не найдены: {", ".join(map(str, missing))}')
+    if wrong := sorted(pk for pk, line in lines.items() if line['shop_id'] not in (None, shops[pk])):
+        raise CartError(f'Позиции не продаются в указанном магазине: {", ".join(map(str, wrong))}')
+    return shops
+
+
+def upsert_cart_lines(cart, quantities: dict[int, int], shops: dict[int, int]):
+    if quantities:
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=cart, product_info_id=pk, shop_id=shops[pk], quantity=quantity)
+             for pk, quantity in quantities.items()],
+            update_conflicts=True, unique_fields=['order', 'product_info'], update_fields=['quantity'],
+        )
+
+
+def add_to_cart(cart, lines: dict[int, dict]):
+    """
+    Добавляет позиции, прибавляя количество к уже лежащим в корзине строкам. Сложение идет в БД
+    (INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity + EXCLUDED.quantity), поэтому параллельные
+    добавления одной позиции не теряют друг друга
+    """
+    shops = product_info_shops(lines)
+    qn = connection.ops.quote_name
+    meta = OrderItem._meta
+    table = qn(meta.db_table)
+    order, product_info, shop, quantity = (qn(meta.get_field(name).column)
+                                           for name in ('order', 'product_info', 'shop', 'quantity'))
+    increment = f'{quantity} = {table}.{quantity} + EXCLUDED.{quantity}'
+    with connection.cursor() as cursor:
+        for batch in chunks(lines.items(), CART_UPSERT_BATCH):
+            cursor.execute(
+                f'INSERT INTO {table} ({order}, {product_info}, {shop}, {quantity}) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({order}, {product_info}) DO UPDATE SET {increment}',
+                [value for pk, line in batch for value in (cart.id, pk, shops[pk], line['quantity'])])
+
+
+def remove_from_cart(cart, lines: dict[int, dict]):
+    """
+    Уменьшает количество в БД, как add_to_cart: параллельные изменения корзины не теряются.
+    Строки, где оно стало нулевым, удаляются; обе операции - в одной транзакции, строки заблокированы UPDATE
+    """
+    if not lines:
+        return
+    amount = Case(*[When(product_info_id=pk, then=Value(line['quantity'])) for pk, line in lines.items()],
+                  output_field=PositiveIntegerField())
+    with transaction.atomic(savepoint=False):
+        items = cart.ordered_items.filter(product_info_id__in=lines)
+        # PositiveIntegerField: вместо отрицательного остатка - 0
+        items.update(quantity=Case(When(quantity__gt=amount, then=F('quantity') - amount), default=Value(0),
+                                   output_field=PositiveIntegerField()))
+        items.filter(quantity=0).delete()
+
+
+def set_cart_quantities(cart, lines: dict[int, dict]):
+    """
+    Задает точное количество; 0 удаляет строку
+    """
+    removed = [pk for pk, line in lines.items() if line['quantity'] == 0]
+    if removed:
+        cart.ordered_items.filter(product_info_id__in=removed).delete()
+    kept = {pk: line for pk, line in lines.items() if line['quantity'] > 0}
+    if kept:
+        upsert_cart_lines(cart, {pk: line['quantity'] for pk, line in kept.items()}, product_info_shops(kept))
+
+
+def apply_cart_change(user, change, lines: dict[int, dict], create: bool = False):
+    """
+    Применяет change(cart, lines) к корзине пользователя в одной транзакции.
+    Возвращает корзину или None, если ее нет и create не задан
+    """
+    with transaction.atomic():
+        cart = Order.objects.filter(user_id=user.id, status='cart').first()
+        if cart is None and create:
+            cart, _ = Order.objects.get_or_create(status='cart', user=user)
+        if cart is not None:
+            change(cart, lines)
+    return cart
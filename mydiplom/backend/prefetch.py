@@ -0,0 +1,49 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+def plan_serializer(serializer: BaseSerializer, model) -> tuple[list[str], list[Prefetch]]:
+    """
+    Обходит дерево вложенных сериализаторов и возвращает пути для select_related и prefetch_related:
+    прямые FK/OneToOne присоединяются в тот же запрос, связи "ко многим" загружаются отдельным запросом
+    со своим планом
+    """
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        child = field.child if isinstance(field, ListSerializer) else field
+        if not isinstance(child, BaseSerializer) or field.source == '*' or '.' in field.source:
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+
+        related_model = model_field.related_model
+        child_select, child_prefetch = plan_serializer(child, related_model)
+        name = field.source
+        if model_field.many_to_many or model_field.one_to_many:
+            queryset = related_model._default_manager.select_related(*child_select).prefetch_related(*child_prefetch)
+            prefetch.append(Prefetch(name, queryset=queryset))
+        else:
+            select.append(name)
+            select.extend(f'{name}__{path}' for path in child_select)
+            prefetch.extend(Prefetch(f'{name}__{item.prefetch_through}', queryset=item.queryset)
+                            for item in child_prefetch)
+    return select, prefetch
+
+
+def plan_queryset(queryset: QuerySet, serializer_class, **serializer_kwargs) -> QuerySet:
+    """
+    Добавляет к queryset загрузку всех связей, которые выводит serializer_class(**serializer_kwargs)
+    """
+    select, prefetch = plan_serializer(serializer_class(**serializer_kwargs), queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
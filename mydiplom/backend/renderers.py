@@ -0,0 +1,53 @@
+import io
+import re
+
+import ujson
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+# ujson пишет 1e-5 там, где json - 1e-05; такие ответы отдаются стандартным путем
+SHORT_EXPONENT = re.compile(r'[0-9]e-[0-9]')
+NON_FINITE = re.compile(rb'NaN|Infinity')
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на ujson с тем же выводом байт в байт: компактные разделители, без экранирования "/",
+    \\u2028/\\u2029 экранируются, datetime/Decimal/ленивые строки - через encoder_class DRF.
+    С отступами (?indent=, Browsable API), экспонентой из одной цифры и типами, которые ujson не пишет,
+    работает стандартный JSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False, allow_nan=not self.strict,
+                              default=self.encoder_class().default)
+        except (TypeError, ValueError, OverflowError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if SHORT_EXPONENT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class UJSONParser(JSONParser):
+    """
+    JSONParser на ujson. NaN/Infinity и ошибки разбора проверяет стандартный json, поэтому результат
+    и текст ParseError не меняются
+    """
+    renderer_class = UJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        if not NON_FINITE.search(body):
+            try:
+                return ujson.loads(body.decode(encoding))
+            except ValueError:
+                pass
+        return super().parse(io.BytesIO(body), media_type, parser_context)
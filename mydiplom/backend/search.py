@@ -0,0 +1,285 @@
+import math
+import re
+import sqlite3
+import threading
+import heapq
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, connections, transaction
+
+from backend.cache import CATALOG_CACHE, catalog_cache
+from backend.models import ProductInfo
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'^[а-я]+$')
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая',
+    'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'а', 'я', 'ы', 'и', 'у', 'ю',
+    'е', 'о', 'ь',
+), key=len, reverse=True)
+SEARCH_TABLE = 'product_search'
+SEARCH_BATCH_SIZE = 500
+
+
+def stem(token: str) -> str:
+    """
+    Упрощенный стеммер: отбрасывает типичное окончание русского слова, оставляя основу от 3 букв
+    """
+    if not CYRILLIC_RE.match(token):
+        return token
+    for ending in RUSSIAN_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    return [stem(token) for token in TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))]
+
+
+def document_rows(ids):
+    """
+    Тексты документов поиска: название продукта и позиции, модель
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), SEARCH_BATCH_SIZE):
+        rows = (ProductInfo.objects.filter(id__in=ids[start:start + SEARCH_BATCH_SIZE]).order_by()
+                .values_list('id', 'product__name', 'name', 'model'))
+        for pk, product_name, name, model in rows:
+            yield pk, ' '.join(tokenize(f'{product_name or ""} {name}')), ' '.join(tokenize(model))
+
+
+@lru_cache(maxsize=None)
+def fts5_available() -> bool:
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+class FTS5SearchIndex:
+    """
+    Индекс в виртуальной таблице SQLite FTS5; пишется в той же транзакции, что и импорт
+    """
+    name = 'fts5'
+
+    def create_table(self, using=None):
+        with connections[using or 'default'].cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                           f"USING fts5(name, model, tokenize='unicode61 remove_diacritics 2')")
+
+    def remove(self, ids):
+        ids = list(ids)
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), SEARCH_BATCH_SIZE):
+                batch = ids[start:start + SEARCH_BATCH_SIZE]
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(batch))})',
+                               batch)
+
+    def sync(self, changed, deleted):
+        changed = set(changed)
+        self.remove(changed | set(deleted))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, name, model) VALUES (%s, %s, %s)',
+                               list(document_rows(changed)))
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        self.sync(ProductInfo.objects.values_list('id', flat=True), [])
+
+    def search(self, query: str, limit: int) -> list[int]:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = ' AND '.join(f'"{token}"*' for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                           f'ORDER BY bm25({SEARCH_TABLE}, 2.0, 1.0) LIMIT %s', [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MemorySearchIndex:
+    """
+    Инвертированный индекс в памяти процесса с ранжированием BM25.
+    Изменения из импорта применяются после коммита; другие процессы, увидев новую версию области 'search'
+    в кэше каталога, перестраивают индекс в фоновом потоке и до замены ищут по старому. Поэтому кэш каталога
+    должен быть общим для процессов (CATALOG_CACHE_URL или CATALOG_CACHE_DIR), иначе это проверяет
+    check_search_version
+    """
+    name = 'memory'
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.total_length = 0
+        self.documents = {}
+        self._terms = None
+        self._impacts = {}
+        self.rebuilding = None
+
+    def create_table(self, using=None):
+        pass
+
+    def _add(self, pk: int, name: str, model: str):
+        tokens = Counter(name.split()) + Counter(model.split())
+        for token, frequency in tokens.items():
+            self.postings[token][pk] = frequency
+        self.lengths[pk] = sum(tokens.values())
+        self.total_length += self.lengths[pk]
+        self.documents[pk] = tokens
+
+    def _remove(self, pk: int):
+        for token in self.documents.pop(pk, ()):
+            self.postings[token].pop(pk, None)
+            if not self.postings[token]:
+                del self.postings[token]
+        self.total_length -= self.lengths.pop(pk, 0)
+
+    def apply(self, changed, deleted):
+        with self._lock:
+            for pk in set(changed) | set(deleted):
+                self._remove(pk)
+            for row in document_rows(changed):
+                self._add(*row)
+            self._terms = None
+            self._impacts = {}
+            catalog_cache.invalidate('search')
+            self.version = catalog_cache.version('search')
+
+    def sync(self, changed, deleted):
+        changed, deleted = list(changed), list(deleted)
+        if changed or deleted:
+            transaction.on_commit(lambda: self.apply(changed, deleted))
+
+    def rebuild(self):
+        """
+        Строит новый индекс без блокировки и подменяет им текущий; версия берется до чтения позиций,
+        поэтому изменения, закоммиченные во время построения, вызовут следующую перестройку
+        """
+        version = catalog_cache.version('search')
+        fresh = MemorySearchIndex()
+        for row in document_rows(ProductInfo.objects.values_list('id', flat=True)):
+            fresh._add(*row)
+        with self._lock:
+            self.postings, self.lengths, self.documents = fresh.postings, fresh.lengths, fresh.documents
+            self.total_length = fresh.total_length
+            self._terms = None
+            self._impacts = {}
+            self.version = version
+
+    def rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            connection.close()
+
+    def ensure_fresh(self):
+        """
+        Первое построение идет в запросе; после изменений в другом процессе индекс перестраивается
+        в фоновом потоке, а запросы до замены обслуживает прежний
+        """
+        if self.version == catalog_cache.version('search'):
+            return
+        with self._lock:
+            if self.version is None:
+                self.rebuild()
+            elif self.rebuilding is None or not self.rebuilding.is_alive():
+                self.rebuilding = threading.Thread(target=self.rebuild_in_background, daemon=True)
+                self.rebuilding.start()
+
+    def expand(self, prefix: str) -> list[str]:
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        terms = []
+        for index in range(bisect_left(self._terms, prefix), len(self._terms)):
+            if not self._terms[index].startswith(prefix):
+                break
+            terms.append(self._terms[index])
+        return terms
+
+    def impacts(self, term: str) -> dict[int, float]:
+        """
+        Вклад BM25 термина в каждый документ; кэшируется до следующего изменения индекса
+        """
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            total = len(self.lengths) or 1
+            average = self.total_length / total or 1
+            postings = self.postings[term]
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            impacts = self._impacts[term] = {
+                pk: idf * frequency * (self.k1 + 1) /
+                (frequency + self.k1 * (1 - self.b + self.b * self.lengths[pk] / average))
+                for pk, frequency in postings.items()
+            }
+        return impacts
+
+    def token_scores(self, token: str) -> dict[int, float]:
+        terms = self.expand(token)
+        if len(terms) == 1:
+            return self.impacts(terms[0])
+        scores = {}
+        for term in terms:
+            for pk, score in self.impacts(term).items():
+                if score > scores.get(pk, 0):
+                    scores[pk] = score
+        return scores
+
+    def search(self, query: str, limit: int) -> list[int]:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self.ensure_fresh()
+        with self._lock:
+            candidates = sorted((self.token_scores(token) for token in tokens), key=len)
+            scores = candidates[0]
+            for other in candidates[1:]:
+                scores = {pk: score + other[pk] for pk, score in scores.items() if pk in other}
+                if not scores:
+                    return []
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [pk for pk, _ in best]
+
+
+@lru_cache(maxsize=None)
+def get_search_index():
+    backend = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if backend == 'fts5' or (backend == 'auto' and connection.vendor == 'sqlite' and fts5_available()):
+        return FTS5SearchIndex()
+    return MemorySearchIndex()
+
+
+def create_search_table(using=None, **kwargs):
+    """
+    Обработчик post_migrate: создает таблицу FTS5 (миграции приложения не хранятся в репозитории)
+    """
+    get_search_index().create_table(using)
+
+
+def check_search_version(app_configs=None, **kwargs):
+    """
+    Системная проверка: индекс в памяти с импортом в воркере Celery и кэшем каталога в памяти процесса
+    не узнает об изменениях других процессов и отдает устаревшие результаты до перезапуска
+    """
+    backend = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    memory = backend == 'memory' or (backend == 'auto' and connection.vendor != 'sqlite')
+    if memory and not settings.CELERY_TASK_ALWAYS_EAGER and isinstance(caches[CATALOG_CACHE], LocMemCache):
+        return [checks.Warning(
+            'Поисковый индекс в памяти процесса не видит импорт в воркере Celery: версия области "search" '
+            'хранится в кэше каталога в памяти процесса',
+            hint='Задайте CATALOG_CACHE_URL (Redis) или CATALOG_CACHE_DIR, общие для сервера и воркера',
+            id='backend.W001',
+        )]
+    return []
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from backend.models import Category, Product, Shop, Order, OrderItem, ProductInfo, Contact
+from backend.compiled import CompiledSerializerMixin
+from backend.models import Category, Product, Shop, Order, OrderItem, ProductInfo, Contact, ImportJob, \
+    ProductOffer
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,12 +27,32 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'shops')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор, выводящий только поля из аргумента fields (если он передан)
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductOfferSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductOffer
+        fields = ('min_price', 'max_price', 'total_quantity', 'shop_count')
+
+
+class ProductSerializer(CompiledSerializerMixin, DynamicFieldsModelSerializer):
     category = CategorySerializer()
+    offer = ProductOfferSerializer(read_only=True)
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'category')
+        fields = ('id', 'name', 'category', 'offer')
 
 
 class ProductInfoSerializer(serializers.ModelSerializer):
@@ -39,29 +61,55 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         fields = ('id', 'model', 'price', 'price_rrc')
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class ProductInfoSearchSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    shop_name = serializers.CharField(source='shop.name', read_only=True)
+
+    class Meta:
+        model = ProductInfo
+        fields = ('id', 'model', 'price', 'price_rrc', 'quantity', 'product', 'product_name', 'shop', 'shop_name')
+
+
+class OrderItemSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     shop = ShopSerializer()
     product_info = ProductInfoSerializer()
+    total = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'shop')
+        fields = ('id', 'product_info', 'quantity', 'shop', 'total')
+
+    @staticmethod
+    def line_total(obj) -> int:
+        return obj.quantity * obj.product_info.price if obj.product_info else 0
+
+    def get_total(self, obj):
+        return self.line_total(obj)
 
 
-class OrderSerializer(serializers.ModelSerializer):
-    ordered_items = serializers.SerializerMethodField()
+class OrderSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    ordered_items = OrderItemSerializer(many=True, read_only=True)
     user = UserSerializer()
+    total = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
-        fields = ('user', 'status', 'ordered_items')
+        fields = ('id', 'user', 'status', 'ordered_items', 'total')
 
-    def get_ordered_items(self, obj):
-        order_items = OrderItem.objects.filter(order=obj)
-        return OrderItemSerializer(order_items, many=True).data
+    def get_total(self, obj):
+        # ordered_items берутся из prefetch_related, поэтому сумма не делает запросов
+        return sum(OrderItemSerializer.line_total(item) for item in obj.ordered_items.all())
 
 
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
-        fields = ('type', 'value')
\ No newline at end of file
+        fields = ('type', 'value')
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_processed = serializers.IntegerField(source='live_rows_processed', read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'mode', 'phase', 'rows_processed', 'errors', 'stats', 'created_at', 'updated_at')
@@ -0,0 +1,69 @@
+import json
+import random
+
+import yaml
+
+BRANDS = ('Apple', 'Samsung', 'Xiaomi', 'Huawei', 'Sony', 'LG', 'Lenovo', 'Asus', 'Philips', 'Honor')
+COLORS = ('черный', 'белый', 'серый', 'золотистый', 'красный', 'синий', 'зеленый')
+CATEGORY_NAMES = ('Смартфоны', 'Аксессуары', 'Flash-накопители', 'Телевизоры', 'Ноутбуки', 'Планшеты',
+                  'Наушники', 'Мониторы', 'Фотоаппараты', 'Часы')
+
+
+def synthetic_parameters(rnd: random.Random, count: int) -> dict:
+    """
+    Параметры как в data/shop1.yaml: числа, размеры вида 2688x1242 и строки
+    """
+    parameters = {}
+    for index in range(count):
+        kind = index % 4
+        if kind == 0:
+            parameters[f'Диагональ {index} (дюйм)'] = round(rnd.uniform(4, 80), 1)
+        elif kind == 1:
+            parameters[f'Разрешение {index} (пикс)'] = f'{rnd.choice((1280, 1920, 2688, 3840))}x' \
+                                                       f'{rnd.choice((720, 1080, 1242, 2160))}'
+        elif kind == 2:
+            parameters[f'Память {index} (Гб)'] = rnd.choice((16, 32, 64, 128, 256, 512))
+        else:
+            parameters[f'Цвет {index}'] = rnd.choice(COLORS)
+    return parameters
+
+
+def synthetic_feed(shop: int, categories: int = 5, goods: int = 100, parameters: int = 4,
+                   seed: int = 0) -> dict:
+    """
+    Прайс магазина в схеме data/shop1.yaml. Названия товаров берутся из общего для всех магазинов набора,
+    чтобы один продукт продавался в нескольких магазинах
+    """
+    rnd = random.Random(f'{seed}-{shop}')
+    category_ids = [100 + index for index in range(categories)]
+    items = []
+    for external_id in rnd.sample(range(1, goods * 2 + 1), goods):
+        brand = BRANDS[external_id % len(BRANDS)]
+        category = category_ids[external_id % categories]
+        price = rnd.randrange(500, 150000, 10)
+        items.append({
+            'id': external_id,
+            'category': category,
+            'model': f'{brand.lower()}/model-{external_id % 97}',
+            'name': f'{CATEGORY_NAMES[category % len(CATEGORY_NAMES)]} {brand} {external_id}',
+            'price': price,
+            'price_rrc': price + rnd.randrange(0, 5000, 10),
+            'quantity': rnd.randint(0, 50),
+            'parameters': synthetic_parameters(rnd, parameters),
+        })
+    return {
+        'shop': f'Магазин {shop}',
+        # Category.name уникально: номер в названии, чтобы категорий могло быть больше, чем CATEGORY_NAMES
+        'categories': [{'id': pk, 'name': f'{CATEGORY_NAMES[pk % len(CATEGORY_NAMES)]} {pk}'} for pk in category_ids],
+        'goods': items,
+    }
+
+
+def write_feed(feed: dict, stream, fmt: str = 'yaml'):
+    if fmt == 'ndjson':
+        stream.write(json.dumps({'shop': feed['shop'], 'categories': feed['categories']}, ensure_ascii=False) + '\n')
+        for item in feed['goods']:
+            stream.write(json.dumps(item, ensure_ascii=False) + '\n')
+    else:
+        yaml.dump(feed, stream, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper), allow_unicode=True,
+                  sort_keys=False)
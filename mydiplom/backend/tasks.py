@@ -0,0 +1,91 @@
+import tempfile
+
+from asgiref.sync import sync_to_async
+from celery import shared_task
+
+from backend.batch import BatchImport
+from backend.feed import FEED_SPOOL_SIZE, feed_format, read_feed, download_feed, fetch_feed, iter_file
+from backend.importer import PriceListImporter
+from backend.notifications import flush_outbox
+from backend.models import ImportJob, Shop
+
+
+def import_feed(job: ImportJob, chunks, content_type: str):
+    """
+    Разбор и запись уже скачиваемого прайса: chunks — итератор байтовых блоков
+    """
+    job.set_phase('parsing')
+    fmt = feed_format(job.url, content_type)
+    shop, categories, goods = read_feed(chunks, fmt)
+    job.set_phase('importing')
+    importer = PriceListImporter(job.user, mode=job.mode, progress=job.report_progress)
+    stats = importer.run_feed(shop, categories, goods)
+    job.set_phase('done', rows_processed=importer.rows_processed, stats=stats, errors='\n'.join(importer.errors))
+
+
+def feed_shop(job: ImportJob) -> Shop | None:
+    """
+    Магазин, чьи сведения о прайсе используются для условного запроса; None - загрузить без проверки
+    """
+    return None if job.force else Shop.objects.filter(user_id=job.user_id).first()
+
+
+@shared_task
+def import_price_list(job_id: int):
+    """
+    Фоновая загрузка прайса поставщика по задаче ImportJob. Прайс скачивается условным запросом целиком
+    (до FEED_SPOOL_SIZE в памяти); на 304 или при том же SHA-256 загрузка пропускается
+    """
+    job = ImportJob.objects.select_related('user').get(id=job_id)
+    try:
+        job.set_phase('downloading')
+        shop = feed_shop(job)
+        with tempfile.SpooledTemporaryFile(max_size=FEED_SPOOL_SIZE) as body:
+            meta = fetch_feed(job.url, body, shop.feed_headers(job.url) if shop else None)
+            if job.skip_unchanged(shop, meta):
+                return
+            body.seek(0)
+            import_feed(job, iter_file(body), meta['content_type'])
+        Shop.remember_feed(job.user, job.url, meta)
+    except Exception as e:
+        job.set_phase('failed', errors=f'{type(e).__name__}: {e}')
+        raise
+
+
+@shared_task
+def import_price_lists(job_ids: list[int]) -> dict:
+    """
+    Пакетная загрузка прайсов многих поставщиков (BatchImport); ошибки каждого прайса сохраняются в его ImportJob
+    """
+    jobs = list(ImportJob.objects.select_related('user').filter(id__in=job_ids).order_by('id'))
+    return BatchImport(jobs).run()
+
+
+async def aimport_price_list(job_id: int):
+    """
+    Загрузка прайса без Celery для асинхронных представлений: скачивание идет в цикле событий,
+    разбор и запись — в потоке через sync_to_async. Ошибка, как и у задачи, сохраняется в ImportJob
+    """
+    job = await ImportJob.objects.select_related('user').aget(id=job_id)
+    try:
+        await sync_to_async(job.set_phase)('downloading')
+        shop = await sync_to_async(feed_shop)(job)
+        body, meta = await download_feed(job.url, shop.feed_headers(job.url) if shop else None)
+        if await sync_to_async(job.skip_unchanged)(shop, meta):
+            return
+        with body:
+            await sync_to_async(import_feed)(job, iter_file(body), meta['content_type'])
+        await sync_to_async(Shop.remember_feed)(job.user, job.url, meta)
+    except Exception as e:
+        await sync_to_async(job.set_phase)('failed', errors=f'{type(e).__name__}: {e}')
+
+
+@shared_task
+def send_queued_emails():
+    """
+    Отправка очереди писем; при ошибках задача перезапускается к моменту ближайшего повтора
+    """
+    result = flush_outbox()
+    if result['retry_in'] is not None and not send_queued_emails.app.conf.task_always_eager:
+        send_queued_emails.apply_async(countdown=result['retry_in'])
+    return result
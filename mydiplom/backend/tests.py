@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
 
-# Create your tests here.
+import yaml
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection, IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from backend.authentication import issue_token, lookup_token
+from backend.batch import BatchImport
+from backend.bulk import bulk_insert
+from backend.cache import catalog_cache
+from backend.export import iter_catalog
+from backend.feed import read_feed, validate_item
+from backend.importer import PriceListImporter
+from backend.search import FTS5SearchIndex, MemorySearchIndex, check_search_version
+from backend.synthetic import synthetic_feed, write_feed
+from backend.models import ImportJob, ProductInfo, Shop, Category, Product, ProductOffer, Order, OrderItem, \
+    Contact, OutgoingEmail, ProductParameter, AuthToken, ShopOrderLine
+from backend.management.commands.benchmark import compare
+from backend.metrics import RequestMetrics, current_request, enable_query_metrics, registry, sql_shape
+from backend.notifications import flush_outbox, reset_mail_connection
+from backend.tasks import aimport_price_list, send_queued_emails
+from backend.orders import parse_cart_lines, add_to_cart, apply_cart_change, rebuild_shop_lines, remove_from_cart
+from backend.prefetch import plan_queryset
+from backend.renderers import UJSONParser, UJSONRenderer
+from backend.serializers import OrderSerializer, ProductSerializer
+
+SHOP_FEED = Path(__file__).resolve().parent.parent.parent / 'data' / 'shop1.yaml'
+
+
+class FeedResponse:
+    def __init__(self, content: bytes, content_type: str = 'application/x-yaml'):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FeedServer(ThreadingHTTPServer):
+    """
+    Локальный HTTP-сервер с прайсами для проверки сетевой загрузки: {путь: (тело, Content-Type)}.
+    С validators=True отдает ETag и Last-Modified и отвечает 304 на совпавший If-None-Match
+    """
+
+    def __init__(self, feeds: dict[str, tuple[bytes, str]], validators: bool = False):
+        self.feeds = feeds
+        self.validators = validators
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), FeedRequestHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in self.server.feeds:
+            self.send_error(404)
+            return
+        self.server.requests.append((self.path, dict(self.headers)))
+        body, content_type = self.server.feeds[self.path]
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.server.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', 'Mon, 05 Oct 2026 10:00:00 GMT')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PartnerUpdateTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FeedServer({'/shop1.yaml': (SHOP_FEED.read_bytes(), 'application/x-yaml'),
+                                 '/broken.yaml': (b'shop: [broken', 'application/x-yaml')})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shop', email='shop@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_upload_runs_import_job(self):
+        response = self.client.post(reverse('partner-update'), {'url': self.server.url('/shop1.yaml')})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['Job']
+
+        response = self.client.get(reverse('partner-update-status', args=[job_id]))
+        job = response.json()['Job']
+        self.assertEqual(job['phase'], 'done')
+        self.assertEqual(job['rows_processed'], 14)
+        self.assertEqual(job['stats']['counts']['created'], 14)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.user).count(), 14)
+
+    def test_upload_reports_errors(self):
+        response = self.client.post(reverse('partner-update'), {'url': self.server.url('/broken.yaml')})
+        job = ImportJob.objects.get(id=response.json()['Job'])
+        self.assertEqual(job.phase, 'failed')
+        self.assertIn('Error', job.errors)
+
+    def test_status_shows_live_progress(self):
+        job = ImportJob.objects.create(user=self.user, url='http://example.com', phase='importing')
+        job.report_progress(7)
+        self.assertEqual(caches['progress'].get(job.progress_key), 7)
+        response = self.client.get(reverse('partner-update-status', args=[job.id]))
+        self.assertEqual(response.json()['Job']['rows_processed'], 7)
+
+    def test_status_of_foreign_job(self):
+        job = ImportJob.objects.create(user=User.objects.create_user(username='other'), url='http://example.com')
+        response = self.client.get(reverse('partner-update-status', args=[job.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalFetchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shop', email='shop@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def serve(self, validators: bool) -> FeedServer:
+        server = FeedServer({'/shop1.yaml': (SHOP_FEED.read_bytes(), 'application/x-yaml'),
+                             '/mirror/shop1.yaml': (SHOP_FEED.read_bytes(), 'application/x-yaml')}, validators)
+        self.addCleanup(server.stop)
+        return server
+
+    def upload(self, url: str, **data) -> ImportJob:
+        response = self.client.post(reverse('partner-update'), {'url': url, **data})
+        return ImportJob.objects.get(id=response.json()['Job'])
+
+    def test_not_modified(self):
+        server = self.serve(validators=True)
+        self.assertEqual(self.upload(server.url('/shop1.yaml')).rows_processed, 14)
+        ProductInfo.objects.update(price=1)
+        job = self.upload(server.url('/shop1.yaml'))
+        self.assertEqual((job.phase, job.stats), ('done', {'skipped': 'not_modified'}))
+        self.assertNotIn('If-None-Match', server.requests[0][1])
+        self.assertEqual(server.requests[1][1]['If-None-Match'], Shop.objects.get(user=self.user).feed_etag)
+        self.assertEqual(server.requests[1][1]['If-Modified-Since'], 'Mon, 05 Oct 2026 10:00:00 GMT')
+        self.assertFalse(ProductInfo.objects.exclude(price=1).exists())
+
+    def test_same_content_hash(self):
+        server = self.serve(validators=False)
+        self.upload(server.url('/shop1.yaml'))
+        job = self.upload(server.url('/shop1.yaml'))
+        self.assertEqual(job.stats, {'skipped': 'unchanged'})
+
+        server.feeds['/shop1.yaml'] = (SHOP_FEED.read_bytes().replace(b'price: 110000', b'price: 100000'),
+                                       'application/x-yaml')
+        job = self.upload(server.url('/shop1.yaml'))
+        self.assertEqual(job.stats['counts']['updated'], 1)
+
+    def test_force_and_other_url(self):
+        server = self.serve(validators=True)
+        self.upload(server.url('/shop1.yaml'))
+        job = self.upload(server.url('/shop1.yaml'), force='true')
+        self.assertEqual(job.stats['counts']['unchanged'], 14)
+        self.assertNotIn('If-None-Match', server.requests[1][1])
+        job = self.upload(server.url('/mirror/shop1.yaml'))
+        self.assertNotIn('If-None-Match', server.requests[2][1])
+        self.assertEqual(job.stats['counts']['unchanged'], 14)
+
+    def test_async_upload_force(self):
+        server = self.serve(validators=True)
+        key, _ = issue_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+
+        def upload(**data) -> ImportJob:
+            response = self.client.post(reverse('async-partner-update'), {'url': server.url('/shop1.yaml'), **data},
+                                        format='json')
+            return ImportJob.objects.get(id=response.json()['Job'])
+        self.assertEqual(upload().rows_processed, 14)
+        self.assertEqual(upload().stats, {'skipped': 'not_modified'})
+        job = upload(force=True)
+        self.assertTrue(job.force)
+        self.assertEqual(job.stats['counts']['unchanged'], 14)
+
+    def test_batch_and_async_skip(self):
+        server = self.serve(validators=True)
+        job = ImportJob.objects.create(user=self.user, url=server.url('/shop1.yaml'))
+        self.assertEqual(BatchImport([job], processes=1).run()['rows'], 14)
+        job = ImportJob.objects.create(user=self.user, url=server.url('/shop1.yaml'))
+        report = BatchImport([job], processes=1).run()
+        self.assertEqual((report['rows'], report['feeds'][0]['skipped']), (0, 'not_modified'))
+
+        async_to_sync(aimport_price_list)(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.stats, {'skipped': 'not_modified'})
+
+
+class FeedTests(TestCase):
+    def test_yaml_feed_matches_safe_load(self):
+        content = SHOP_FEED.read_bytes()
+        data = yaml.safe_load(content)
+        shop, categories, goods = read_feed(FeedResponse(content).iter_content(100))
+        self.assertEqual(shop, data['shop'])
+        self.assertEqual(categories, data['categories'])
+        self.assertEqual(list(goods), data['goods'])
+
+    def test_ndjson_feed(self):
+        data = yaml.safe_load(SHOP_FEED.read_bytes())
+        lines = [json.dumps({'shop': data['shop'], 'categories': data['categories']})]
+        lines += [json.dumps(item) for item in data['goods']]
+        content = '\n'.join(lines).encode()
+        shop, categories, goods = read_feed(FeedResponse(content).iter_content(50), 'ndjson')
+        self.assertEqual((shop, categories, list(goods)), (data['shop'], data['categories'], data['goods']))
+
+
+class ImporterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shop')
+        self.data = yaml.safe_load(SHOP_FEED.read_bytes())
+
+    def test_bulk_import(self):
+        with CaptureQueriesContext(connection) as captured:
+            stats = PriceListImporter(self.user).run(self.data)
+        self.assertLessEqual(len(captured), 30)
+        self.assertLessEqual({'shop', 'categories', 'products', 'parameters', 'product_infos', 'product_parameters',
+                              'offers', 'search', 'total'}, set(stats['timings']))
+        parameters = sum(len(item['parameters']) for item in self.data['goods'])
+        self.assertEqual(stats['counts'], {
+            'categories': 4, 'products_created': 14, 'parameters_created': 10, 'created': 14, 'updated': 0,
+            'unchanged': 0, 'product_parameters_created': parameters, 'product_parameters_updated': 0,
+            'product_parameters_deleted': 0, 'deleted': 0, 'offers': 14,
+        })
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.user).count(), 14)
+        self.assertEqual(ProductParameter.objects.count(), parameters)
+        info = ProductInfo.objects.get(external_id=4216292)
+        self.assertEqual(dict(info.product_parameters.values_list('parameter__name', 'value')),
+                         {name: str(value) for name, value in self.data['goods'][0]['parameters'].items()})
+
+    def test_sync_diff(self):
+        PriceListImporter(self.user).run(self.data)
+        goods = self.data['goods']
+        goods[0]['price'] = 100000
+        goods[1]['parameters']['Цвет'] = 'синий'
+        del goods[1]['parameters']['Диагональ (дюйм)']
+        goods[2]['parameters']['Вес (г)'] = 194
+        removed = goods.pop()
+        goods.append({**goods[3], 'id': 1, 'name': 'Новый товар'})
+        stats = PriceListImporter(self.user).run(self.data)
+        self.assertEqual({name: stats['counts'][name] for name in (
+            'created', 'updated', 'unchanged', 'deleted', 'product_parameters_created', 'product_parameters_updated',
+            'product_parameters_deleted')}, {'created': 1, 'updated': 1, 'unchanged': 12, 'deleted': 1,
+                                             'product_parameters_created': 1 + len(goods[3]['parameters']),
+                                             'product_parameters_updated': 1, 'product_parameters_deleted': 1})
+        self.assertFalse(ProductInfo.objects.filter(external_id=removed['id']).exists())
+        self.assertEqual(ProductInfo.objects.get(external_id=goods[0]['id']).price, 100000)
+        self.assertEqual(dict(ProductInfo.objects.get(external_id=goods[1]['id']).product_parameters.values_list(
+            'parameter__name', 'value')), {name: str(value) for name, value in goods[1]['parameters'].items()})
+
+        stats = PriceListImporter(self.user).run(self.data)
+        self.assertEqual((stats['counts']['unchanged'], stats['counts']['updated'], stats['counts']['deleted']),
+                         (14, 0, 0))
+
+    def test_category_name_conflict(self):
+        existing = Category.objects.create(id=500, name='Смартфоны')
+        importer = PriceListImporter(self.user)
+        stats = importer.run(self.data)
+        self.assertEqual(stats['counts']['category_conflicts'], 1)
+        self.assertFalse(Category.objects.filter(id=224).exists())
+        self.assertEqual(Product.objects.filter(category=existing).count(),
+                         sum(1 for item in self.data['goods'] if item['category'] == 224))
+        self.assertIn(existing, Shop.objects.get(user=self.user).categories.all())
+        self.assertEqual(importer.errors, ['Категория 224 "Смартфоны" уже есть с id 500: товары отнесены к ней'])
+
+    def test_queries_are_batched(self):
+        # 500 позиций и 2000 параметров пишутся пакетами: запросов на порядок меньше, чем строк
+        with CaptureQueriesContext(connection) as captured:
+            PriceListImporter(self.user).run(synthetic_feed(1, goods=500))
+        self.assertEqual(ProductParameter.objects.count(), 2000)
+        self.assertLess(len(captured), 50)
+
+
+class ProductsTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        for i in range(3):
+            category = Category.objects.create(name=f'Категория {i}')
+            for j in range(3):
+                user = User.objects.create_user(username=f'shop-{i}-{j}')
+                category.shops.add(Shop.objects.create(name=f'Магазин {i}-{j}', user=user))
+            for j in range(5):
+                Product.objects.create(name=f'Товар {i}-{j}', category=category)
+        self.client = APIClient()
+
+    def test_list_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('products'))
+        results = response.json()['results']
+        self.assertEqual(len(results), 15)
+        self.assertEqual(len(results[0]['category']['shops']), 3)
+        self.assertIsNotNone(results[0]['category']['shops'][0]['user']['username'])
+
+    def test_cursor_pagination(self):
+        names = []
+        url = reverse('products') + '?page_size=4'
+        while url:
+            with self.assertNumQueries(2):
+                page = self.client.get(url).json()
+            names += [product['name'] for product in page['results']]
+            url = page['next']
+        self.assertEqual(names, sorted(Product.objects.values_list('name', flat=True)))
+
+    def test_sparse_fields_and_filters(self):
+        category = Category.objects.get(name='Категория 1')
+        shop = Shop.objects.get(name='Магазин 2-0')
+        product = Product.objects.get(name='Товар 2-3')
+        ProductInfo.objects.create(product=product, shop=shop, quantity=1, price=1, price_rrc=1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('products'), {'fields': 'id,name', 'category': category.id})
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set(results[0]), {'id', 'name'})
+
+        response = self.client.get(reverse('products'), {'shop': shop.id})
+        self.assertEqual([item['id'] for item in response.json()['results']], [product.id])
+        self.assertEqual(self.client.get(reverse('products'), {'shop': 'x'}).status_code, 400)
+
+    def test_detail_query_budget(self):
+        product = Product.objects.first()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product_one', args=[product.id]))
+        self.assertEqual(response.json()['name'], product.name)
+
+    def test_cache_invalidated_by_import(self):
+        user = User.objects.create_user(username='supplier')
+        data = yaml.safe_load(SHOP_FEED.read_bytes())
+        hits = catalog_cache.hits
+        self.assertEqual(self.client.get(reverse('products')).headers['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('products')).headers['X-Cache'], 'HIT')
+        self.assertEqual(catalog_cache.hits, hits + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(user).run(data)
+        response = self.client.get(reverse('products'), {'page_size': 100})
+        self.assertEqual(len(response.json()['results']), 15 + len(data['goods']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(user).run(data)
+        self.assertEqual(self.client.get(reverse('products'), {'page_size': 100}).headers['X-Cache'], 'HIT')
+
+        data['goods'][0]['price'] = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(user).run(data)
+        response = self.client.get(reverse('products'), {'page_size': 100, 'sort': 'price'})
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['offer']['min_price'], 1)
+
+    def test_offer_aggregates(self):
+        product = Product.objects.get(name='Товар 0-0')
+        for external_id, (shop, price, quantity) in enumerate([('Магазин 0-0', 100, 3), ('Магазин 0-1', 80, 2),
+                                                               ('Магазин 0-1', 120, 1)]):
+            ProductInfo.objects.create(product=product, shop=Shop.objects.get(name=shop), price=price,
+                                       price_rrc=price, quantity=quantity, external_id=external_id)
+        ProductOffer.refresh([product.id])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('products'), {'sort': 'price'})
+        self.assertEqual(response.json()['results'], [self.client.get(reverse('product_one', args=[product.id])).json()])
+        self.assertEqual(response.json()['results'][0]['offer'],
+                         {'min_price': 80, 'max_price': 120, 'total_quantity': 6, 'shop_count': 2})
+
+        ProductInfo.objects.filter(product=product).delete()
+        ProductOffer.refresh([product.id])
+        self.assertFalse(ProductOffer.objects.exists())
+
+
+class ProductFacetSearchTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='shop')
+        PriceListImporter(user).run(yaml.safe_load(SHOP_FEED.read_bytes()))
+        self.client = APIClient()
+
+    def test_typed_conditions_and_facets(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('products-facets'),
+                                       {'p': ['Встроенная память (Гб)>=256', 'Цвет=черный']})
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['product_name'], 'Смартфон Apple iPhone XR 256GB (черный)')
+        self.assertEqual(data['facets']['Цвет'], [{'value': 'черный', 'count': 1}])
+
+        data = self.client.get(reverse('products-facets'), {'p': 'Диагональ (дюйм)<6.2'}).json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['facets']['Диагональ (дюйм)'], [{'value': '6.1', 'count': 3}])
+
+    def test_invalid_conditions(self):
+        self.assertEqual(self.client.get(reverse('products-facets'), {'p': 'Цвет>черный'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('products-facets'), {'p': 'Нет такого=1'}).status_code, 400)
+
+
+class ProductTextSearchTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.user = User.objects.create_user(username='shop')
+        self.data = yaml.safe_load(SHOP_FEED.read_bytes())
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(self.user).run(self.data)
+        self.client = APIClient()
+
+    def search(self, query: str) -> list[str]:
+        response = self.client.get(reverse('products-search'), {'q': query})
+        return [item['product_name'] for item in response.json()['results']]
+
+    def test_russian_tokens_and_ranking(self):
+        self.assertEqual(self.search('смартфоны XR черного'), ['Смартфон Apple iPhone XR 256GB (черный)'])
+        self.assertEqual(len(self.search('Смартфон apple/iphone/xr')), 3)
+        self.assertEqual(self.search('несуществующий'), [])
+
+    def test_incremental_update(self):
+        self.data['goods'][0]['name'] = 'Смартфон Apple iPhone XS Max 512GB (серебристый)'
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(self.user).run(self.data)
+        self.assertEqual(self.search('серебристого'), ['Смартфон Apple iPhone XS Max 512GB (серебристый)'])
+        self.assertEqual(self.search('золотистый'), [])
+
+    def test_memory_index_matches_fts5(self):
+        index = MemorySearchIndex()
+        for query in ('смартфон xr', 'apple 512', 'телевизор', 'флешк'):
+            self.assertEqual(set(index.search(query, 50)), set(FTS5SearchIndex().search(query, 50)), query)
+
+    @override_settings(SEARCH_BACKEND='memory', CELERY_TASK_ALWAYS_EAGER=False)
+    def test_memory_index_requires_shared_cache(self):
+        self.assertEqual([warning.id for warning in check_search_version()], ['backend.W001'])
+        shared = {**settings.CACHES, 'catalog': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                 'LOCATION': tempfile.gettempdir()}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_search_version(), [])
+
+
+class MemorySearchRebuildTests(TransactionTestCase):
+    def create_offer(self, external_id: int, name: str):
+        ProductInfo.objects.create(product=Product.objects.create(name=name), shop=self.shop, external_id=external_id,
+                                   quantity=1, price=10, price_rrc=10)
+
+    def test_stale_index_is_rebuilt_in_background(self):
+        caches['catalog'].clear()
+        self.shop = Shop.objects.create(name='Магазин')
+        self.create_offer(1, 'Смартфон')
+        index = MemorySearchIndex()
+        first = index.search('смартфон', 10)
+        self.create_offer(2, 'Смартфон складной')
+        # так новую версию видит процесс, в котором импорт не шел
+        catalog_cache.invalidate('search')
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search('смартфон', 10), first)
+        index.rebuilding.join()
+        self.assertEqual(len(index.search('смартфон', 10)), 2)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ConfirmCartTests(TransactionTestCase):
+    def setUp(self):
+        shop = Shop.objects.create(name='Магазин')
+        product = Product.objects.create(name='Товар')
+        self.product_info = ProductInfo.objects.create(product=product, shop=shop, quantity=3, price=10,
+                                                       price_rrc=10)
+
+    def create_cart(self, username: str, quantity: int = 1) -> User:
+        user = User.objects.create_user(username=username, email=f'{username}@example.com')
+        Contact.objects.create(user=user, type='home', value='Москва')
+        order = Order.objects.create(user=user, status='cart')
+        OrderItem.objects.create(order=order, product_info=self.product_info, shop=self.product_info.shop,
+                                 quantity=quantity)
+        return user
+
+    def confirm(self, user: User):
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            return client.post(reverse('order-cart-confirm'), {'address': 'home'}).status_code
+        finally:
+            connection.close()
+
+    def test_insufficient_stock_rolls_back(self):
+        user = self.create_cart('buyer', quantity=5)
+        self.assertEqual(self.confirm(user), 409)
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 3)
+        self.assertEqual(Order.objects.get(user=user).status, 'cart')
+
+    def test_confirmation_invalidates_shop_scope(self):
+        shop_scope = f'shop:{self.product_info.shop_id}'
+        versions = catalog_cache.version('catalog'), catalog_cache.version(shop_scope)
+        self.assertEqual(self.confirm(self.create_cart('buyer')), 201)
+        self.assertEqual(catalog_cache.version('catalog'), versions[0])
+        self.assertNotEqual(catalog_cache.version(shop_scope), versions[1])
+
+    def test_parallel_adds_keep_every_increment(self):
+        user = self.create_cart('buyer')
+        lines = {self.product_info.id: {'quantity': 1, 'shop_id': None}}
+
+        def add(_):
+            try:
+                apply_cart_change(user, add_to_cart, lines)
+            finally:
+                connection.close()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(add, range(8)))
+        self.assertEqual(OrderItem.objects.get(order__user=user).quantity, 9)
+
+    def test_parallel_add_and_remove_keep_every_change(self):
+        user = self.create_cart('buyer', quantity=10)
+
+        def change(step):
+            try:
+                apply_cart_change(user, *step)
+            finally:
+                connection.close()
+        steps = [(add_to_cart, {self.product_info.id: {'quantity': 2, 'shop_id': None}}),
+                 (remove_from_cart, {self.product_info.id: {'quantity': 1}})] * 4
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(change, steps))
+        self.assertEqual(OrderItem.objects.get(order__user=user).quantity, 14)
+
+    def test_parallel_confirmations(self):
+        users = [self.create_cart(f'buyer-{i}') for i in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(self.confirm, users))
+        self.assertEqual(sorted(codes), [201] * 3 + [409] * 5)
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 0)
+        self.assertEqual(Order.objects.filter(status='confirmed').count(), 3)
+        self.assertEqual(ProductOffer.objects.get(product=self.product_info.product).total_quantity, 0)
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        reset_mail_connection()
+
+    def test_registration_email_is_queued_and_sent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(reverse('user-register'), {'username': 'buyer', 'email': 'buyer@example.com'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_batch_uses_one_connection(self):
+        for i in range(5):
+            OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=[f'user{i}@example.com'])
+        with patch('backend.notifications.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(flush_outbox(batch_size=2)['sent'], 5)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        email = OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=['user@example.com'])
+        with patch('backend.notifications.get_connection', side_effect=ConnectionError('smtp down')):
+            result = flush_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('smtp down', email.last_error)
+        self.assertGreater(result['retry_in'], 0)
+
+        email.next_attempt_at = timezone.now()
+        email.save()
+        self.assertEqual(flush_outbox()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unavailable_server_stops_flush(self):
+        emails = [OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=[f'user{i}@example.com'])
+                  for i in range(5)]
+        with patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('smtp down')) as open_:
+            result = flush_outbox(batch_size=2)
+        self.assertEqual(open_.call_count, 1)
+        self.assertEqual(result['sent'], 0)
+        self.assertGreater(result['retry_in'], 0)
+        self.assertEqual(list(OutgoingEmail.objects.order_by('id').values_list('status', 'attempts')),
+                         [('pending', 1)] + [('pending', 0)] * 4)
+        self.assertIn('smtp down', OutgoingEmail.objects.get(id=emails[0].id).last_error)
+        self.assertEqual(mail.outbox, [])
+
+    def test_periodic_flush_sends_backed_off_email(self):
+        self.assertEqual(settings.CELERY_BEAT_SCHEDULE['flush-outbox']['task'], send_queued_emails.name)
+        email = OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=['user@example.com'],
+                                             attempts=1, next_attempt_at=timezone.now() - timedelta(seconds=1))
+        stdout = io.StringIO()
+        call_command('flush_outbox', stdout=stdout)
+        self.assertIn('Отправлено писем: 1', stdout.getvalue())
+        self.assertFalse(OutgoingEmail.objects.filter(id=email.id).exists())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class CartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        self.shop = Shop.objects.create(name='Магазин')
+        self.infos = [ProductInfo.objects.create(product=Product.objects.create(name=f'Товар {i}'), shop=self.shop,
+                                                 external_id=i, quantity=100, price=10, price_rrc=10)
+                      for i in range(20)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, infos, quantity: int = 1):
+        return self.client.post(reverse('add-products'), {'product_info_ids': [
+            {'id': info.id, 'quantity': quantity, 'shop_id': self.shop.id} for info in infos
+        ]}, format='json')
+
+    def cart_lines(self) -> dict[int, int]:
+        return dict(OrderItem.objects.filter(order__user=self.user).values_list('product_info_id', 'quantity'))
+
+    def test_add_merges_quantities(self):
+        self.add(self.infos[:2])
+        response = self.add([self.infos[0], self.infos[0]], quantity=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_lines(), {self.infos[0].id: 5, self.infos[1].id: 1})
+        self.assertEqual(len(response.json()['cart']['ordered_items']), 2)
+
+    def test_bounded_queries(self):
+        cart = Order.objects.create(user=self.user, status='cart')
+        lines = parse_cart_lines([{'id': info.id, 'quantity': 1, 'shop_id': self.shop.id} for info in self.infos],
+                                 'id', shop_key='shop_id')
+        with self.assertNumQueries(2):
+            add_to_cart(cart, lines)
+        with self.assertNumQueries(2):
+            add_to_cart(cart, lines)
+        self.assertEqual(set(self.cart_lines().values()), {2})
+
+    def test_set_and_delete(self):
+        self.add(self.infos[:3], quantity=3)
+        self.client.post(reverse('set-products'), {'order_items': [
+            {'id': self.infos[0].id, 'quantity': 7}, {'id': self.infos[1].id, 'quantity': 0},
+        ]}, format='json')
+        self.client.post(reverse('delete-products'), {'order_items': [
+            {'product_id': self.infos[2].id, 'quantity': 1}, {'product_id': self.infos[0].id, 'quantity': 7},
+        ]}, format='json')
+        self.assertEqual(self.cart_lines(), {self.infos[2].id: 2})
+
+    def test_invalid_lines(self):
+        other = Shop.objects.create(name='Другой')
+        response = self.client.post(reverse('add-products'), {'product_info_ids': [
+            {'id': self.infos[0].id, 'quantity': 1, 'shop_id': other.id}]}, format='json')
+        self.assertEqual(response.status_code, 422)
+        response = self.client.post(reverse('add-products'), {'product_info_ids': [
+            {'id': 0, 'quantity': 1, 'shop_id': self.shop.id}]}, format='json')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.cart_lines(), {})
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        shops = [Shop.objects.create(name=f'Магазин {i}', user=User.objects.create_user(username=f'shop-{i}'))
+                 for i in range(3)]
+        infos = [ProductInfo.objects.create(product=Product.objects.create(name=f'Товар {i}'), shop=shops[i % 3],
+                                            external_id=i, quantity=100, price=10 * (i + 1), price_rrc=10)
+                 for i in range(6)]
+        for i in range(30):
+            order = Order.objects.create(user=self.user, status='cart' if i == 0 else 'confirmed')
+            for info in infos[i % 4:i % 4 + 3]:
+                OrderItem.objects.create(order=order, product_info=info, shop=info.shop, quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_history_page_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order-list'), {'page_size': 25})
+        orders = response.json()['results']
+        self.assertEqual(len(orders), 25)
+        self.assertIsNotNone(response.json()['next'])
+        for order in orders:
+            self.assertEqual(len(order['ordered_items']), 3)
+            self.assertEqual(order['total'], sum(item['total'] for item in order['ordered_items']))
+            self.assertEqual(order['ordered_items'][0]['total'],
+                             order['ordered_items'][0]['quantity'] * order['ordered_items'][0]['product_info']['price'])
+
+    def test_show_cart_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order-cart'))
+        self.assertEqual(response.json()['status'], 'cart')
+        self.assertEqual(response.json()['total'], 2 * (10 + 20 + 30))
+
+
+class ConstraintTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_single_cart_per_user(self):
+        Order.objects.create(user=self.user, status='cart')
+        Order.objects.create(user=self.user, status='confirmed')
+        Order.objects.create(user=self.user, status='confirmed')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, status='cart')
+
+    def test_duplicate_contact_rejected(self):
+        data = {'type': 'address', 'value': 'Москва'}
+        self.assertEqual(self.client.post(reverse('contact-create'), data).status_code, 201)
+        response = self.client.post(reverse('contact-create'), data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Contact.objects.filter(user=self.user).count(), 1)
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_sqlite_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Настройки для SQLite')
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+
+    def test_bulk_insert_assigns_ids(self):
+        shop = Shop.objects.create(name='Магазин', user=User.objects.create_user(username='supplier'))
+        product = Product.objects.create(name='Товар')
+        infos = bulk_insert(ProductInfo, [ProductInfo(product=product, shop=shop, external_id=i, quantity=1,
+                                                      price=10, price_rrc=10) for i in range(3)], key='external_id')
+        self.assertEqual({info.external_id: info.id for info in infos},
+                         dict(ProductInfo.objects.values_list('external_id', 'id')))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FeedServer({'/shop1.yaml': (SHOP_FEED.read_bytes(), 'application/x-yaml')})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shop', email='shop@example.com', password='password')
+        credentials = base64.b64encode(b'shop:password').decode()
+        self.auth = {'HTTP_AUTHORIZATION': f'Basic {credentials}'}
+
+    def post(self, name: str, data: dict, **extra):
+        return self.client.post(reverse(name), data, content_type='application/json', **{**self.auth, **extra})
+
+    def test_upload_downloads_feed(self):
+        response = self.post('async-partner-update', {'url': self.server.url('/shop1.yaml')})
+        self.assertEqual(response.status_code, 202)
+        response = self.client.get(reverse('async-partner-update-status', args=[response.json()['Job']]),
+                                   **self.auth)
+        job = response.json()['Job']
+        self.assertEqual(job['phase'], 'done')
+        self.assertEqual(job['rows_processed'], 14)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.user).count(), 14)
+
+    def test_upload_reports_http_errors(self):
+        response = self.post('async-partner-update', {'url': self.server.url('/missing.yaml')})
+        job = ImportJob.objects.get(id=response.json()['Job'])
+        self.assertEqual(job.phase, 'failed')
+        self.assertIn('HTTPStatusError', job.errors)
+
+    def test_login_required(self):
+        response = self.post('async-partner-update', {'url': self.server.url('/shop1.yaml')},
+                             HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'shop:wrong').decode())
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_registration(self):
+        response = self.client.post(reverse('async-user-register'), {'username': 'buyer', 'email': 'b@example.com'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.get(username='buyer').has_usable_password())
+        self.assertEqual(OutgoingEmail.objects.get().recipients, ['b@example.com'])
+        response = self.client.post(reverse('async-user-register'), {'username': 'buyer'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cart(self):
+        shop = Shop.objects.create(name='Магазин')
+        infos = [ProductInfo.objects.create(product=Product.objects.create(name=f'Товар {i}'), shop=shop,
+                                            external_id=i, quantity=100, price=10, price_rrc=10) for i in range(3)]
+        self.assertEqual(self.client.get(reverse('async-order-cart'), **self.auth).json(),
+                         {'message': 'Ваша корзина пуста'})
+        response = self.post('async-add-products', {'product_info_ids': [
+            {'id': info.id, 'quantity': 2, 'shop_id': shop.id} for info in infos]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['cart']['ordered_items']), 3)
+        self.post('async-set-products', {'order_items': [{'id': infos[0].id, 'quantity': 5}]})
+        self.post('async-delete-products', {'order_items': [{'product_id': infos[1].id, 'quantity': 2}]})
+        cart = self.client.get(reverse('async-order-cart'), **self.auth).json()
+        self.assertEqual({item['product_info']['id']: item['quantity'] for item in cart['ordered_items']},
+                         {infos[0].id: 5, infos[2].id: 2})
+        response = self.post('async-add-products', {'product_info_ids': [{'id': 0, 'quantity': 1, 'shop_id': 1}]})
+        self.assertEqual(response.status_code, 422)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TokenAuthTests(TestCase):
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client = APIClient()
+
+    def issue(self) -> str:
+        credentials = base64.b64encode(b'buyer:password').decode()
+        response = self.client.post(reverse('authorization'), HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['token']
+
+    def test_issue_stores_digest_only(self):
+        key = self.issue()
+        token = AuthToken.objects.get(user=self.user)
+        self.assertNotEqual(token.digest, key)
+        self.assertGreater(token.expires_at, timezone.now())
+
+    def test_token_lookup_is_cached(self):
+        key = self.issue()
+        for scheme in ('Token', 'Bearer'):
+            response = self.client.get(reverse('order-cart'), HTTP_AUTHORIZATION=f'{scheme} {key}')
+            self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(lookup_token(key), self.user)
+        self.assertEqual(len(captured), 0)
+
+    def test_expired_token_rejected(self):
+        key, token = issue_token(self.user)
+        AuthToken.objects.filter(pk=token.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.get(reverse('order-cart'), HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoke(self):
+        key = self.issue()
+        self.client.get(reverse('order-cart'), HTTP_AUTHORIZATION=f'Token {key}')
+        response = self.client.delete(reverse('authorization'), HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('order-cart'), HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(AuthToken.objects.exists())
+
+    def test_deactivated_user_rejected(self):
+        key = self.issue()
+        self.assertEqual(lookup_token(key), self.user)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('order-cart'), HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_async_view_accepts_token(self):
+        key = self.issue()
+        response = self.client.get(reverse('async-order-cart'), HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('async-order-cart'), HTTP_AUTHORIZATION='Token wrong')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_SERVER_TIMING=True, METRICS_N_PLUS_ONE_THRESHOLD=3)
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        caches['catalog'].clear()
+
+    def test_request_metrics_exposed(self):
+        Product.objects.create(name='Товар')
+        response = self.client.get(reverse('products'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", render')
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_requests_total{view="api/v1/products",method="GET",status="200"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{view="api/v1/products",method="GET"} 1', metrics)
+        self.assertIn('http_response_size_bytes_bucket{view="api/v1/products",method="GET",le="+Inf"} 1', metrics)
+        self.assertNotIn('db_n_plus_one_total{', metrics)
+
+    def test_repeated_queries_flagged(self):
+        request_metrics = RequestMetrics('GET')
+        token = current_request.set(request_metrics)
+        enable_query_metrics()
+        try:
+            for pk in range(3):
+                list(Product.objects.filter(id=pk))
+            list(Product.objects.filter(id__in=[1, 2]))
+            list(Product.objects.filter(id__in=[1, 2, 3]))
+        finally:
+            current_request.reset(token)
+        with self.assertLogs('backend.metrics', 'WARNING'):
+            request_metrics.finish(3)
+        self.assertEqual(request_metrics.query_count, 5)
+        self.assertEqual(list(request_metrics.repeated.values()), [3])
+        self.assertEqual(sql_shape('SELECT 1 WHERE id IN (%s, %s, %s)'), 'SELECT 1 WHERE id IN (%s...)')
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('products'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('http_requests_total{', self.client.get(reverse('metrics')).content.decode())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.feed = yaml.safe_load(SHOP_FEED.read_bytes())
+        self.user = User.objects.create_user(username='shop', email='shop@example.com')
+        PriceListImporter(self.user).run(self.feed)
+        self.shop = Shop.objects.get(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_catalog_round_trip(self):
+        for fmt in ('yaml', 'ndjson'):
+            response = self.client.get(reverse('partner-export'), {'type': fmt})
+            self.assertTrue(response.streaming)
+            shop, categories, goods = read_feed(response.streaming_content, fmt)
+            self.assertEqual(shop, self.feed['shop'])
+            self.assertEqual(sorted(categories, key=lambda category: category['id']),
+                             sorted(self.feed['categories'], key=lambda category: category['id']))
+            self.assertEqual(list(goods), self.feed['goods'])
+
+    def test_catalog_prefetch_per_chunk(self):
+        with self.assertNumQueries(5):  # категории, товары одним курсором, параметры на каждую из 3 порций
+            chunks = list(iter_catalog(self.shop, 'ndjson', chunk_size=5))
+        self.assertEqual(len(chunks), 4)
+
+    def test_orders(self):
+        infos = list(ProductInfo.objects.order_by('id')[:2])
+        for status in ('confirmed', 'cart'):
+            order = Order.objects.create(user=self.user, status=status)
+            for info in infos:
+                OrderItem.objects.create(order=order, product_info=info, shop=self.shop, quantity=2)
+        response = self.client.get(reverse('order-export'))
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0].split(',')[:3], ['order', 'dt', 'status'])
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(rows[1].endswith(f',2,{infos[0].price},{2 * infos[0].price}'))
+
+        response = self.client.get(reverse('order-export'), {'type': 'ndjson'})
+        orders = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([order['status'] for order in orders], ['confirmed'])
+        self.assertEqual(orders[0]['total'], 2 * infos[0].price + 2 * infos[1].price)
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('export', 'catalog', '--shop', self.shop.name, '--format', 'ndjson', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), len(self.feed['goods']) + 1)
+
+
+class PartnerOrdersTests(TestCase):
+    def setUp(self):
+        self.suppliers = [User.objects.create_user(username=f'supplier{index}') for index in range(2)]
+        product = Product.objects.create(name='Товар')
+        shops = [Shop.objects.create(name=f'Магазин {index}', user=user) for index, user in enumerate(self.suppliers)]
+        self.infos = [ProductInfo.objects.create(product=product, shop=shop, external_id=index + 1, model='m',
+                                                 quantity=10, price=100 + index, price_rrc=100)
+                      for index, shop in enumerate(shops)]
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        Contact.objects.create(user=self.buyer, type='home', value='Москва')
+        self.client = APIClient()
+
+    def confirm(self, quantity: int = 1):
+        self.client.force_authenticate(self.buyer)
+        order = Order.objects.create(user=self.buyer, status='cart')
+        for info in self.infos:
+            OrderItem.objects.create(order=order, product_info=info, shop=info.shop, quantity=quantity)
+        self.assertEqual(self.client.post(reverse('order-cart-confirm'), {'address': 'home'}).status_code, 201)
+        return order
+
+    def poll(self, supplier: User, **params) -> dict:
+        self.client.force_authenticate(supplier)
+        response = self.client.get(reverse('partner-orders'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lines_recorded_on_confirmation(self):
+        order = self.confirm(quantity=2)
+        data = self.poll(self.suppliers[1])
+        self.assertEqual(len(data['Lines']), 1)
+        line = data['Lines'][0]
+        self.assertEqual((line['order_id'], line['product_info_id'], line['total'], line['buyer'], line['address']),
+                         (order.id, self.infos[1].id, 2 * 101, 'buyer', 'Москва'))
+
+    def test_since_cursor(self):
+        self.confirm()
+        first = self.poll(self.suppliers[0])
+        self.confirm()
+        self.client.force_authenticate(self.suppliers[0])
+        with self.assertNumQueries(2):
+            self.client.get(reverse('partner-orders'), {'since': first['Cursor']})
+        second = self.poll(self.suppliers[0], since=first['Cursor'])
+        self.assertEqual(len(second['Lines']), 1)
+        self.assertGreater(second['Cursor'], first['Cursor'])
+        self.assertEqual(self.poll(self.suppliers[0], since=second['Cursor'])['Lines'], [])
+        self.assertTrue(self.poll(self.suppliers[0], limit=1)['More'])
+
+    def test_rebuild(self):
+        self.confirm()
+        ShopOrderLine.objects.all().delete()
+        self.assertEqual(rebuild_shop_lines(chunk_size=1), 2)
+        self.assertEqual(len(self.poll(self.suppliers[0])['Lines']), 1)
+
+
+class BatchImportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        broken = synthetic_feed(2, goods=5)
+        broken['goods'][0]['price'] = -1
+        del broken['goods'][1]['name']
+        ndjson = io.StringIO()
+        write_feed(broken, ndjson, 'ndjson')
+        feed = io.StringIO()
+        write_feed(synthetic_feed(1, goods=14), feed)
+        # синтетические прайсы делят id категорий между собой, но не с data/shop1.yaml
+        cls.server = FeedServer({
+            '/shop1.yaml': (feed.getvalue().encode(), 'application/x-yaml'),
+            '/shop2.ndjson': (ndjson.getvalue().encode(), 'application/x-ndjson'),
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.suppliers = [User.objects.create_user(username=f'supplier{index}') for index in range(1, 4)]
+
+    def test_validate_item(self):
+        item = {'id': 1, 'category': 5, 'model': 'm', 'name': 'Товар', 'price': 10, 'price_rrc': 12, 'quantity': 0}
+        self.assertIsNone(validate_item(item, {5}))
+        self.assertIn('категория', validate_item(item, {6}))
+        self.assertIn('quantity', validate_item({**item, 'quantity': '3'}, {5}))
+        self.assertIn('name', validate_item({key: value for key, value in item.items() if key != 'name'}, {5}))
+
+    def test_endpoint(self):
+        admin = User.objects.create_user(username='admin', is_staff=True)
+        client = APIClient()
+        feeds = [{'user': 'supplier1', 'url': self.server.url('/shop1.yaml')},
+                 {'user': 'supplier2', 'url': self.server.url('/shop2.ndjson')},
+                 {'user': 'supplier3', 'url': self.server.url('/missing.yaml')}]
+        client.force_authenticate(self.suppliers[0])
+        self.assertEqual(client.post(reverse('partner-batch-update'), {'feeds': feeds}, format='json').status_code,
+                         403)
+
+        client.force_authenticate(admin)
+        response = client.post(reverse('partner-batch-update'), {'feeds': feeds}, format='json')
+        self.assertEqual(response.status_code, 202)
+        jobs = [ImportJob.objects.get(id=job_id) for job_id in response.json()['Jobs']]
+        self.assertEqual([job.phase for job in jobs], ['done', 'done', 'failed'])
+        self.assertEqual(jobs[0].rows_processed, 14)
+        self.assertEqual((jobs[1].rows_processed, jobs[1].stats['counts']['invalid']), (3, 2))
+        self.assertIn('price', jobs[1].errors)
+        self.assertIn('HTTPError', jobs[2].errors)
+        status = client.get(reverse('partner-update-status', args=[jobs[1].id])).json()
+        self.assertEqual(status['Job']['phase'], 'done')
+
+    def batch_jobs(self) -> list[ImportJob]:
+        return ImportJob.objects.bulk_create([
+            ImportJob(user=self.suppliers[0], url=self.server.url('/shop1.yaml'), mode='sync'),
+            ImportJob(user=self.suppliers[1], url=self.server.url('/shop2.ndjson'), mode='sync')])
+
+    def test_daemon_process_parses_in_threads(self):
+        # так выглядит процесс пула prefork Celery: ProcessPoolExecutor в нем бросает AssertionError
+        process = multiprocessing.current_process()
+        process.daemon = True
+        try:
+            report = BatchImport(self.batch_jobs(), processes=2).run()
+        finally:
+            process.daemon = False
+        self.assertEqual([feed['error'] for feed in report['feeds']], ['', ''])
+        self.assertEqual(report['rows'], 17)
+        self.assertEqual(list(ImportJob.objects.order_by('id').values_list('phase', flat=True)), ['done', 'done'])
+
+    def test_pool_start_failure_fails_jobs(self):
+        with patch.object(ProcessPoolExecutor, 'submit', side_effect=OSError('нет ресурсов')):
+            report = BatchImport(self.batch_jobs(), processes=1).run()
+        self.assertEqual([feed['error'] for feed in report['feeds']], ['OSError: нет ресурсов'] * 2)
+        self.assertEqual(list(ImportJob.objects.order_by('id').values_list('phase', flat=True)),
+                         ['failed', 'failed'])
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'shop3.yaml'
+            with path.open('w', encoding='utf-8') as stream:
+                write_feed(synthetic_feed(3, goods=20), stream)
+            output = io.StringIO()
+            call_command('import_feeds', f'supplier3={path}', f'supplier1={self.server.url("/shop1.yaml")}',
+                         '--processes', '1', stdout=output)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.suppliers[2]).count(), 20)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.suppliers[0]).count(), 14)
+        self.assertIn('строк: 34', output.getvalue())
+
+
+class BenchmarkTests(TestCase):
+    def test_synthetic_feed_round_trip(self):
+        feed = synthetic_feed(1, categories=3, goods=50, parameters=4)
+        user = User.objects.create_user(username='supplier')
+        for fmt in ('yaml', 'ndjson'):
+            stream = io.StringIO()
+            write_feed(feed, stream, fmt)
+            shop, categories, goods = read_feed([stream.getvalue().encode()], fmt)
+            self.assertEqual((shop, categories, list(goods)), (feed['shop'], feed['categories'], feed['goods']))
+        stats = PriceListImporter(user).run(feed)
+        self.assertEqual(stats['counts']['created'], 50)
+        self.assertEqual(ProductParameter.objects.filter(product_info__shop__user=user).count(), 200)
+        self.assertTrue(ProductParameter.objects.filter(value_num__isnull=False).exists())
+
+    def test_many_categories(self):
+        feed = synthetic_feed(1, categories=12, goods=50)
+        self.assertEqual(len({category['name'] for category in feed['categories']}), 12)
+        stats = PriceListImporter(User.objects.create_user(username='supplier')).run(feed)
+        self.assertEqual(stats['counts']['created'], 50)
+        self.assertEqual(Category.objects.count(), 12)
+
+    def test_shared_products_across_shops(self):
+        names = [{item['name'] for item in synthetic_feed(shop, goods=100)['goods']} for shop in (1, 2)]
+        self.assertTrue(names[0] & names[1])
+
+    def test_compare_with_baseline(self):
+        baseline = {'100': {'catalog': {'seconds': 0.010, 'queries': 2}, 'import': {'seconds': 0.1, 'queries': 50}}}
+        self.assertEqual(compare(baseline, baseline, 0.25), [])
+        results = {'100': {'catalog': {'seconds': 0.012, 'queries': 3}, 'import': {'seconds': 0.2, 'queries': 50}},
+                   '1000': {'catalog': {'seconds': 1, 'queries': 9}}}
+        self.assertEqual(compare(baseline, results, 0.25), ['catalog [100]: запросов 2 -> 3',
+                                                            'import [100]: время 0.1000 -> 0.2000 с'])
+
+
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        category = Category.objects.create(name='Смартфоны')
+        shops = [Shop.objects.create(name=f'Магазин "{i}"/\u2028', user=User.objects.create_user(username=f'shop-{i}'))
+                 for i in range(2)]
+        category.shops.add(*shops)
+        products = [Product.objects.create(name=f'Товар {i}', category=category if i else None) for i in range(4)]
+        infos = [ProductInfo.objects.create(product=product, shop=shops[i % 2], external_id=i, model=f'm/{i}',
+                                            quantity=5, price=100 * (i + 1), price_rrc=100)
+                 for i, product in enumerate(products[:3])]
+        ProductOffer.refresh([product.id for product in products])
+        for status in ('cart', 'confirmed'):
+            order = Order.objects.create(user=self.user, status=status)
+            for info in infos:
+                OrderItem.objects.create(order=order, product_info=info, shop=info.shop, quantity=2)
+        OrderItem.objects.create(order=Order.objects.create(user=None, status='new'), quantity=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rendered(self, serializer_class, queryset, fast: bool, **kwargs) -> bytes:
+        with override_settings(FAST_SERIALIZERS=fast):
+            objects = plan_queryset(queryset, serializer_class, **kwargs)
+            return JSONRenderer().render(serializer_class(objects, many=True, **kwargs).data)
+
+    def test_products_match_drf(self):
+        for fields in (None, ['id', 'name'], ['offer', 'category']):
+            self.assertEqual(self.rendered(ProductSerializer, Product.objects.order_by('id'), True, fields=fields),
+                             self.rendered(ProductSerializer, Product.objects.order_by('id'), False, fields=fields))
+
+    def test_orders_match_drf(self):
+        queryset = Order.objects.order_by('id')
+        self.assertEqual(self.rendered(OrderSerializer, queryset, True),
+                         self.rendered(OrderSerializer, queryset, False))
+        order = Order.objects.get(status='new')
+        with override_settings(FAST_SERIALIZERS=True):
+            data = OrderSerializer(order).data
+        self.assertEqual(data['user'], None)
+        self.assertEqual(data['ordered_items'][0]['product_info'], None)
+        self.assertEqual(data['total'], 0)
+
+    def test_endpoints_match_drf(self):
+        for name in ('products', 'order-list', 'order-cart'):
+            responses = []
+            for fast in (False, True):
+                caches['catalog'].clear()
+                with override_settings(FAST_SERIALIZERS=fast):
+                    responses.append(self.client.get(reverse(name)))
+            self.assertEqual(responses[0].status_code, 200)
+            self.assertEqual(responses[0].content, responses[1].content)
+
+    def test_renderer_bytes(self):
+        data = {'name': 'Товар "1"/\u2028\u2029', 'price': 1.5, 'small': 1e-7, 'big': 2 ** 70,
+                'values': (1, None, True), 'dt': timezone.now(), 'nested': [{'url': 'http://example.com/a'}]}
+        for payload in (data, [data], {key: value for key, value in data.items() if key not in ('small', 'dt')}):
+            self.assertEqual(UJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(UJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(UJSONRenderer().render(None), b'')
+        with self.assertRaises(ValueError):
+            UJSONRenderer().render({'value': float('nan')})
+
+    def test_parser(self):
+        body = json.dumps({'items': [{'id': 1, 'quantity': 2.5}], 'name': 'Товар'}, ensure_ascii=False).encode()
+        self.assertEqual(UJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for body in (b'{"value": NaN}', b'{"value": ', b'\xff'):
+            with self.assertRaises(ParseError) as expected:
+                JSONParser().parse(io.BytesIO(body))
+            with self.assertRaises(ParseError) as actual:
+                UJSONParser().parse(io.BytesIO(body))
+            self.assertEqual(str(actual.exception), str(expected.exception))
+        response = self.client.post(reverse('order-cart-confirm'), '{"address": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
@@ -1,19 +1,37 @@
 from django.urls import path
 
-from backend.views import UserRegistration, PartnerUpdate, UserAuthorization, Products, OrderView, ContactView
+from backend.views import UserRegistration, PartnerUpdate, UserAuthorization, Products, OrderView, ContactView, \
+    ProductFacetSearch, ProductTextSearch, AsyncPartnerUpdate, AsyncUserRegistration, AsyncCartView, \
+    PartnerExport, PartnerOrders, PartnerBatchUpdate
 
 
 urlpatterns = [
     path('auth', UserAuthorization.as_view(), name='authorization'),
     path('register', UserRegistration.as_view(), name='user-register'),
     path('upload', PartnerUpdate.as_view(), name='partner-update'),
+    path('upload/batch', PartnerBatchUpdate.as_view(), name='partner-batch-update'),
+    path('upload/<int:job_id>', PartnerUpdate.as_view(), name='partner-update-status'),
+    path('export', PartnerExport.as_view(), name='partner-export'),
+    path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     path('products', Products.as_view({'get': 'list'}), name='products'),
+    path('products/facets', ProductFacetSearch.as_view(), name='products-facets'),
+    path('products/search', ProductTextSearch.as_view(), name='products-search'),
+    path('products/cache', Products.as_view({'get': 'cache_stats'}), name='products-cache'),
     path('products/<int:pk>', Products.as_view({'get': 'one_product'}), name='product_one'),
     path('order/cart', OrderView.as_view({'get': 'show_cart'}), name='order-cart'),
     path('order/cart/confirm', OrderView.as_view({'post': 'confirm_cart'}), name='order-cart-confirm'),
     path('order', OrderView.as_view({'get': 'list'}), name='order-list'),
+    path('order/export', OrderView.as_view({'get': 'export'}), name='order-export'),
     path('order/add', OrderView.as_view({'post': 'add_products'}), name='add-products'),
+    path('order/cart/set', OrderView.as_view({'post': 'set_products'}), name='set-products'),
     path('order/cart/delete', OrderView.as_view({'post': 'delete_products'}), name='delete-products'),
+    path('async/register', AsyncUserRegistration.as_view(), name='async-user-register'),
+    path('async/upload', AsyncPartnerUpdate.as_view(), name='async-partner-update'),
+    path('async/upload/<int:job_id>', AsyncPartnerUpdate.as_view(), name='async-partner-update-status'),
+    path('async/order/cart', AsyncCartView.as_view(), name='async-order-cart'),
+    path('async/order/add', AsyncCartView.as_view(action='add'), name='async-add-products'),
+    path('async/order/cart/set', AsyncCartView.as_view(action='set'), name='async-set-products'),
+    path('async/order/cart/delete', AsyncCartView.as_view(action='delete'), name='async-delete-products'),
     path('contacts/list', ContactView.as_view({'get': 'list'}), name='contact-list'),
     path('contacts/create', ContactView.as_view({'post': 'create'}), name='contact-create'),
     path('contacts/delete', ContactView.as_view({'delete': 'delete_contact'}), name='contact-delete'),
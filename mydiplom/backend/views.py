@@ -1,34 +1,59 @@
+import base64
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.handlers.wsgi import WSGIRequest
 from django.core.validators import URLValidator
-from django.db.models import QuerySet
-from django.http import JsonResponse
-from django.core.mail import send_mail
+from django.db.models import Exists, OuterRef, F
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.utils.crypto import get_random_string
-from requests import get
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.pagination import CursorPagination
+from rest_framework.authentication import BasicAuthentication
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-import yaml
 from rest_framework.decorators import action
-from backend.serializers import UserSerializer, ProductSerializer, OrderSerializer, ContactSerializer
+from backend.authentication import TokenAuthentication, issue_token, revoke_token, revoke_user_tokens, \
+    token_from_header, alookup_token
+from backend.cache import catalog_cache
+from backend.export import CATALOG_FORMATS, ORDER_FORMATS, iter_catalog, iter_orders
+from backend.facets import search_product_infos
+from backend.importer import PriceListImporter
+from backend.metrics import registry
+from backend.notifications import queue_email
+from backend.orders import InsufficientStock, reserve_stock, CartError, parse_cart_lines, add_to_cart, \
+    remove_from_cart, set_cart_quantities, apply_cart_change, record_shop_lines, SHOP_LINE_FIELDS
+from backend.prefetch import plan_queryset
+from backend.search import get_search_index
+from backend.serializers import UserSerializer, ProductSerializer, OrderSerializer, ContactSerializer, \
+    ImportJobSerializer, ProductInfoSearchSerializer
+from backend.tasks import import_price_list, aimport_price_list, import_price_lists
+
+from backend.models import Shop, ProductInfo, Product, Order, Contact, ImportJob
+
+from backend.models import ProductOffer, ShopOrderLine
 
-from backend.models import Shop, Category, ProductInfo, Product, ProductParameter, Parameter, Order, Contact
+from mydiplom import settings
 
-from backend.models import OrderItem
 
-from mydiplom import settings
+def is_true(value) -> bool:
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
 
 
 class PartnerUpdate(APIView):
     """
     Класс для обновления прайса от поставщика
     """
-    authentication_classes = [BasicAuthentication]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]  # mixin
 
     def post(self, request: WSGIRequest, *args, **kwargs):
@@ -46,54 +71,138 @@ class PartnerUpdate(APIView):
             except ValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                stream = get(url).content
-                data = yaml.safe_load(stream)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=self.request.user.id)
-                for category in data['categories']:
-                    category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_object.shops.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-                    product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'],
-                                                              quantity=item['quantity'],
-                                                              shop_id=shop.id)
-                    for name, value in item['parameters'].items():
-                        parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_object.id,
-                                                        value=value)
-
-                return JsonResponse({'Status': True})
+                mode = self.request.data.get('mode', 'sync')
+                if mode not in PriceListImporter.modes:
+                    return JsonResponse({'Status': False, 'Error': f'Неизвестный режим загрузки: {mode}'})
+                job = ImportJob.objects.create(user=self.request.user, url=url, mode=mode,
+                                               force=is_true(self.request.data.get('force')))
+                import_price_list.delay(job.id)
+                return JsonResponse({'Status': True, 'Job': job.id}, status=status.HTTP_202_ACCEPTED)
 
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
+    def get(self, request: WSGIRequest, job_id: int = None, *args, **kwargs):
+        if job_id is None:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        jobs = ImportJob.objects.all() if self.request.user.is_staff else \
+            ImportJob.objects.filter(user_id=self.request.user.id)
+        job = jobs.filter(id=job_id).first()
+        if job is None:
+            return JsonResponse({'Status': False, 'Error': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'Status': True, 'Job': ImportJobSerializer(job).data})
+
+
+class PartnerBatchUpdate(APIView):
+    """
+    Пакетное обновление прайсов многих поставщиков (для администратора):
+    {"feeds": [{"user": "<username>", "url": "..."}], "mode": "sync"}. Статус - по upload/<id> каждой задачи
+    """
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def post(self, request: WSGIRequest, *args, **kwargs):
+        feeds = request.data.get('feeds')
+        if not isinstance(feeds, list) or not feeds or \
+                any(not isinstance(feed, dict) or not feed.get('user') or not feed.get('url') for feed in feeds):
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        mode = request.data.get('mode', 'sync')
+        if mode not in PriceListImporter.modes:
+            return JsonResponse({'Status': False, 'Error': f'Неизвестный режим загрузки: {mode}'})
+        validate_url = URLValidator()
+        try:
+            for feed in feeds:
+                validate_url(feed['url'])
+        except DjangoValidationError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)})
+        users = User.objects.in_bulk({feed['user'] for feed in feeds}, field_name='username')
+        unknown = sorted({feed['user'] for feed in feeds} - users.keys())
+        if unknown:
+            return JsonResponse({'Status': False, 'Error': f'Пользователи не найдены: {", ".join(unknown)}'})
+        force = is_true(request.data.get('force'))
+        jobs = ImportJob.objects.bulk_create([ImportJob(user=users[feed['user']], url=feed['url'], mode=mode,
+                                                        force=force) for feed in feeds])
+        job_ids = [job.id for job in jobs]
+        import_price_lists.delay(job_ids)
+        return JsonResponse({'Status': True, 'Jobs': job_ids}, status=status.HTTP_202_ACCEPTED)
+
+
+def streaming_export(chunks, content_type: str, filename: str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(chunks, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class PartnerExport(APIView):
+    """
+    Выгрузка прайса магазина в формате загрузки (data/shop1.yaml или NDJSON), потоком
+    """
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: WSGIRequest, *args, **kwargs):
+        fmt = request.query_params.get('type', 'yaml')
+        if fmt not in CATALOG_FORMATS:
+            return JsonResponse({'Status': False, 'Error': f'Неизвестный формат выгрузки: {fmt}'}, status=400)
+        shop = Shop.objects.filter(user=request.user).first()
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=status.HTTP_404_NOT_FOUND)
+        return streaming_export(iter_catalog(shop, fmt), CATALOG_FORMATS[fmt], f'shop{shop.id}.{fmt}')
+
+
+class PartnerOrders(APIView):
+    """
+    Строки подтвержденных заказов с товарами магазина пользователя, по возрастанию id.
+    Опрос: ?since=<Cursor из прошлого ответа> возвращает только новые строки - диапазон индекса (shop, id)
+    """
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+    permission_classes = [IsAuthenticated]
+    default_limit = 100
+    max_limit = 1000
+    fields = ('id', 'order_id', 'product_info_id', 'external_id', 'product_name', 'model', 'quantity', 'price',
+              'total', 'buyer', 'address', 'dt')
+
+    def get(self, request: WSGIRequest, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Error': 'since и limit должны быть числами'}, status=400)
+        shop_id = Shop.objects.filter(user=request.user).values_list('id', flat=True).first()
+        if shop_id is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=status.HTTP_404_NOT_FOUND)
+        lines = list(ShopOrderLine.objects.filter(shop_id=shop_id, id__gt=since).order_by('id')
+                     .values(*self.fields)[:limit + 1])
+        more = len(lines) > limit
+        lines = lines[:limit]
+        return JsonResponse({'Status': True, 'Lines': lines, 'Cursor': lines[-1]['id'] if lines else since,
+                             'More': more})
+
 
 class UserRegistration(APIView):
+    @staticmethod
+    def create_user(serializer: UserSerializer) -> User:
+        """
+        Создает пользователя со случайным паролем и ставит письмо с паролем в очередь
+        """
+        password = get_random_string(length=16)
+        user = serializer.save()
+        user.set_password(password)
+        user.save()
+        queue_email(
+            "Регистрация",
+            f"{user.username}, Вы успешно зарегестрировались на сайте goods.ru!\n"
+            f"Ваш username: {user.username}\n"
+            f"Ваш пароль: {password}",
+            [user.email],
+            settings.EMAIL_HOST_USER,
+        )
+        return user
+
     def post(self, request, *args, **kwargs):
         serializers = UserSerializer(data=request.data)
 
         if serializers.is_valid():
-            password = get_random_string(length=16)
-            user = serializers.save()
-            user.set_password(password)
-            user.save()
-            send_mail(
-                "Регистрация",
-                f"{user.username}, Вы успешно зарегестрировались на сайте goods.ru!\n"
-                f"Ваш username: {user.username}\n"
-                f"Ваш пароль: {password}",
-                settings.EMAIL_HOST_USER,
-                [user.email],
-                fail_silently=False
-            )
+            self.create_user(serializers)
             return Response({
                 'status': 'OK',
                 'message': f'Письмо с паролем было отправлено на почту {request.data.get("email")}'
@@ -101,17 +210,120 @@ class UserRegistration(APIView):
         return Response({'status': 'ERROR', 'errors': serializers.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ProductCursorPagination(CursorPagination):
+    ordering = ('name', 'id')
+    sort_orderings = {
+        'price': ('min_price', 'id'),
+        '-price': ('-min_price', '-id'),
+    }
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        return self.sort_orderings.get(request.query_params.get('sort'), self.ordering)
+
+
 class Products(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+
+    def get_fields(self):
+        fields = self.request.query_params.get('fields')
+        if fields:
+            return [name.strip() for name in fields.split(',') if name.strip()]
+        return None
+
+    def get_filter_id(self, name: str):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        if not value.isdigit():
+            raise ValidationError({name: 'Ожидается числовой идентификатор'})
+        return int(value)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if (category_id := self.get_filter_id('category')) is not None:
+            qs = qs.filter(category_id=category_id)
+        if (shop_id := self.get_filter_id('shop')) is not None:
+            qs = qs.filter(Exists(ProductInfo.objects.filter(product_id=OuterRef('pk'), shop_id=shop_id)))
+        if self.request.query_params.get('sort') in ProductCursorPagination.sort_orderings:
+            qs = qs.filter(offer__isnull=False).annotate(min_price=F('offer__min_price'))
+        return plan_queryset(qs, self.get_serializer_class(), fields=self.get_fields())
+
+    def get_cache_scopes(self) -> list[str]:
+        scopes = ['catalog']
+        if (shop_id := self.get_filter_id('shop')) is not None:
+            scopes.append(f'shop:{shop_id}')
+        return scopes
+
+    def cached_response(self, name: str, build) -> Response:
+        data, hit = catalog_cache.get_or_build(name, self.get_cache_scopes(), self.request.query_params.dict(), build)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response('products', lambda: super(Products, self).list(request, *args, **kwargs).data)
 
     @action(detail=False, methods=['get'], name='one_product')
     def one_product(self, request, *args, **kwargs):
-        return Response(ProductSerializer(self.queryset.filter(id=kwargs['pk']).first()).data)
+        return self.cached_response(
+            f'product:{kwargs["pk"]}',
+            lambda: self.get_serializer(self.get_queryset().filter(id=kwargs['pk']).first()).data
+        )
+
+    @action(detail=False, methods=['get'], name='cache_stats')
+    def cache_stats(self, request, *args, **kwargs):
+        return Response(catalog_cache.stats())
+
+
+class ProductFacetSearch(APIView):
+    """
+    Поиск позиций по значениям параметров с подсчетом фасетов
+    """
+    default_limit = 50
+    max_limit = 500
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается число'})
+        found = search_product_infos(request.query_params.getlist('p'), limit, offset)
+        return Response({
+            'count': found['count'],
+            'results': ProductInfoSearchSerializer(found['results'], many=True).data,
+            'facets': found['facets'],
+        }, status=status.HTTP_200_OK)
+
+
+class ProductTextSearch(APIView):
+    """
+    Полнотекстовый поиск позиций по названию продукта и модели
+    """
+    default_limit = 50
+    max_limit = 500
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается число'})
+        ids = get_search_index().search(request.query_params.get('q', ''), limit)
+        found = ProductInfo.objects.select_related('product', 'shop').in_bulk(ids)
+        return Response({
+            'results': ProductInfoSearchSerializer([found[pk] for pk in ids if pk in found], many=True).data,
+        }, status=status.HTTP_200_OK)
 
 
 class UserAuthorization(APIView):
-    authentication_classes = [BasicAuthentication]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
@@ -121,115 +333,147 @@ class UserAuthorization(APIView):
         }
         return Response(content, status=status.HTTP_200_OK)
 
+    def post(self, request, *args, **kwargs):
+        """
+        Выдает токен для заголовка "Authorization: Token <токен>": пароль проверяется один раз, здесь
+        """
+        key, token = issue_token(request.user)
+        return Response({'token': key, 'expires_at': token.expires_at}, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, *args, **kwargs):
+        """
+        Отзывает текущий токен; при входе по паролю - все токены пользователя
+        """
+        if isinstance(request.successful_authenticator, TokenAuthentication):
+            revoke_token(request.auth)
+            return Response({'message': 'Токен отозван'}, status=status.HTTP_200_OK)
+        count = revoke_user_tokens(request.user)
+        return Response({'message': f'Отозвано токенов: {count}'}, status=status.HTTP_200_OK)
+
+
+class OrderCursorPagination(CursorPagination):
+    ordering = ('-dt', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
 
 class OrderView(ModelViewSet):
-    authentication_classes = [BasicAuthentication]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]
 
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
         qs = self.queryset.filter(user_id=self.request.user.id)
         return qs
 
+    def get_serialized_queryset(self):
+        """
+        Заказы пользователя с загрузкой строк, магазинов и позиций для OrderSerializer
+        """
+        return plan_queryset(self.get_queryset(), OrderSerializer)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_serialized_queryset())
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @action(detail=False, methods=['get'], name='export')
+    def export(self, request: WSGIRequest, *args, **kwargs):
+        """
+        Выгрузка оформленных заказов пользователя в CSV (по строке на позицию) или NDJSON, потоком
+        """
+        fmt = request.query_params.get('type', 'csv')
+        if fmt not in ORDER_FORMATS:
+            return Response({'message': f'Неизвестный формат выгрузки: {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+        orders = self.get_queryset().exclude(status='cart')
+        return streaming_export(iter_orders(orders, fmt), ORDER_FORMATS[fmt], f'orders.{fmt}')
+
     @action(detail=False, methods=['post'], name='confirm_cart')
     def confirm_cart(self, request: WSGIRequest, *args, **kwargs):
         address = request.data.get('address', None)
         if not address:
             return Response({"message": "обязательно укажите поле \"address\" для создания заказа"},
                             status=status.HTTP_400_BAD_REQUEST)
-        elif not (address := Contact.objects.filter(user=self.request.user, type=address)).exists():
+        elif (address := Contact.objects.filter(user=self.request.user, type=address)
+                .values_list('value', flat=True).first()) is None:
             return Response({"message": "Указанный Вами адрес не существует"},
                             status=status.HTTP_400_BAD_REQUEST)
-        qs: QuerySet = self.get_queryset().filter(status='cart')
-        if len(qs) == 0:
-            return Response({'message': 'Ваша корзина пуста'}, status=status.HTTP_200_OK)
-
-        orders_text = []
-
-        cart: Order = qs.first()
-        cart.status = 'confirmed'
-        for oi in cart.ordered_items.all():
-            orders_text.append(f"Товар {oi.product_info.name} ({oi.quantity} шт.)")
-            oi.product_info.quantity -= oi.quantity
-            oi.product_info.save()
-        cart.save()
-
+        try:
+            with transaction.atomic():
+                cart: Order = self.get_queryset().select_for_update().filter(status='cart').first()
+                if cart is None:
+                    return Response({'message': 'Ваша корзина пуста'}, status=status.HTTP_200_OK)
+                lines = list(cart.ordered_items.filter(product_info__isnull=False).values(
+                    *SHOP_LINE_FIELDS, 'product_info__name', 'product_info__product_id'))
+                reserve_stock(lines)
+                cart.status = 'confirmed'
+                cart.save(update_fields=['status'])
+                record_shop_lines(lines, request.user.username, address)
+                if ProductOffer.refresh({line['product_info__product_id'] for line in lines}):
+                    # заказ меняет только остатки: сбрасываются страницы магазинов, у которых они списаны,
+                    # а общий каталог (total_quantity в сводках) обновится по CATALOG_CACHE_TIMEOUT
+                    scopes = sorted({f'shop:{line["product_info__shop_id"]}' for line in lines})
+                    transaction.on_commit(lambda: catalog_cache.invalidate(*scopes))
+        except InsufficientStock as e:
+            return Response({'message': 'Недостаточно товара на складе', 'items': e.shortages()},
+                            status=status.HTTP_409_CONFLICT)
+
+        orders_text = [f"Товар {line['product_info__name']} ({line['quantity']} шт.)" for line in lines]
         t = '\n'.join(orders_text)
-        send_mail(
+        queue_email(
             "Подтверждение заказа",
             f"{request.user.username}, Ваш заказ успешно создан!\n"
             f"{t}",
-            settings.EMAIL_HOST_USER,
             [request.user.email],
-            fail_silently=False
+            settings.EMAIL_HOST_USER,
         )
 
         return Response({'message': 'Ваш заказ успешно создан!'}, status=status.HTTP_201_CREATED)
 
+    def change_cart(self, change, lines: dict, message: str, create: bool = False) -> Response:
+        cart = apply_cart_change(self.request.user, change, lines, create)
+        if cart is None:
+            return Response({'message': 'Ваша корзина пуста'}, status=status.HTTP_200_OK)
+        cart = self.get_serialized_queryset().get(id=cart.id)
+        return Response({'message': message, 'cart': OrderSerializer(cart).data}, status=status.HTTP_200_OK)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CartError):
+            return Response({'message': str(exc)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return super().handle_exception(exc)
+
     @action(detail=False, methods=['post'], name='delete_products')
     def delete_products(self, request: WSGIRequest, *args, **kwargs):
-        qs: QuerySet = self.get_queryset().filter(status='cart')
-        if len(qs) == 0:
-            return Response({'message': 'Ваша корзина пуста'}, status=status.HTTP_200_OK)
-        cart: Order = qs.first()
-        order_items: list[dict] = request.data.get('order_items', [])
-        for oi in order_items:
-            if 'product_id' not in oi.keys() or \
-                    'quantity' not in oi.keys():
-                return Response({'message': 'Неверный формат входных данных'},
-                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-
-            cart_item = cart.ordered_items.filter(product_info_id=oi.get('product_id'))
-            if len(cart_item) > 0:
-                item = cart_item.first()
-                item.quantity -= oi.get('quantity', 0)
-                if item.quantity <= 0:
-                    item.delete()
-                else:
-                    item.save()
-        return Response({'message': f'{len(order_items)} товаров было удалено из корзины'},
-                        status=status.HTTP_200_OK)
+        order_items = request.data.get('order_items', [])
+        lines = parse_cart_lines(order_items, 'product_id')
+        return self.change_cart(remove_from_cart, lines, f'{len(order_items)} товаров было удалено из корзины')
+
+    @action(detail=False, methods=['post'], name='set_products')
+    def set_products(self, request: WSGIRequest, *args, **kwargs):
+        order_items = request.data.get('order_items', [])
+        lines = parse_cart_lines(order_items, 'id', min_quantity=0)
+        return self.change_cart(set_cart_quantities, lines, f'{len(lines)} позиций корзины обновлено', create=True)
 
     @action(detail=False, methods=['get'], name='show_cart')
     def show_cart(self, request: WSGIRequest, *args, **kwargs):
-        qs: QuerySet = self.get_queryset().filter(status='cart')
-        if len(qs) == 0:
+        cart = self.get_serialized_queryset().filter(status='cart').first()
+        if cart is None:
             return Response({'message': 'Ваша корзина пуста'}, status=status.HTTP_200_OK)
-        return Response(OrderSerializer(qs.first()).data, status=status.HTTP_200_OK)
+        return Response(OrderSerializer(cart).data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'], name='add_products')
     def add_products(self, request: WSGIRequest, *args, **kwargs):
-        qs: QuerySet = self.get_queryset()
-        if len(qs) == 0 or len(cart := qs.filter(status='cart')) == 0:
-            order = Order(
-                status='cart',
-                user=self.request.user
-            )
-            order.save()
-        else:
-            order = cart.first()
-
-        product_infos: list[dict] = request.data.get('product_info_ids', [])
-        for product_info in product_infos:
-            if 'id' not in product_info.keys() or \
-                    'quantity' not in product_info.keys() or \
-                    'shop_id' not in product_info.keys():
-                return Response({'message': 'Неверный формат входных данных'},
-                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-            OrderItem(
-                order=order,
-                quantity=product_info.get('quantity', 0),
-                product_info_id=product_info.get('id', None),
-                shop_id=product_info.get('shop_id', 0),
-            ).save()
-        return Response({'message': f'{len(product_infos)} товаров было добавлено в корзину'},
-                        status=status.HTTP_200_OK)
+        product_infos = request.data.get('product_info_ids', [])
+        lines = parse_cart_lines(product_infos, 'id', shop_key='shop_id')
+        return self.change_cart(add_to_cart, lines, f'{len(product_infos)} товаров было добавлено в корзину',
+                                create=True)
 
 
 class ContactView(ModelViewSet):
-    authentication_classes = [BasicAuthentication]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]
 
     queryset = Contact.objects.all()
@@ -242,6 +486,8 @@ class ContactView(ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer: ContactSerializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
+            if self.get_queryset().filter(**serializer.validated_data).exists():
+                return Response({'message': 'Такой контакт уже есть'}, status=status.HTTP_400_BAD_REQUEST)
             self.perform_create(serializer)
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -261,3 +507,152 @@ class ContactView(ModelViewSet):
             obj.delete()
             return Response({"message": "Контакт был удален"}, status=status.HTTP_200_OK)
         return Response({"message": "Такого контакта нет"}, status=status.HTTP_404_NOT_FOUND)
+
+
+async def aauthenticate_request(request) -> User | None:
+    """
+    Токен или HTTP Basic для асинхронных представлений; проверка пароля выполняется бэкендом в потоке
+    """
+    header = request.headers.get('Authorization', '')
+    if (key := token_from_header(header)) is not None:
+        return await alookup_token(key)
+    scheme, _, credentials = header.partition(' ')
+    if scheme.lower() != 'basic' or not credentials:
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode().partition(':')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    user = await aauthenticate(request, username=username, password=password)
+    return user if user is not None and user.is_active else None
+
+
+class AsyncAPIView(View):
+    """
+    Базовое асинхронное представление: токен или HTTP Basic, тело JSON или формы, ответы JsonResponse.
+    Все обработчики методов должны быть async
+    """
+    login_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await aauthenticate_request(request)
+        if self.login_required and request.user is None:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+        try:
+            request.data = json.loads(request.body or b'{}') if request.content_type == 'application/json' \
+                else request.POST.dict()
+        except ValueError:
+            return JsonResponse({'Status': False, 'Error': 'Неверный формат входных данных'}, status=400)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncPartnerUpdate(AsyncAPIView):
+    """
+    Асинхронный вариант PartnerUpdate: без брокера Celery (CELERY_TASK_ALWAYS_EAGER) прайс скачивается
+    асинхронным HTTP-клиентом, и поток сервера не ждет удаленный сервер. С брокером (docker-compose) задача
+    только ставится в очередь, как в PartnerUpdate, и воркер скачивает прайс обычным блокирующим клиентом requests
+    """
+
+    async def post(self, request, *args, **kwargs):
+        url = request.data.get('url')
+        if not url:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        try:
+            URLValidator()(url)
+        except DjangoValidationError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)})
+        mode = request.data.get('mode', 'sync')
+        if mode not in PriceListImporter.modes:
+            return JsonResponse({'Status': False, 'Error': f'Неизвестный режим загрузки: {mode}'})
+        job = await ImportJob.objects.acreate(user=request.user, url=url, mode=mode,
+                                              force=is_true(request.data.get('force')))
+        if import_price_list.app.conf.task_always_eager:
+            await aimport_price_list(job.id)
+        else:
+            await sync_to_async(import_price_list.delay)(job.id)
+        return JsonResponse({'Status': True, 'Job': job.id}, status=status.HTTP_202_ACCEPTED)
+
+    async def get(self, request, job_id: int = None, *args, **kwargs):
+        if job_id is None:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        job = await ImportJob.objects.filter(id=job_id, user_id=request.user.id).afirst()
+        if job is None:
+            return JsonResponse({'Status': False, 'Error': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({'Status': True, 'Job': ImportJobSerializer(job).data})
+
+
+class AsyncUserRegistration(AsyncAPIView):
+    login_required = False
+
+    async def post(self, request, *args, **kwargs):
+        serializer = UserSerializer(data=request.data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse({'status': 'ERROR', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        # хеширование пароля и запись письма в очередь — в потоке, цикл событий не блокируется
+        await sync_to_async(UserRegistration.create_user)(serializer)
+        return JsonResponse({
+            'status': 'OK',
+            'message': f'Письмо с паролем было отправлено на почту {request.data.get("email")}'
+        }, status=status.HTTP_201_CREATED)
+
+
+class AsyncCartView(AsyncAPIView):
+    """
+    Асинхронные варианты действий с корзиной. action: show (GET), add, set, delete (POST).
+    Чтение идет через асинхронный ORM, изменения — транзакцией в потоке через sync_to_async
+    """
+    action = 'show'
+    changes = {
+        # action: (ключ списка в запросе, поле id, минимальное количество, поле магазина, изменение, создать корзину)
+        'add': ('product_info_ids', 'id', 1, 'shop_id', add_to_cart, True),
+        'set': ('order_items', 'id', 0, None, set_cart_quantities, True),
+        'delete': ('order_items', 'product_id', 1, None, remove_from_cart, False),
+    }
+    messages = {
+        'add': '{} товаров было добавлено в корзину',
+        'set': '{} позиций корзины обновлено',
+        'delete': '{} товаров было удалено из корзины',
+    }
+
+    @staticmethod
+    async def serialized_cart(user_id: int, **filters) -> dict | None:
+        queryset = plan_queryset(Order.objects.filter(user_id=user_id, **filters), OrderSerializer)
+        cart = await queryset.afirst()
+        return None if cart is None else OrderSerializer(cart).data
+
+    async def get(self, request, *args, **kwargs):
+        if self.action != 'show':
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        cart = await self.serialized_cart(request.user.id, status='cart')
+        if cart is None:
+            return JsonResponse({'message': 'Ваша корзина пуста'})
+        return JsonResponse(cart)
+
+    async def post(self, request, *args, **kwargs):
+        if self.action not in self.changes:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        key, id_key, min_quantity, shop_key, change, create = self.changes[self.action]
+        items = request.data.get(key, [])
+        try:
+            lines = parse_cart_lines(items, id_key, min_quantity=min_quantity, shop_key=shop_key)
+            cart = await sync_to_async(apply_cart_change)(request.user, change, lines, create)
+        except CartError as e:
+            return JsonResponse({'message': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if cart is None:
+            return JsonResponse({'message': 'Ваша корзина пуста'})
+        count = len(lines) if self.action == 'set' else len(items)
+        return JsonResponse({'message': self.messages[self.action].format(count),
+                             'cart': await self.serialized_cart(request.user.id, id=cart.id)})
+
+
+class MetricsView(View):
+    """
+    Метрики процесса в текстовом формате Prometheus (собираются при METRICS_ENABLED)
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,15 @@
+"""
+Celery config for mydiplom project.
+
+Tasks are discovered in the ``tasks`` modules of installed apps.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mydiplom.settings')
+
+app = Celery('mydiplom')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,12 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'mydiplom.urls'
 
+# Метрики запросов (/metrics в формате Prometheus): выключены — middleware исключается из цепочки
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'False') == 'True'
+# столько одинаковых по форме SQL-запросов за один HTTP-запрос считаются признаком N+1
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -72,21 +80,127 @@ WSGI_APPLICATION = 'mydiplom.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'backend.authentication.TokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-    ]
+    ],
+    # ujson вместо json: вывод байт в байт совпадает со стандартным JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.UJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'backend.renderers.UJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# ProductSerializer, OrderSerializer и OrderItemSerializer выводят объекты заранее собранными функциями
+# чтения полей (backend/compiled.py); False - обычный to_representation DRF
+FAST_SERIALIZERS = os.environ.get('FAST_SERIALIZERS', 'True') == 'True'
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'mydiplom'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # постоянные соединения с проверкой перед каждым запросом вместо нового подключения на запрос
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # пул psycopg: соединения переиспользуются между потоками, CONN_MAX_AGE должен быть 0
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # BEGIN IMMEDIATE: транзакция сразу берет блокировку записи и ждет ее до timeout,
+                # вместо ошибки "database is locked" при повышении блокировки
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                # WAL: чтение каталога не ждет записи импорта; synchronous=NORMAL в WAL не теряет целостность,
+                # но не делает fsync на каждый коммит
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA busy_timeout=20000; '
+                                'PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456',
+            },
+            'TEST': {
+                # файл вместо общей памяти: параллельные тесты подтверждения заказов ждут блокировку, а не падают
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+
+# новые позиции прайса от этого размера пакета пишутся в PostgreSQL через COPY
+IMPORT_COPY_THRESHOLD = int(os.environ.get('IMPORT_COPY_THRESHOLD', 500))
+
+
+# Cache
+# Кэш каталога и версий его областей должен быть общим для веб-процессов и воркера Celery, иначе сброс после
+# импорта или заказа виден только процессу, который его сделал: CATALOG_CACHE_URL - Redis, CATALOG_CACHE_DIR -
+# файловый backend. Без них - память процесса (LRU по MAX_ENTRIES), годится для тестов и одного процесса
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache' if os.environ.get('CATALOG_CACHE_URL')
+        else 'django.core.cache.backends.filebased.FileBasedCache' if os.environ.get('CATALOG_CACHE_DIR')
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.environ.get('CATALOG_CACHE_URL') or os.environ.get('CATALOG_CACHE_DIR', 'catalog'),
+        'TIMEOUT': int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300)),
+        # Redis вытесняет записи сам (maxmemory-policy), OPTIONS ушли бы в параметры соединения
+        'OPTIONS': {} if os.environ.get('CATALOG_CACHE_URL') else {
+            'MAX_ENTRIES': int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # токен -> пользователь; с AUTH_CACHE_URL (Redis) отзыв токена и изменение пользователя сразу видны всем
+    # процессам, иначе другие процессы узнают о них не позже AUTH_TOKEN_CACHE_TIMEOUT
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache' if os.environ.get('AUTH_CACHE_URL')
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.environ.get('AUTH_CACHE_URL', 'auth'),
+    },
+    # прогресс импорта пишет воркер Celery, а читает веб-процесс: с отдельным воркером нужен общий Redis
+    'progress': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache' if os.environ.get('PROGRESS_CACHE_URL')
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.environ.get('PROGRESS_CACHE_URL', 'progress'),
+    },
 }
 
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 7 * 24 * 60 * 60))
+# без общего кэша это окно, в течение которого отозванный токен или деактивированный пользователь
+# еще принимаются другими процессами, поэтому по умолчанию оно короткое
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 300 if os.environ.get('AUTH_CACHE_URL')
+                                              else 5))
+
+
+# Search
+# auto - SQLite FTS5, если доступен, иначе инвертированный индекс в памяти процесса; также fts5 | memory
+
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -139,3 +253,27 @@ EMAIL_HOST_PASSWORD = 'uectfbhqgpryqacm'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
+EMAIL_TIMEOUT = 10
+
+# Очередь писем: пакет за одно SMTP-соединение, задержка для склейки всплесков, повторы с экспоненциальной паузой
+EMAIL_BATCH_SIZE = 50
+EMAIL_BATCH_DELAY = 2
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = 30
+EMAIL_CLAIM_TIMEOUT = 300
+# периодический разбор очереди: письма, отложенные после ошибки, уходят и без новых писем
+EMAIL_FLUSH_INTERVAL = int(os.environ.get('EMAIL_FLUSH_INTERVAL', 60))
+
+# Celery
+# Без внешнего брокера задачи выполняются синхронно в процессе (локальный запуск и тесты)
+
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'True') == 'True'
+CELERY_TASK_IGNORE_RESULT = True
+# воркер запускается с -B (docker-compose); без брокера то же делает cron: manage.py flush_outbox
+CELERY_BEAT_SCHEDULE = {
+    'flush-outbox': {
+        'task': 'backend.tasks.send_queued_emails',
+        'schedule': EMAIL_FLUSH_INTERVAL,
+    },
+}
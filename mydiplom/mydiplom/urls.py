@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from backend.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('api/v1/', include('backend.urls')),
 ]